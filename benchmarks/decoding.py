@@ -0,0 +1,103 @@
+"""compare the decoding indexes of `icdcodex.decoding` with the sklearn nearest neighbor search
+
+Undirected embeddings of the packaged ICD-9 hierarchy are fit (or loaded from the embedding
+registry), and noisy copies of the embeddings of random codes are decoded. The noise is
+relative to the mean norm of the embeddings. Recall is measured against exact search with
+the same metric.
+
+    python benchmarks/decoding.py --queries 20000 --dimensions 128
+"""
+
+import argparse
+import os
+import resource
+import tempfile
+import time
+import numpy as np
+from icdcodex import hierarchy
+from icdcodex.decoding import ExactIndex, IVFIndex, TreeIndex
+from icdcodex.icd2vec import Icd2Vec
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def recall(rows, expected):
+    k = expected.shape[1]
+    return np.mean([len(set(a) & set(b)) / k for a, b in zip(rows.tolist(), expected.tolist())])
+
+
+def report(name, seconds, n, rows=None, expected=None):
+    line = f"{name:<32} {n / seconds:>12,.0f} queries/s"
+    if rows is not None:
+        line += f"   recall@{expected.shape[1]} {recall(rows, expected):.3f}"
+    print(line)
+
+
+def main(num_queries, dimensions, k, noise, seed):
+    tree, _ = hierarchy.icd9(as_networkx=False)
+    model = Icd2Vec(num_embedding_dimensions=dimensions, directed=False, seed=seed).fit_or_load(tree)
+    rng = np.random.default_rng(seed)
+    targets = rng.integers(0, len(model.icd_codes), num_queries)
+    scale = noise * np.linalg.norm(model.embeddings, axis=1).mean() / np.sqrt(dimensions)
+    queries = model.embeddings[targets] + scale * rng.standard_normal((num_queries, dimensions)).astype(np.float32)
+    print(f"{len(model.icd_codes)} codes, {dimensions} dimensions, {num_queries} queries, k={k}\n")
+
+    from sklearn.neighbors import NearestNeighbors
+
+    nn = NearestNeighbors(n_neighbors=k).fit(model.embeddings)
+    (_, sklearn_rows), seconds = timed(lambda: nn.kneighbors(queries))
+    report("sklearn NearestNeighbors", seconds, num_queries)
+
+    euclidean = ExactIndex("euclidean").fit(model.embeddings)
+    (_, rows), seconds = timed(lambda: euclidean.search(queries, k))
+    report("ExactIndex euclidean", seconds, num_queries, rows, sklearn_rows)
+
+    cosine = ExactIndex("cosine").fit(model.embeddings)
+    (_, exact), seconds = timed(lambda: cosine.search(queries, k))
+    report("ExactIndex cosine", seconds, num_queries)
+
+    # constrain each query to the chapter of the code it was made from
+    code_ids = tree.ids(model.icd_codes)
+    chapters = np.array([tree.ancestors(i)[-2] for i in code_ids[targets].tolist()])
+    tree_index = TreeIndex(tree, model.icd_codes).fit(model.embeddings)
+    (_, rows), seconds = timed(lambda: tree_index.search(queries, k, within=chapters))
+    report("TreeIndex cosine, within chapter", seconds, num_queries, rows, exact)
+
+    ivf, seconds = timed(lambda: IVFIndex(seed=seed).fit(model.embeddings))
+    print(f"\nIVFIndex: {len(ivf.centroids)} lists, built in {seconds:.2f}s")
+    for n_probe in (1, 2, 4, 8, 16, 32, 64):
+        ivf.n_probe = n_probe
+        (_, rows), seconds = timed(lambda: ivf.search(queries, k))
+        report(f"IVFIndex cosine, n_probe={n_probe}", seconds, num_queries, rows, exact)
+
+    # bulk decoding of a memory-mapped array, 10x the queries above
+    with tempfile.TemporaryDirectory() as tmp:
+        bulk = np.lib.format.open_memmap(
+            os.path.join(tmp, "queries.npy"), mode="w+", dtype=np.float32, shape=(10 * num_queries, dimensions)
+        )
+        for start in range(0, len(bulk), num_queries):
+            bulk[start:start + num_queries] = queries
+        bulk.flush()
+        bulk = np.load(os.path.join(tmp, "queries.npy"), mmap_mode="r")
+        print(f"\nIcd2Vec.decode of a {len(bulk)} x {dimensions} memmap, 64 MiB memory limit")
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        for workers in sorted({1, 2, os.cpu_count() or 1}):
+            _, seconds = timed(lambda: model.decode(bulk, workers=workers, memory_limit=64 << 20))
+            report(f"workers={workers}", seconds, len(bulk))
+        growth = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024
+        print(f"peak RSS growth {growth:.0f} MiB (including the page cache of the memmap)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", type=int, default=20000)
+    parser.add_argument("--dimensions", type=int, default=128)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--noise", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    main(args.queries, args.dimensions, args.k, args.noise, args.seed)
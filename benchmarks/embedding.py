@@ -0,0 +1,58 @@
+"""compare the closed-form SVD embeddings of `Icd2Vec(method="svd")` with node2vec ones
+
+Both are fit on the packaged ICD-9 hierarchy (node2vec with undirected walks, as in
+`benchmarks/decoding.py`) and evaluated on how well they reflect the hierarchy: the fraction
+of codes that decode back to themselves, the fraction whose nearest other code is a sibling,
+and the rank correlation between the cosine similarity of random pairs of codes and the depth
+of their lowest common ancestor.
+
+    python benchmarks/embedding.py --dimensions 128 --pairs 20000
+"""
+
+import argparse
+import time
+import numpy as np
+from scipy.stats import spearmanr
+from icdcodex import hierarchy
+from icdcodex.ancestry import AncestryIndex
+from icdcodex.decoding import ExactIndex
+from icdcodex.icd2vec import Icd2Vec
+
+
+def evaluate(name, model, tree, seconds, num_pairs, seed):
+    embeddings = model.embeddings
+    code_ids = tree.ids(model.icd_codes)
+    parents = np.asarray(tree.parent_ids)[code_ids]
+    _, rows = ExactIndex("euclidean").fit(embeddings).search(embeddings, k=2)
+    self_accuracy = np.mean(rows[:, 0] == np.arange(len(rows)))
+    nearest = np.where(rows[:, 0] == np.arange(len(rows)), rows[:, 1], rows[:, 0])
+    siblings = np.mean(parents[nearest] == parents)
+    rng = np.random.default_rng(seed)
+    a, b = rng.integers(0, len(code_ids), (2, num_pairs))
+    normalized = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    similarity = (normalized[a] * normalized[b]).sum(axis=1)
+    lca_depths = np.asarray(tree.depths)[AncestryIndex(tree).lca(code_ids[a], code_ids[b])]
+    correlation = spearmanr(similarity, lca_depths).correlation
+    print(
+        f"{name:<10} {seconds:>8.1f}s   self-decoding {self_accuracy:.3f}   "
+        f"nearest is a sibling {siblings:.3f}   spearman(cosine, lca depth) {correlation:.3f}"
+    )
+
+
+def main(dimensions, num_pairs, seed):
+    tree, _ = hierarchy.icd9(as_networkx=False)
+    print(f"{len(tree.codes)} codes, {dimensions} dimensions, {num_pairs} random pairs\n")
+    for name, params in (("svd", {"method": "svd"}), ("node2vec", {"directed": False})):
+        model = Icd2Vec(num_embedding_dimensions=dimensions, seed=seed, **params)
+        start = time.perf_counter()
+        model.fit(tree)
+        evaluate(name, model, tree, time.perf_counter() - start, num_pairs, seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dimensions", type=int, default=128)
+    parser.add_argument("--pairs", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    main(args.dimensions, args.pairs, args.seed)
@@ -2,6 +2,18 @@ __author__ = """Jeremy Fisher"""
 __email__ = "jeremyf@cmu.edu"
 __version__ = "__version__ = '0.5.1'"
 
-from . import hierarchy, icd2vec
+import importlib
 
-__all__ = [hierarchy, icd2vec]
+# submodules are imported on first attribute access (PEP 562), so that `import icdcodex`
+# does not pay for networkx, node2vec/gensim, scikit-learn or pandas until they are used
+__all__ = ["datacleaning", "hierarchy", "icd2vec", "tree"]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
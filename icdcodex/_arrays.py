@@ -0,0 +1,97 @@
+"""serialize named numpy arrays into a single file that can be memory-mapped
+
+The layout is a fixed-size preamble (magic, format version, header length), a
+JSON header describing every array (dtype, shape and offset) and free-form
+metadata, followed by the raw array buffers aligned to 64 bytes. Loading with
+``mmap=True`` maps the file read-only, so processes that load the same file
+share its pages.
+"""
+
+from typing import Any, Dict, Optional, Tuple
+import json
+import mmap as mmap_
+import os
+import struct
+import tempfile
+from pathlib import Path
+import numpy as np
+
+MAGIC = b"ICDCODEX"
+FORMAT_VERSION = 1
+_PREAMBLE = struct.Struct("<8sII")
+_ALIGNMENT = 64
+
+
+def _align(offset: int) -> int:
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def dump(fp, kind: str, arrays: Dict[str, np.ndarray], meta: Optional[Dict[str, Any]] = None):
+    """write arrays to `fp`, replacing it atomically
+
+    Args:
+        fp (Pathlike): destination file
+        kind (str): what the file holds (e.g., "IcdTree"), checked when loading
+        arrays (Dict[str, np.ndarray]): arrays to store
+        meta (Dict[str, Any], optional): JSON-serializable metadata. Defaults to None.
+    """
+    arrays = {name: np.ascontiguousarray(arr) for name, arr in arrays.items()}
+    entries, offset = {}, 0
+    for name, arr in arrays.items():
+        offset = _align(offset)
+        entries[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        offset += arr.nbytes
+    header = json.dumps({"kind": kind, "meta": meta or {}, "arrays": entries}).encode()
+    data_start = _align(_PREAMBLE.size + len(header))
+    fp = Path(fp)
+    fd, tmp_fp = tempfile.mkstemp(dir=fp.parent, prefix=fp.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)))
+            f.write(header)
+            for name, arr in arrays.items():
+                f.seek(data_start + entries[name]["offset"])
+                f.write(arr.tobytes())
+            f.truncate(data_start + offset)
+        os.chmod(tmp_fp, 0o644)  # mkstemp creates files only the owner can read
+        os.replace(tmp_fp, fp)
+    except BaseException:
+        os.unlink(tmp_fp)
+        raise
+
+
+def load(fp, kind: str, mmap: bool = True) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """read arrays written by `dump`
+
+    Args:
+        fp (Pathlike): file written by `dump`
+        kind (str): expected kind of the file
+        mmap (bool): If True, memory-map the file instead of reading it. Defaults to True.
+
+    Raises:
+        ValueError: If `fp` is not an array file of the expected kind
+
+    Returns:
+        Tuple[Dict[str, np.ndarray], Dict[str, Any]]: read-only arrays and metadata
+    """
+    with open(fp, "rb") as f:
+        magic, version, header_len = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{fp} is not an icdcodex array file (version {FORMAT_VERSION})")
+        header = json.loads(f.read(header_len))
+        if header["kind"] != kind:
+            raise ValueError(f"{fp} holds a {header['kind']}, not a {kind}")
+        if mmap:
+            buffer = mmap_.mmap(f.fileno(), 0, access=mmap_.ACCESS_READ)
+        else:
+            f.seek(0)
+            buffer = f.read()
+    data_start = _align(_PREAMBLE.size + header_len)
+    arrays = {}
+    for name, entry in header["arrays"].items():
+        dtype = np.dtype(entry["dtype"])
+        shape = tuple(entry["shape"])
+        arrays[name] = np.frombuffer(
+            buffer, dtype=dtype, count=int(np.prod(shape, dtype=np.int64)), offset=data_start + entry["offset"]
+        ).reshape(shape)
+    return arrays, header["meta"]
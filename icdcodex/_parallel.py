@@ -0,0 +1,53 @@
+"""helpers to run numpy-heavy work on a thread pool (numpy releases the GIL in its inner loops),
+or on a process pool for work that holds the GIL"""
+
+from typing import Callable, Iterable, Iterator, Optional, TypeVar
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import os
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def resolve_workers(workers: int) -> int:
+    """number of threads to use, where -1 means one per CPU"""
+    if workers == -1:
+        return os.cpu_count() or 1
+    return max(1, workers)
+
+
+def imap(
+    fn: Callable[[T], R],
+    items: Iterable[T],
+    workers: int = 1,
+    processes: bool = False,
+    initializer: Optional[Callable] = None,
+    initargs: tuple = (),
+) -> Iterator[R]:
+    """lazily map `fn` over `items` on a thread pool, yielding results in order
+
+    At most 2 * `workers` items are in flight at once, so memory stays bounded even if
+    `items` is a long generator or the consumer is slow.
+
+    If `processes` is True, use a process pool instead, whose workers each run
+    `initializer(*initargs)` first. `fn` and `items` must then be picklable.
+    """
+    workers = resolve_workers(workers)
+    if workers == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        yield from map(fn, items)
+        return
+    if processes:
+        pool = ProcessPoolExecutor(workers, initializer=initializer, initargs=initargs)
+    else:
+        pool = ThreadPoolExecutor(workers, initializer=initializer, initargs=initargs)
+    with pool as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
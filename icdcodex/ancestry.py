@@ -0,0 +1,117 @@
+"""constant-time ancestor, descendant and lowest common ancestor queries over an ICD hierarchy"""
+
+from typing import TYPE_CHECKING, Sequence, Union
+import numpy as np
+from .tree import IcdTree
+
+if TYPE_CHECKING:
+    import networkx as nx
+
+Nodes = Union[Sequence[str], np.ndarray]
+
+
+class AncestryIndex:
+    """index an ICD hierarchy once to answer ancestry queries in O(1) each
+
+    `IcdTree` numbers nodes in depth-first preorder, so node ids double as Euler-tour
+    entry times: node `u` is a descendant of `a` iff `a <= u < a + subtree_sizes[a]`.
+    The lowest common ancestor of `u < v` is the parent of the shallowest node with an id
+    in `(u, v]`, which a sparse table answers with two lookups.
+
+    Every query is vectorized: it accepts arrays of node ids (any integer dtype) or of node
+    names, and broadcasts its arguments like a numpy ufunc. Looking up names is a python loop,
+    so encode large arrays of codes once with `encoding.CodeEncoder` and pass the ids instead.
+
+    Args:
+        tree (Union[IcdTree, nx.DiGraph]): ICD hierarchy
+    """
+
+    def __init__(self, tree: Union[IcdTree, "nx.DiGraph"]):
+        if not isinstance(tree, IcdTree):
+            tree = IcdTree.from_networkx(tree, [])
+        self.tree = tree
+        n = len(tree)
+        depths = np.asarray(tree.depths)
+        # sparse table: the shallowest node among ids [i, i + 2**k)
+        table = np.zeros((max(1, n.bit_length()), n), dtype=np.int32)
+        table[0] = np.arange(n)
+        for k in range(1, len(table)):
+            half, width = 1 << (k - 1), n - (1 << k) + 1
+            left, right = table[k - 1, :width], table[k - 1, half:half + width]
+            table[k, :width] = np.where(depths[left] <= depths[right], left, right)
+        self._table = table
+        self._log2 = np.zeros(n + 1, dtype=np.int8)
+        self._log2[2:] = np.floor(np.log2(np.arange(2, n + 1)))
+        # ancestors at every depth, -1 below the node's own depth
+        max_depth = int(depths.max())
+        ancestors = np.full((max_depth + 1, n), -1, dtype=np.int32)
+        ancestors[0, 0] = 0
+        for depth in range(1, max_depth + 1):
+            at_depth = np.flatnonzero(depths == depth)
+            ancestors[:depth, at_depth] = ancestors[:depth, tree.parent_ids[at_depth]]
+            ancestors[depth, at_depth] = at_depth
+        self._ancestors = ancestors
+
+    def ids(self, nodes: Nodes) -> np.ndarray:
+        """node ids, passing integer arrays through and looking up names otherwise"""
+        nodes = np.asarray(nodes)
+        if nodes.dtype.kind in "iu":
+            return nodes
+        return self.tree.ids(nodes.ravel()).reshape(nodes.shape)
+
+    def depth(self, nodes: Nodes) -> np.ndarray:
+        """number of edges between each node and the root"""
+        return np.asarray(self.tree.depths)[self.ids(nodes)]
+
+    def is_descendant(self, nodes: Nodes, ancestors: Nodes, strict: bool = False) -> np.ndarray:
+        """test whether each node lies under the corresponding ancestor (e.g. chapter or section)
+
+        Args:
+            nodes (Nodes): nodes to test
+            ancestors (Nodes): candidate ancestors, broadcast against `nodes`
+            strict (bool): If True, a node is not its own descendant. Defaults to False.
+
+        Returns:
+            np.ndarray: boolean mask
+        """
+        nodes, ancestors = self.ids(nodes), self.ids(ancestors)
+        lower = ancestors + 1 if strict else ancestors
+        return (lower <= nodes) & (nodes < ancestors + np.asarray(self.tree.subtree_sizes)[ancestors])
+
+    def lca(self, a: Nodes, b: Nodes) -> np.ndarray:
+        """lowest common ancestors of pairs of nodes
+
+        Args:
+            a (Nodes): first node of each pair
+            b (Nodes): second node of each pair, broadcast against `a`
+
+        Returns:
+            np.ndarray: node ids of the lowest common ancestors
+        """
+        a, b = np.broadcast_arrays(self.ids(a), self.ids(b))
+        lo, hi = np.minimum(a, b), np.maximum(a, b)
+        n = len(self.tree)
+        k = self._log2[np.maximum(hi - lo, 1)].astype(np.intp)
+        # flat indices into the sparse table, for ids (lo, lo + 2**k] and (hi - 2**k, hi]
+        row = k * n
+        left = self._table.take(row + np.minimum(lo + 1, n - 1))
+        right = self._table.take(row + np.maximum(hi + 1 - np.left_shift(1, k), 0))
+        depths = self.tree.depths
+        shallowest = np.where(depths.take(left) <= depths.take(right), left, right)
+        return np.where(lo == hi, lo, self.tree.parent_ids.take(shallowest))
+
+    def ancestor_at_depth(self, nodes: Nodes, depth: Union[int, np.ndarray]) -> np.ndarray:
+        """roll nodes up to their ancestor at a given depth (e.g. 1 for chapters)
+
+        Args:
+            nodes (Nodes): nodes to roll up
+            depth (Union[int, np.ndarray]): depth of the ancestors, broadcast against `nodes`
+
+        Returns:
+            np.ndarray: node ids of the ancestors, or -1 where a node is shallower than `depth`
+        """
+        nodes, depth = np.broadcast_arrays(self.ids(nodes), depth)
+        out = np.full(nodes.shape, -1, dtype=np.int32)
+        valid = (depth >= 0) & (depth < len(self._ancestors))
+        out[valid] = self._ancestors[depth[valid], nodes[valid]]
+        return out
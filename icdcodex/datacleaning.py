@@ -1,66 +1,242 @@
 """preprocess icd-10 hierarchy into a graphical structure that node2vec can use"""
 
 
-from typing import List, Optional
+from typing import TYPE_CHECKING, List, Optional
 import warnings
 import tempfile
 import re
 import json
+import hashlib
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+from xml.etree import ElementTree
 from zipfile import ZipFile
 from pathlib import Path
-import requests
-import untangle
-import pandas as pd
 import networkx as nx
+from icdcodex import download, hierarchy
+from icdcodex.encoding import format_icd10cm
+from icdcodex.search import SearchIndex
+from icdcodex.tree import IcdTree
+from icdcodex.versions import VERSION_INDEX, VersionIndex
+
+# requests, untangle and pandas are imported by the functions that need them, to keep
+# `import icdcodex.datacleaning` cheap
+if TYPE_CHECKING:
+    import untangle
+
+logger = logging.getLogger(__name__)
 
 # Note to self: to get these links in the future, go to https://www.cms.gov/medicare/coding-billing/icd-10-codes/latest-news
 # and copy the links for the "20XX Code Descriptions in Tabular Order" and "20XX Code Tables, Tabular and Index" files
 
-def main():
-    G_icd9, codes_icd9 = build_icd9_hierarchy_from_url(
-        "https://raw.githubusercontent.com/kshedden/icd9/master/icd9/resources/icd9Hierarchy.json"
-    )
-    G_icd10cm_2019, codes_icd10cm_2019 = build_icd10_hierarchy_from_url(
+# (revision, version, source urls) of every packaged hierarchy
+SOURCES = [
+    ("icd9", None, (
+        "https://raw.githubusercontent.com/kshedden/icd9/master/icd9/resources/icd9Hierarchy.json",
+    )),
+    ("icd10cm", "2019", (
         "https://www.cms.gov/Medicare/Coding/ICD10/Downloads/2019-ICD-10-CM-Code-Descriptions.zip",
         "https://www.cms.gov/Medicare/Coding/ICD10/Downloads/2019-ICD-10-CM-Tables-and-Index.zip",
-    )
-    G_icd10cm_2020, codes_icd10cm_2020 = build_icd10_hierarchy_from_url(
+    )),
+    ("icd10cm", "2020", (
         "https://www.cms.gov/Medicare/Coding/ICD10/Downloads/2020-ICD-10-CM-Codes.zip",
         "https://www.cms.gov/Medicare/Coding/ICD10/Downloads/2020-ICD-10-CM-Code-Tables.zip",
-    )
-    G_icd10cm_2021, codes_icd10cm_2021 = build_icd10_hierarchy_from_url(
+    )),
+    ("icd10cm", "2021", (
         "https://www.cms.gov/files/zip/2021-code-descriptions-tabular-order.zip",
         "https://www.cms.gov/files/zip/2021-code-tables-and-index.zip",
-    )
-    G_icd10cm_2022, codes_icd10cm_2022 = build_icd10_hierarchy_from_url(
+    )),
+    ("icd10cm", "2022", (
         "https://www.cms.gov/files/zip/2022-code-descriptions-tabular-order-updated-02012022.zip",
-        "https://www.cms.gov/files/zip/2022-code-tables-tabular-and-index-updated-02012022.zip",     
-    )
-    G_icd10cm_2023, codes_icd10cm_2023 = build_icd10_hierarchy_from_url(
+        "https://www.cms.gov/files/zip/2022-code-tables-tabular-and-index-updated-02012022.zip",
+    )),
+    ("icd10cm", "2023", (
         "https://www.cms.gov/files/zip/2023-code-descriptions-tabular-order-updated-01/11/2023.zip",
         "https://www.cms.gov/files/zip/2023-code-tables-tabular-and-index-updated-01/11/2023.zip",
-    )
-    G_icd10cm_2024, codes_icd10cm_2024 = build_icd10_hierarchy_from_url(
+    )),
+    ("icd10cm", "2024", (
         "https://www.cms.gov/files/zip/2024-code-descriptions-tabular-order-updated-06/29/2023.zip",
         "https://www.cms.gov/files/zip/2024-code-tables-tabular-and-index-updated-06/29/2023.zip",
-    )
-    outdir = Path("icdcodex/data")
-    for G, codes, fname in [
-        (G_icd9, codes_icd9, "icd-9-hierarchy.json"),
-        (G_icd10cm_2019, codes_icd10cm_2019, "icd-10-2019-hierarchy.json",),
-        (G_icd10cm_2020, codes_icd10cm_2020, "icd-10-2020-hierarchy.json",),
-        (G_icd10cm_2021, codes_icd10cm_2021, "icd-10-2021-hierarchy.json",),
-        (G_icd10cm_2022, codes_icd10cm_2022, "icd-10-2022-hierarchy.json",),
-        (G_icd10cm_2023, codes_icd10cm_2023, "icd-10-2023-hierarchy.json",),
-        (G_icd10cm_2024, codes_icd10cm_2024, "icd-10-2024-hierarchy.json",),
-    ]:
-        with open(outdir / fname, "w") as f:
-            root_node, *_ = nx.topological_sort(G)
-            j = {
-                "tree": nx.readwrite.json_graph.tree_data(G, root_node),
-                "codes": sorted(codes),
-            }
-            json.dump(j, f)
+    )),
+]
+
+# records the inputs, outputs and statistics of the last build of each hierarchy
+BUILD_MANIFEST = "build-manifest.json"
+
+# modules whose code determines the packaged data files
+_BUILDER_MODULES = ["datacleaning.py", "encoding.py", "search.py", "tree.py", "_arrays.py"]
+
+
+def main(outdir="icdcodex/data", sources=None, download_dir=None, workers=None, force=False):
+    """build every packaged hierarchy, skipping the ones that are already current
+
+    Each hierarchy is downloaded, built and serialized in its own process. It is only
+    rebuilt if the hashes of its source archives or of the builder code differ from the
+    ones recorded in the build manifest, or if one of its outputs is missing.
+
+    Args:
+        outdir (Pathlike): directory of the packaged data files. Defaults to "icdcodex/data".
+        sources (List[Tuple[str, Optional[str], Tuple[str, ...]]], optional): revision, version and
+            source urls (or local paths) of each hierarchy. Defaults to `SOURCES`.
+        download_dir (Pathlike, optional): download cache, see `download.Downloader`. Defaults to
+            `download.DEFAULT_CACHE_DIR`.
+        workers (int, optional): number of processes. Defaults to the number of CPUs.
+        force (bool): If True, rebuild every hierarchy. Defaults to False.
+
+    Returns:
+        Dict[str, dict]: the build manifest, keyed by the stem of the data files (e.g. "icd-10-2022")
+    """
+    outdir = Path(outdir)
+    manifest_fp = outdir / BUILD_MANIFEST
+    manifest = json.loads(manifest_fp.read_text()) if manifest_fp.exists() else {}
+    errors = []
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {}
+        for revision, version, urls in SOURCES if sources is None else sources:
+            stem = hierarchy.resource_stem(revision, version)
+            future = pool.submit(
+                build_revision, revision, version, urls, outdir,
+                download_dir, manifest.get(stem), force,
+            )
+            futures[future] = stem
+        for future in as_completed(futures):
+            stem = futures[future]
+            try:
+                manifest[stem], rebuilt = future.result()
+            except Exception as e:
+                logger.error(f"failed to build {stem}: {e!r}")
+                errors.append(e)
+                continue
+            logger.info(f"{stem}: {'built' if rebuilt else 'up to date'}")
+    manifest = dict(sorted(manifest.items()))
+    write_version_index(outdir, [entry["version"] for entry in manifest.values() if entry["revision"] == "icd10cm"])
+    with tempfile.NamedTemporaryFile("w", dir=outdir, suffix=".tmp", delete=False) as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f.name, manifest_fp)
+    if errors:
+        raise errors[0]
+    return manifest
+
+
+def build_revision(revision, version, urls, outdir, download_dir=None, previous=None, force=False):
+    """download, build and serialize one hierarchy, unless its outputs are current
+
+    Args:
+        revision (str): "icd9" or "icd10cm"
+        version (str, optional): icd-10-cm version
+        urls (Tuple[str, ...]): the icd9 hierarchy spec, or the icd-10-cm code description and
+            code table archives. Local paths are used as they are, and urls are downloaded concurrently.
+        outdir (Pathlike): directory of the packaged data files
+        download_dir (Pathlike, optional): download cache, see `download.Downloader`
+        previous (dict, optional): build manifest entry of the last build. Defaults to None.
+        force (bool): If True, rebuild even if the outputs are current. Defaults to False.
+
+    Returns:
+        Tuple[dict, bool]: build manifest entry, and whether the hierarchy was rebuilt
+    """
+    outdir = Path(outdir)
+    stem = hierarchy.resource_stem(revision, version)
+    outputs = [f"{stem}-hierarchy.json", f"{stem}-hierarchy.bin", f"{stem}-search.bin"]
+    start = time.perf_counter()
+    remote = [url for url in urls if re.match(r"https?://", url)]
+    downloads = dict(zip(remote, download.fetch_all(remote, download_dir)))
+    paths = [downloads.get(url, Path(url)) for url in urls]
+    downloaded = time.perf_counter()
+    sources = {url: _sha256(path) for url, path in zip(urls, paths)}
+    builder = builder_fingerprint()
+    fingerprint = hashlib.sha256(json.dumps([builder, sources], sort_keys=True).encode()).hexdigest()
+    unchanged = previous is not None and previous.get("fingerprint") == fingerprint
+    outputs_exist = all((outdir / output).exists() for output in outputs)
+    if not force and unchanged and outputs_exist:
+        return previous, False
+    if revision == "icd9":
+        G, codes = build_icd9_hierarchy(*paths)
+    else:
+        G, codes = build_icd10cm_hierarchy_from_zip(*paths)
+    built = time.perf_counter()
+    meta = {"revision": revision} if version is None else {"revision": revision, "version": version}
+    write_hierarchy(G, codes, outdir, stem, meta)
+    serialized = time.perf_counter()
+    entry = {
+        "revision": revision,
+        "version": version,
+        "fingerprint": fingerprint,
+        "builder": builder,
+        "sources": sources,
+        "outputs": {output: _sha256(outdir / output) for output in outputs},
+        "nodes": G.number_of_nodes(),
+        "codes": len(codes),
+        "seconds": {
+            "download": round(downloaded - start, 3),
+            "build": round(built - downloaded, 3),
+            "serialize": round(serialized - built, 3),
+        },
+        "built_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    return entry, True
+
+
+def write_hierarchy(G, codes, outdir, stem, meta):
+    """serialize a hierarchy as the data files that `hierarchy` and `search` load
+
+    Args:
+        G (nx.DiGraph): ICD hierarchy
+        codes (List[str]): ICD codes
+        outdir (Pathlike): directory of the packaged data files
+        stem (str): common prefix of the data files, see `hierarchy.resource_stem`
+        meta (dict): metadata stored with the `IcdTree`, e.g. {"revision": "icd9"}
+    """
+    outdir = Path(outdir)
+    with open(outdir / f"{stem}-hierarchy.json", "w") as f:
+        root_node, *_ = nx.topological_sort(G)
+        j = {
+            "tree": nx.readwrite.json_graph.tree_data(G, root_node),
+            "codes": sorted(codes),
+        }
+        json.dump(j, f)
+    # compact, memory-mappable version of the same hierarchy (see tree.py)
+    tree = IcdTree.from_networkx(G, sorted(codes), meta=meta)
+    tree.save(outdir / f"{stem}-hierarchy.bin")
+    SearchIndex(tree).save(outdir / f"{stem}-search.bin")
+
+
+def write_version_index(outdir, versions):
+    """index the codes of every icd-10-cm release in `outdir`, see `versions.VersionIndex`
+
+    The index is cheap to build from the memory-mapped hierarchies, so it is always rebuilt.
+
+    Args:
+        outdir (Pathlike): directory of the packaged data files
+        versions (List[str]): icd-10-cm versions to index
+    """
+    outdir = Path(outdir)
+    trees = {}
+    for version in versions:
+        fp = outdir / f"{hierarchy.resource_stem('icd10cm', version)}-hierarchy.bin"
+        if fp.exists():
+            trees[version] = IcdTree.load(fp)
+    if trees:
+        VersionIndex.from_trees(trees).save(outdir / VERSION_INDEX)
+
+
+def builder_fingerprint() -> str:
+    """hash of the code that builds and serializes the hierarchies"""
+    package = Path(__file__).parent
+    h = hashlib.sha256()
+    for module in _BUILDER_MODULES:
+        h.update((package / module).read_bytes())
+    return h.hexdigest()
+
+
+def _sha256(fp) -> str:
+    h = hashlib.sha256()
+    with open(fp, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
 
 
 # -------- ICD 9 ------------ #
@@ -68,21 +244,20 @@ def main():
 
 def build_icd9_hierarchy_from_url(
     url="https://github.com/kshedden/icd9/blob/master/icd9/resources/icd9Hierarchy.json",
-    root_name=None
+    root_name=None,
+    cache_dir=None,
 ):
     """build the icd9 hierarchy by downloading the hierarchy files
 
     Args:
         url (str, optional): url to hierarchy spec. Defaults to "https://github.com/kshedden/icd9/blob/master/icd9/resources/icd9Hierarchy.json".
         root_name (str, option): arbitrary name for the root of the hierarchy. Defaults to "root."
+        cache_dir (Pathlike, optional): download cache, see `download.Downloader`. Defaults to None.
 
     Returns:
         icd-9 hierarchy (nx.Graph) and ICD9 codes (List[str])
     """
-    with tempfile.NamedTemporaryFile("wt") as f:
-        f.write(requests.get(url).content.decode())
-        f.seek(0)
-        return build_icd9_hierarchy(f.name)
+    return build_icd9_hierarchy(download.fetch(url, cache_dir), root_name)
 
 
 def build_icd9_hierarchy(fp, root_name=None):
@@ -95,50 +270,56 @@ def build_icd9_hierarchy(fp, root_name=None):
     Returns:
         icd-9 hierarchy (nx.Graph) and ICD9 codes (List[str])
     """
+    import pandas as pd
+
     if root_name is None:
         root_name = "root"
-    hierarchy = pd.read_json(fp)
+    df = pd.read_json(fp)
+    # edge lists, one column operation per level, in the order the edges were first inserted
+    # by the per-group loops this replaces (the order of each node's children)
+    chapters = df.chapter.unique()
+    with_subchapters = df[~df.chapter.isin(_ICD9_CHAPTERS_WITHOUT_SUBCHAPTERS)]
+    subchapter_edges = with_subchapters[["chapter", "subchapter"]].drop_duplicates()
+    has_subchapter = df.subchapter.notna()
+    major_edges = pd.concat([
+        df.loc[~has_subchapter, ["chapter", "major"]].drop_duplicates().set_axis(["parent", "child"], axis=1),
+        df.loc[has_subchapter, ["subchapter", "major"]].drop_duplicates().set_axis(["parent", "child"], axis=1),
+    ])
+    major_edges = major_edges[major_edges.parent.notna()]
+    codes = df[df.major.notna()]
     G = nx.DiGraph()
     G.add_node(root_name)
-    for chapter in hierarchy.chapter.unique():
-        G.add_edge(root_name, chapter)
-    G.add_nodes_from(hierarchy.subchapter.unique())
-    for chapter, child_df in hierarchy.groupby("chapter"):
-        if chapter in [
-            "Diseases Of The Blood And Blood-Forming Organs",
-            "Congenital Anomalies",
-        ]:
-            # no sub-chapters
-            continue
-        for subchapter in child_df.subchapter.unique():
-            G.add_edge(chapter, subchapter)
-    icd_codes_with_subchapters = ~hierarchy.subchapter.isna()
-    for parent_prop, child_prop, df in [
-        ("chapter", "major", hierarchy[~icd_codes_with_subchapters]),
-        ("subchapter", "major", hierarchy[icd_codes_with_subchapters]),
-    ]:
-        for parent, child_df in df.groupby(parent_prop):
-            for child in child_df[child_prop].unique():
-                G.add_edge(str(parent), str(child))
-    icd9_descriptions = {}
-    for parent, icd_df in hierarchy.groupby("major"):
-        for _, icd in icd_df.iterrows():
-            icd9_descriptions[icd.icd9] = {"description": icd.descLong}
-            G.add_edge(str(parent), icd.icd9)
-    icd_codes = hierarchy.icd9.unique()
-    assert not any(
-        code for code in icd_codes if code not in G.nodes()
-    ), "some codes are not represented in the networkx hierarchy!"
+    G.add_edges_from((root_name, chapter) for chapter in chapters.tolist())
+    G.add_edges_from(zip(subchapter_edges.chapter.tolist(), subchapter_edges.subchapter.tolist()))
+    G.add_edges_from(zip(major_edges.parent.astype(str).tolist(), major_edges.child.astype(str).tolist()))
+    G.add_edges_from(zip(codes.major.astype(str).tolist(), codes.icd9.tolist()))
+    icd_codes = df.icd9.unique()
+    missing = pd.Index(icd_codes).difference(pd.Index(codes.icd9))
+    assert not len(missing), "some codes are not represented in the networkx hierarchy!"
     G = nx.algorithms.traversal.breadth_first_search.bfs_tree(G, source=root_name)
-    nx.set_node_attributes(G, icd9_descriptions)
+    # for duplicated codes, the description of the last row in major order wins
+    descriptions = codes.sort_values("major", kind="stable").drop_duplicates("icd9", keep="last")
+    nx.set_node_attributes(
+        G,
+        {
+            code: {"description": description}
+            for code, description in zip(descriptions.icd9.tolist(), descriptions.descLong.tolist())
+        },
+    )
     return G, icd_codes
 
 
+_ICD9_CHAPTERS_WITHOUT_SUBCHAPTERS = [
+    "Diseases Of The Blood And Blood-Forming Organs",
+    "Congenital Anomalies",
+]
+
+
 # -------- ICD 10 CM -------- #
 
 
 def build_icd10_hierarchy_from_url(
-    code_desc_url, code_table_url, root_name: Optional[str] = None, return_intermediates = False
+    code_desc_url, code_table_url, root_name: Optional[str] = None, return_intermediates = False, cache_dir=None
 ):
     """build the icd10 hierarchy by downloading from cms.gov
 
@@ -147,18 +328,15 @@ def build_icd10_hierarchy_from_url(
         code_table_url (str): url to the "Code Tables and Index (ZIP)" file
         root_name (str, option): arbitrary name for the root of the hierarchy. Defaults to "root."
         return_intermediates (bool): If True, return the untangle element and codes. Defaults to False.
+            Otherwise, the code table is streamed with `build_icd10_hierarchy_from_xml`, which
+            never holds the whole document in memory.
+        cache_dir (Pathlike, optional): download cache, see `download.Downloader`. Defaults to None.
 
     Returns:
         Tuple[nx.Graph, List[str]]: icd10 hierarchy and ICD-10-CM codes
     """
-    with tempfile.NamedTemporaryFile("wb") as desc_f, tempfile.NamedTemporaryFile(
-        "wb"
-    ) as table_f:
-        desc_f.write(requests.get(code_desc_url).content)
-        desc_f.seek(0)
-        table_f.write(requests.get(code_table_url).content)
-        table_f.seek(0)
-        return build_icd10cm_hierarchy_from_zip(desc_f.name, table_f.name, root_name, return_intermediates)
+    desc_fp, table_fp = download.fetch_all([code_desc_url, code_table_url], cache_dir)
+    return build_icd10cm_hierarchy_from_zip(desc_fp, table_fp, root_name, return_intermediates)
 
 
 def build_icd10cm_hierarchy_from_zip(
@@ -171,6 +349,8 @@ def build_icd10cm_hierarchy_from_zip(
         code_table_zip_fp ([type]): file path to the "Code Tables and Index (ZIP)" file
         root_name (str, option): arbitrary name for the root of the hierarchy. Defaults to "root."
         return_intermediates (bool): If True, return the untangle element and codes. Defaults to False.
+            Otherwise, the code table is streamed with `build_icd10_hierarchy_from_xml`, which
+            never holds the whole document in memory.
 
     Returns:
         Tuple[nx.Graph, List[str]]: icd10 hierarchy and ICD-10-CM codes
@@ -185,22 +365,22 @@ def build_icd10cm_hierarchy_from_zip(
                 if not line.strip():
                     continue  # blank line
                 code, *_ = line.decode().split(" ")
-                if 3 < len(code) and "." not in code:
-                    code = "{}.{}".format(code[:3], code[3:])
-                codes.append(code)
+                codes.append(format_icd10cm(code))
     with ZipFile(code_table_zip_fp) as z:
         (code_table_fp,) = [
             n for n in z.namelist() if re.findall(r"icd10cm_tabular_\d{4}\.xml$", n)
         ]
         with z.open(code_table_fp, "r") as f:
+            if not return_intermediates:
+                return build_icd10_hierarchy_from_xml(f, codes, root_name)
+            import untangle
+
             e = untangle.parse(f)
-    if return_intermediates:
-        return build_icd10_hierarchy(e, codes, root_name), e, codes
-    return build_icd10_hierarchy(e, codes, root_name)
+    return build_icd10_hierarchy(e, codes, root_name), e, codes
 
 
 def build_icd10_hierarchy(
-    xml_root: untangle.Element,
+    xml_root: "untangle.Element",
     codes: List[str],
     root_name: Optional[str] = None,
     prune_extra_codes: bool = True,
@@ -216,41 +396,41 @@ def build_icd10_hierarchy(
         root_name (str, option): arbitrary name for the root of the hierarchy. Defaults to "root."
         prune_extra_codes (bool): If True, remove any leaf node not specified in `codes`
     Returns:
-        Tuple[nx.Graph, List[str]]: icd10 hierarchy and ICD-10-CM codes
+        Tuple[nx.DiGraph, List[str]]: icd10 hierarchy and ICD-10-CM codes
     """
-    if root_name is None:
-        root_name = "root"
-    G = nx.Graph()
-    G.add_node(root_name)
+    builder = _Icd10HierarchyBuilder(codes, root_name, prune_extra_codes)
     for chapter_elem in xml_root.ICD10CM_tabular.chapter:
         chapter = chapter_elem.desc.cdata
-        G.add_node(chapter, chapter_num=chapter_elem.name.cdata)
-        G.add_edge(chapter, root_name)
+        builder.add(builder.root_name, chapter)
         for section_elem in chapter_elem.section:
             section = section_elem.desc.cdata
             try:
                 diag_elems = section_elem.diag
             except AttributeError:
-                pass  # e.g., "C00-C96" has no codes but "C00-C14" does
-            else:
-                G.add_node(section)
-                G.add_edge(section, chapter)
-                for diag_elem in diag_elems:
-                    traverse_diag(G, section, diag_elem)
-    leafs = [n for n in G.nodes() if G.degree[n] == 1]
-    if root_name in leafs:
-        warnings.warn(UserWarning(f"parsing strangeness, root node `{root_name}` is a leaf"))
-    if prune_extra_codes:
-        codes_ = set(codes)
-        G.remove_nodes_from(leaf for leaf in leafs if leaf not in codes_)
-    G_directed = nx.algorithms.traversal.breadth_first_search.bfs_tree(G, source=root_name)
-    # Iterate over the nodes in the graph and add back the description
-    for node in G_directed.nodes():
-        if node in G.nodes():
-            description = G.nodes[node].get("description", None)
-            if description:
-                G_directed.nodes[node]["description"] = description
-    return G_directed, codes
+                continue  # e.g., "C00-C96" has no codes but "C00-C14" does
+            builder.add(chapter, section)
+            # depth-first, with children pushed in reverse so that they are added in document order
+            stack = [(section, diag_elem, []) for diag_elem in reversed(list(diag_elems))]
+            while stack:
+                parent, diag_elem, extensions = stack.pop()
+                self = diag_elem.name.cdata
+                description = diag_elem.desc.cdata
+                builder.add(parent, self, description)
+                try:
+                    extension_elems = diag_elem.sevenChrDef.extension
+                except AttributeError:
+                    pass
+                else:
+                    extensions = [(ext["char"], ext.cdata) for ext in extension_elems]
+                try:
+                    children = diag_elem.diag
+                except AttributeError:
+                    builder.add_extensions(self, description, extensions)
+                    builder.close(self)
+                else:
+                    stack.extend((self, child, extensions) for child in reversed(list(children)))
+        builder.close(chapter)
+    return builder.finish(), codes
 
 
 def traverse_diag(G, parent, untangle_elem, extensions=None):
@@ -260,12 +440,25 @@ def traverse_diag(G, parent, untangle_elem, extensions=None):
     uncle/aunt. Also, some diagnoses are non-billable because they are,
     parents to more specific sub-diagnoses.
 
+    Deprecated: the ICD-10-CM builders no longer use `traverse_diag`, and it will be
+    removed in a future release.
+
     Args:
         G (nx.Graph): ICD hierarchy to mutate
         parent (str): parent node
         untangle_elem (untangle.Element): XML element, from untangle API
         extensions (List[Tuple[str,str]], optional): Seventh character extensions and related descriptions. Defaults to None.
     """
+    warnings.warn(
+        "traverse_diag is deprecated and will be removed: the ICD-10-CM builders no longer use it",
+        DeprecationWarning,
+        stacklevel=2,
+    )
+    _traverse_diag(G, parent, untangle_elem, extensions)
+
+
+def _traverse_diag(G, parent, untangle_elem, extensions=None):
+    """undirected counterpart of `traverse_diag`, without the deprecation warning"""
     self = untangle_elem.name.cdata
     description = untangle_elem.desc.cdata
     G.add_node(self, description=description)
@@ -279,27 +472,191 @@ def traverse_diag(G, parent, untangle_elem, extensions=None):
     try:
         children = untangle_elem.diag
     except AttributeError:
-        if extensions:
-            if 7 < len(self):
-                # There is an inconsistency in the XML structure where, somtimes,
-                # the seventh character is specified explicitly as well as by
-                # having their parent contain a <sevenChrDef> tag. In this case,
-                # we simply ignore it because these codes already have a seventh
-                # character
-                return
-            for extension, extension_desc in extensions:
-                if "." not in self:  # e.g., T07 -> T07.XXXD
-                    num_xs_needed = 7 - len(self) - len(extension)
-                    extension = "." + ("X" * num_xs_needed) + extension
-                else:  # e.g. E09.37 -> E09.37X1
-                    num_xs_needed = 8 - len(self) - len(extension)
-                    extension = ("X" * num_xs_needed) + extension
-                G.add_node(self + extension, description=description + " " + extension_desc)
-                G.add_edge(self + extension, self)
+        for code, code_description in _extended_codes(self, description, extensions):
+            G.add_node(code, description=code_description)
+            G.add_edge(code, self)
     else:
         for child in children:
-            traverse_diag(G, self, child, extensions)
+            _traverse_diag(G, self, child, extensions)
+
+
+def _extended_codes(code, description, extensions):
+    """codes and descriptions of a leaf diagnosis with each of its seventh-character extensions
+
+    Args:
+        code (str): leaf diagnosis, e.g. "T07" or "E09.37"
+        description (str): description of the diagnosis
+        extensions (List[Tuple[str,str]]): Seventh character extensions and related descriptions
+
+    Returns:
+        List[Tuple[str,str]]: extended codes (e.g. "T07.XXXD" or "E09.37X1") and descriptions
+    """
+    if 7 < len(code):
+        # There is an inconsistency in the XML structure where, somtimes,
+        # the seventh character is specified explicitly as well as by
+        # having their parent contain a <sevenChrDef> tag. In this case,
+        # we simply ignore it because these codes already have a seventh
+        # character
+        return []
+    extended = []
+    for extension, extension_desc in extensions:
+        if "." not in code:  # e.g., T07 -> T07.XXXD
+            num_xs_needed = 7 - len(code) - len(extension)
+            extension = "." + ("X" * num_xs_needed) + extension
+        else:  # e.g. E09.37 -> E09.37X1
+            num_xs_needed = 8 - len(code) - len(extension)
+            extension = ("X" * num_xs_needed) + extension
+        extended.append((code + extension, description + " " + extension_desc))
+    return extended
+
+
+def build_icd10_hierarchy_from_xml(
+    xml_file,
+    codes: List[str],
+    root_name: Optional[str] = None,
+    prune_extra_codes: bool = True,
+):
+    """build the icd10 hierarchy by streaming the code table XML
+
+    Builds the same hierarchy as `build_icd10_hierarchy`, but parses the XML incrementally
+    and adds each diagnosis as soon as its <name> and <desc> are read. Elements are freed
+    when their <diag> closes, so memory does not grow with the size of the document.
+
+    Seventh-character extensions are expected before any child <diag>, as the code table
+    schema requires.
+
+    Args:
+        xml_file (file-like or Pathlike): code table XML, e.g. "icd10cm_tabular_2020.xml"
+        codes (List[str]): list of ICD codes
+        root_name (str, option): arbitrary name for the root of the hierarchy. Defaults to "root."
+        prune_extra_codes (bool): If True, remove any leaf node not specified in `codes`
+    Returns:
+        Tuple[nx.DiGraph, List[str]]: icd10 hierarchy and ICD-10-CM codes
+    """
+    builder = _Icd10HierarchyBuilder(codes, root_name, prune_extra_codes)
+    path = []  # tags of the open elements, to tell e.g. a chapter's <desc> from a diagnosis'
+    diags = []  # open <diag> elements, outermost first
+    chapter = section = None
+    section_added = False
+    for event, elem in ElementTree.iterparse(xml_file, events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if tag == "diag" and path and path[-1] in ("section", "diag"):
+                if diags:
+                    parent = diags[-1]
+                    parent.has_children = True
+                    inherited = parent.extensions()
+                else:
+                    if not section_added:  # e.g., "C00-C96" has no codes but "C00-C14" does
+                        builder.add(chapter, section)
+                        section_added = True
+                    inherited = []
+                diags.append(_StreamedDiag(inherited))
+            path.append(tag)
+            continue
+        path.pop()
+        parent_tag = path[-1] if path else None
+        text = elem.text or ""
+        if parent_tag == "diag" and tag in ("name", "desc"):
+            diag = diags[-1]
+            if tag == "name":
+                diag.name = text
+            else:
+                diag.description = text
+                builder.add(diags[-2].name if 1 < len(diags) else section, diag.name, text)
+        elif parent_tag == "sevenChrDef" and tag == "extension" and path[-2:-1] == ["diag"]:
+            diags[-1].own_extensions.append((elem.get("char"), text))
+        elif parent_tag == "diag" and tag == "sevenChrDef":
+            diags[-1].num_seven_chr_defs += 1
+        elif tag == "diag" and parent_tag in ("section", "diag"):
+            diag = diags.pop()
+            if not diag.has_children:
+                builder.add_extensions(diag.name, diag.description, diag.extensions())
+                builder.close(diag.name)
+            elem.clear()
+        elif parent_tag == "chapter" and tag == "desc":
+            chapter = text
+            builder.add(builder.root_name, chapter)
+        elif parent_tag == "section" and tag == "desc":
+            section = text
+        elif parent_tag == "chapter" and tag == "section":
+            section_added = False
+            elem.clear()
+        elif tag == "chapter":
+            builder.close(chapter)
+            elem.clear()
+    return builder.finish(), codes
+
+
+class _StreamedDiag:
+    """a <diag> element that has been opened but not yet closed"""
+
+    __slots__ = ("name", "description", "inherited", "own_extensions", "num_seven_chr_defs", "has_children")
+
+    def __init__(self, inherited):
+        self.name = self.description = ""
+        self.inherited = inherited
+        self.own_extensions = []
+        self.num_seven_chr_defs = 0
+        self.has_children = False
+
+    def extensions(self):
+        # a single <sevenChrDef> with extensions overrides the inherited ones, like untangle's lookup
+        if self.num_seven_chr_defs == 1 and self.own_extensions:
+            return self.own_extensions
+        return self.inherited
+
+
+class _Icd10HierarchyBuilder:
+    """build the directed icd10 hierarchy top-down in a single pass
+
+    Nodes are added parent first, in document order, and leaves that are not in `codes`
+    are pruned as soon as they are closed, so there is never more than one graph in memory.
+    As before, only the leaves of the full hierarchy (seventh-character extensions included)
+    are pruned: a diagnosis whose extensions are all pruned is kept. A name that occurs
+    twice keeps its first parent.
+    """
+
+    def __init__(self, codes, root_name, prune_extra_codes):
+        self.root_name = "root" if root_name is None else root_name
+        self.codes = set(codes) if prune_extra_codes else None
+        self.G = nx.DiGraph()
+        self.G.add_node(self.root_name)
+        self.parents = set()  # nodes that had a child before pruning
+
+    def add(self, parent, child, description=None):
+        self.parents.add(parent)
+        if child in self.G:
+            return
+        self.G.add_edge(parent, child)
+        if description:
+            self.G.nodes[child]["description"] = description
+
+    def close(self, node):
+        """prune `node` if it is a leaf that is not a code"""
+        if self.codes is not None and node not in self.codes and node not in self.parents:
+            self.G.remove_node(node)
+
+    def add_extensions(self, self_, description, extensions):
+        """add the seventh-character extensions of a leaf diagnosis"""
+        for code, code_description in _extended_codes(self_, description, extensions):
+            self.add(self_, code, code_description)
+            self.close(code)
+
+    def finish(self):
+        if self.G.out_degree(self.root_name) == 1:
+            warnings.warn(UserWarning(f"parsing strangeness, root node `{self.root_name}` is a leaf"))
+        return self.G
 
 
 if __name__ == "__main__":
-    main()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="build the packaged ICD hierarchies")
+    parser.add_argument("--outdir", default="icdcodex/data")
+    parser.add_argument("--download-dir", default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="rebuild even if the outputs are current")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    main(args.outdir, download_dir=args.download_dir, workers=args.workers, force=args.force)
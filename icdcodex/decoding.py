@@ -0,0 +1,457 @@
+"""indexes that decode vectors into the codes with the nearest embeddings"""
+
+from typing import Iterable, Iterator, Optional, Sequence, Tuple, Union
+import abc
+import numpy as np
+from . import _parallel
+from .quantization import DTYPES, dequantize, quantize
+from .tree import IcdTree, Node
+
+Queries = Union[np.ndarray, Iterable[np.ndarray]]
+
+METRICS = ["cosine", "euclidean", "dot"]
+
+# largest k for which `_top_k` selects by repeated argmax rather than by partitioning
+_ARGMAX_TOP_K = 32
+# columns per block when `_top_k` first selects blocks of columns by their maxima
+_BLOCK = 64
+
+DEFAULT_MEMORY_LIMIT = 256 << 20
+
+# rows of quantized embeddings dequantized at once while scoring
+_SCORE_BLOCK = 4096
+
+
+class DecodingIndex(abc.ABC):
+    """find the `k` embeddings nearest to each query vector
+
+    Indexes score candidates so that higher is better (cosine or dot similarity, or the
+    negative squared distance) and report cosine and dot similarities, or euclidean distances.
+    Results are sorted best first and padded with row -1 (and a score of nan) when fewer than
+    `k` candidates qualify.
+
+    Embeddings may be stored quantized (see `quantization`): scores are then computed a block
+    of rows at a time, so that at most `_SCORE_BLOCK` rows are dequantized at once.
+
+    Args:
+        metric (str): "cosine", "euclidean" or "dot". Defaults to "cosine".
+        chunk_size (int): queries scored at once, which bounds the size of the score matrix
+            to chunk_size x len(embeddings). Defaults to 1024.
+        dtype (str): "float32", "float16" or "int8" storage of the embeddings. Defaults to "float32".
+    """
+
+    def __init__(self, metric: str = "cosine", chunk_size: int = 1024, dtype: str = "float32"):
+        if metric not in METRICS:
+            raise ValueError(f"metric must be one of {METRICS}, but got {metric}")
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype must be one of {DTYPES}, but got {dtype}")
+        self.metric = metric
+        self.chunk_size = chunk_size
+        self.dtype = dtype
+        self.vectors: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None
+        self._half_norms: Optional[np.ndarray] = None
+
+    def fit(self, embeddings: np.ndarray, scales: Optional[np.ndarray] = None) -> "DecodingIndex":
+        """index embeddings, whose rows are the results of `search`
+
+        Args:
+            embeddings (np.ndarray): embeddings of shape (n, num_embedding_dimensions), which are
+                used without a copy if they are already stored as `dtype` and need no normalization
+            scales (np.ndarray, optional): scale of each dimension, for int8 embeddings. Defaults to None.
+        """
+        embeddings = np.asarray(embeddings)
+        if self.metric != "cosine" and embeddings.dtype == np.dtype(self.dtype) and embeddings.flags["C_CONTIGUOUS"]:
+            self.vectors, self.scales = embeddings, scales
+        else:
+            self.vectors, self.scales = quantize(self._prepare(dequantize(embeddings, scales)), self.dtype)
+        # with ||q||^2 dropped, -||q - v||^2 / 2 ranks like q.v - ||v||^2 / 2
+        if self.metric == "euclidean":
+            self._half_norms = np.concatenate(
+                [(block ** 2).sum(axis=1) / 2 for _, block in self._blocks(0, len(self.vectors))]
+            ) if len(self.vectors) else np.zeros(0, dtype=np.float32)
+        else:
+            self._half_norms = None
+        return self
+
+    def update(self, embeddings: np.ndarray, scales: Optional[np.ndarray] = None) -> "DecodingIndex":
+        """index new embeddings with the settings learned by `fit`, e.g. after codes were added or
+        removed; exact indexes have nothing to learn, so this is `fit`"""
+        return self.fit(embeddings, scales)
+
+    @abc.abstractmethod
+    def search(self, queries: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """find the `k` best rows for each query
+
+        Args:
+            queries (np.ndarray): query vectors of shape (n, num_embedding_dimensions)
+            k (int): number of results per query. Defaults to 1.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: float32 scores and int64 rows, of shape (n, k)
+        """
+
+    def __len__(self) -> int:
+        return 0 if self.vectors is None else len(self.vectors)
+
+    def _prepare(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.metric == "cosine":
+            norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+            vectors = vectors / np.where(norms == 0, 1, norms)
+        return vectors
+
+    def _score(self, queries: np.ndarray, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        """scores of prepared queries against rows start:stop, higher is better"""
+        stop = len(self.vectors) if stop is None else stop
+        if self.vectors.dtype == np.float32:
+            scores = queries @ self.vectors[start:stop].T
+        else:
+            scores = np.empty((len(queries), stop - start), dtype=np.float32)
+            for offset, block in self._blocks(start, stop):
+                np.matmul(queries, block.T, out=scores[:, offset:offset + len(block)])
+        if self._half_norms is not None:
+            scores -= self._half_norms[start:stop]
+        return scores
+
+    def _blocks(self, start: int, stop: int) -> Iterator[Tuple[int, np.ndarray]]:
+        """float32 embeddings of rows start:stop, dequantized `_SCORE_BLOCK` rows at a time"""
+        block_size = stop - start if self.vectors.dtype == np.float32 else _SCORE_BLOCK
+        for offset in range(0, stop - start, max(block_size, 1)):
+            block = self.vectors[start + offset:min(stop, start + offset + block_size)]
+            yield offset, dequantize(block, self.scales)
+
+    def _finish(self, queries: np.ndarray, scores: np.ndarray, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """turn internal scores into the reported metric"""
+        scores = scores.astype(np.float32)
+        if self.metric == "euclidean":
+            query_half_norms = (queries ** 2).sum(axis=1, keepdims=True) / 2
+            scores = np.sqrt(np.maximum(2 * (query_half_norms - scores), 0))
+        scores[rows == -1] = np.nan
+        return scores, rows
+
+
+class ExactIndex(DecodingIndex):
+    """score every embedding with one matrix multiplication per chunk of queries
+
+    See `DecodingIndex` for the arguments.
+    """
+
+    def search(self, queries: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        queries = self._prepare(np.atleast_2d(queries))
+        scores = np.empty((len(queries), k), dtype=np.float32)
+        rows = np.empty((len(queries), k), dtype=np.int64)
+        for start in range(0, len(queries), self.chunk_size):
+            chunk = queries[start:start + self.chunk_size]
+            chunk_scores, chunk_rows = _top_k(self._score(chunk), k)
+            scores[start:start + len(chunk)], rows[start:start + len(chunk)] = self._finish(
+                chunk, chunk_scores, chunk_rows
+            )
+        return scores, rows
+
+
+class TreeIndex(DecodingIndex):
+    """exact search among the codes under a node of the hierarchy, e.g. a predicted chapter
+
+    Embeddings are stored in the preorder of their codes in `tree`, so the codes under any
+    node are a contiguous block of rows (see `IcdTree`) and constraining a query to a
+    subtree just scores a slice of the matrix.
+
+    Args:
+        tree (IcdTree): ICD hierarchy
+        icd_codes (Sequence[str]): code of each embedding, all of which must be nodes of `tree`
+        metric (str): "cosine", "euclidean" or "dot". Defaults to "cosine".
+        chunk_size (int): queries scored at once. Defaults to 1024.
+        dtype (str): "float32", "float16" or "int8" storage of the embeddings. Defaults to "float32".
+    """
+
+    def __init__(
+        self,
+        tree: IcdTree,
+        icd_codes: Sequence[str],
+        metric: str = "cosine",
+        chunk_size: int = 1024,
+        dtype: str = "float32",
+    ):
+        super().__init__(metric, chunk_size, dtype)
+        self.tree = tree
+        node_ids = tree.ids([str(code) for code in icd_codes])
+        self._order = np.argsort(node_ids, kind="stable")
+        self._node_ids = node_ids[self._order]
+
+    def fit(self, embeddings: np.ndarray, scales: Optional[np.ndarray] = None) -> "TreeIndex":
+        return super().fit(np.asarray(embeddings)[self._order], scales)
+
+    def search(
+        self, queries: np.ndarray, k: int = 1, within: Union[Node, Sequence[Node], np.ndarray, None] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """find the `k` best rows for each query among the codes under `within`
+
+        Args:
+            queries (np.ndarray): query vectors of shape (n, num_embedding_dimensions)
+            k (int): number of results per query. Defaults to 1.
+            within (Union[Node, Sequence[Node], np.ndarray], optional): node (id or name) to
+                search under, for all queries or for each query. Defaults to the root.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: float32 scores and int64 rows, of shape (n, k)
+        """
+        queries = self._prepare(np.atleast_2d(queries))
+        if within is None:
+            within = 0
+        if isinstance(within, (str, int, np.integer)):
+            within = np.full(len(queries), self.tree.node_id(within))
+        else:
+            within = np.asarray(within)
+            within = within if within.dtype.kind in "iu" else self.tree.ids(within.astype(str))
+        starts = np.searchsorted(self._node_ids, within)
+        stops = np.searchsorted(self._node_ids, within + np.asarray(self.tree.subtree_sizes)[within])
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        ranges, groups = np.unique(np.stack([starts, stops], axis=1), axis=0, return_inverse=True)
+        groups = groups.reshape(-1)
+        query_order = np.argsort(groups, kind="stable")
+        group_offsets = np.searchsorted(groups[query_order], np.arange(len(ranges) + 1))
+        for (start, stop), lo, hi in zip(ranges.tolist(), group_offsets[:-1], group_offsets[1:]):
+            if start == stop:
+                continue
+            for chunk_start in range(lo, hi, self.chunk_size):
+                members = query_order[chunk_start:min(hi, chunk_start + self.chunk_size)]
+                chunk_scores, positions = _top_k(self._score(queries[members], start, stop), k)
+                scores[members] = chunk_scores
+                rows[members] = np.where(positions == -1, -1, self._order[start + np.maximum(positions, 0)])
+        return self._finish(queries, scores, rows)
+
+
+class IVFIndex(DecodingIndex):
+    """approximate search over an inverted file: the embeddings are clustered with k-means, and
+    each query only scores the embeddings in the `n_probe` clusters whose centroids score best
+
+    `n_probe` trades recall for latency: scoring about n_probe / n_lists of the embeddings,
+    and exact when n_probe == n_lists. It can be changed after fitting.
+
+    Args:
+        n_lists (int, optional): number of clusters. Defaults to sqrt(len(embeddings)).
+        n_probe (int): number of clusters searched per query. Defaults to 8.
+        metric (str): "cosine", "euclidean" or "dot". Defaults to "cosine".
+        iterations (int): k-means iterations. Defaults to 10.
+        seed (int, optional): seed of the k-means initialization. Defaults to None.
+        chunk_size (int): queries searched at once. Each list is scored against all the queries of
+            a chunk that probe it, so larger chunks amortize the loop over lists. Defaults to 8192.
+        dtype (str): "float32", "float16" or "int8" storage of the embeddings. Defaults to "float32".
+    """
+
+    def __init__(
+        self,
+        n_lists: Optional[int] = None,
+        n_probe: int = 8,
+        metric: str = "cosine",
+        iterations: int = 10,
+        seed: Optional[int] = None,
+        chunk_size: int = 8192,
+        dtype: str = "float32",
+    ):
+        super().__init__(metric, chunk_size, dtype)
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self.list_offsets: Optional[np.ndarray] = None
+        self._order: Optional[np.ndarray] = None
+
+    def fit(self, embeddings: np.ndarray, scales: Optional[np.ndarray] = None) -> "IVFIndex":
+        vectors = self._prepare(dequantize(embeddings, scales))
+        n_lists = min(len(vectors), self.n_lists or max(1, int(np.sqrt(len(vectors)))))
+        self.centroids, assignments = _kmeans(vectors, n_lists, self.iterations, np.random.default_rng(self.seed))
+        if self.metric == "cosine":
+            # probes rank centroids by their dot product with unit queries, so the centroids of
+            # the unit embeddings are normalized too (and the embeddings assigned to them again)
+            self.centroids = self._prepare(self.centroids)
+            assignments = _assign(vectors, self.centroids)
+        return self._fill(vectors, assignments)
+
+    def update(self, embeddings: np.ndarray, scales: Optional[np.ndarray] = None) -> "IVFIndex":
+        """assign new embeddings to the lists learned by `fit`, without running k-means again
+
+        Cheap when the embeddings changed little, e.g. when a few codes were added or removed.
+        """
+        if self.centroids is None:
+            return self.fit(embeddings, scales)
+        vectors = self._prepare(dequantize(embeddings, scales))
+        return self._fill(vectors, _assign(vectors, self.centroids))
+
+    def _fill(self, vectors: np.ndarray, assignments: np.ndarray) -> "IVFIndex":
+        # the embeddings of each list are stored contiguously
+        self._order = np.argsort(assignments, kind="stable")
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=len(self.centroids)))])
+        super().fit(vectors[self._order])
+        return self
+
+    def search(self, queries: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        queries = self._prepare(np.atleast_2d(queries))
+        scores = np.empty((len(queries), k), dtype=np.float32)
+        rows = np.empty((len(queries), k), dtype=np.int64)
+        for start in range(0, len(queries), self.chunk_size):
+            chunk = queries[start:start + self.chunk_size]
+            scores[start:start + len(chunk)], rows[start:start + len(chunk)] = self._search(chunk, k)
+        return scores, rows
+
+    def _search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        n_probe = min(self.n_probe, len(self.centroids))
+        centroid_scores = queries @ self.centroids.T
+        if self.metric == "euclidean":
+            centroid_scores -= (self.centroids ** 2).sum(axis=1) / 2
+        _, probes = _top_k(centroid_scores, n_probe)
+        # visit each probed list once, with every query that probes it
+        probed_lists, query_ids = probes.reshape(-1), np.repeat(np.arange(len(queries)), n_probe)
+        visit_order = np.argsort(probed_lists, kind="stable")
+        probed_lists, query_ids = probed_lists[visit_order], query_ids[visit_order]
+        bounds = np.flatnonzero(np.diff(probed_lists)) + 1
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_positions = np.full((len(queries), k), -1, dtype=np.int64)
+        for members in np.split(np.arange(len(probed_lists)), bounds):
+            if not len(members):
+                continue
+            list_id = probed_lists[members[0]]
+            start, stop = self.list_offsets[list_id], self.list_offsets[list_id + 1]
+            if start == stop:
+                continue
+            members = query_ids[members]
+            list_scores = self._score(queries[members], start, stop)
+            candidate_scores = np.concatenate([best_scores[members], list_scores], axis=1)
+            candidate_positions = np.concatenate(
+                [best_positions[members], np.broadcast_to(np.arange(start, stop), list_scores.shape)], axis=1
+            )
+            top_scores, top = _top_k(candidate_scores, k)
+            best_scores[members] = top_scores
+            best_positions[members] = np.where(
+                top == -1, -1, np.take_along_axis(candidate_positions, np.maximum(top, 0), axis=1)
+            )
+        rows = np.where(best_positions == -1, -1, self._order[np.maximum(best_positions, 0)])
+        return self._finish(queries, best_scores, rows)
+
+
+def search_chunks(
+    index: DecodingIndex,
+    queries: Queries,
+    k: int = 1,
+    workers: int = 1,
+    memory_limit: int = DEFAULT_MEMORY_LIMIT,
+    chunk_size: Optional[int] = None,
+    **search_kwargs
+) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+    """search many queries in fixed-size chunks on a thread pool, yielding results in order
+
+    Queries may be an array (including a `np.memmap`, which is only read a chunk at a time) or
+    an iterable of arrays, e.g. batches of model outputs, which are re-chunked. The score
+    matrices of the chunks in flight take at most about `memory_limit` bytes. Matrix products and
+    numpy's reductions release the GIL, so throughput grows with `workers` (limit BLAS to one
+    thread per worker, e.g. with OMP_NUM_THREADS=1, to avoid oversubscribing the cores).
+
+    Args:
+        index (DecodingIndex): fitted index
+        queries (Queries): query vectors of shape (n, num_embedding_dimensions), or batches of them
+        k (int): number of results per query. Defaults to 1.
+        workers (int): number of threads, where -1 means one per CPU. Defaults to 1.
+        memory_limit (int): bytes for the score matrices. Defaults to 256 MiB.
+        chunk_size (int, optional): queries per chunk. Defaults to the most that fit in `memory_limit`.
+        search_kwargs: arguments of `index.search`. When `queries` is an array, array arguments with
+            one entry per query (e.g. the `within` of `TreeIndex`) are chunked along with it.
+
+    Yields:
+        Tuple[int, np.ndarray, np.ndarray]: position of the chunk's first query, and its scores and rows
+    """
+    workers = _parallel.resolve_workers(workers)
+    if chunk_size is None:
+        # the chunks being scored, plus those queued by imap, each hold a score matrix
+        bytes_per_query = 4 * (max(len(index), 1) + k)
+        chunk_size = max(1, memory_limit // ((2 * workers + 1) * bytes_per_query))
+
+    def chunks():
+        if isinstance(queries, np.ndarray):
+            for start in range(0, len(queries), chunk_size):
+                kwargs = {
+                    name: value[start:start + chunk_size]
+                    if isinstance(value, np.ndarray) and value.ndim and len(value) == len(queries) else value
+                    for name, value in search_kwargs.items()
+                }
+                yield start, queries[start:start + chunk_size], kwargs
+            return
+        start, pending = 0, []
+        for batch in queries:
+            pending.append(np.atleast_2d(batch))
+            while sum(map(len, pending)) >= chunk_size:
+                merged = np.concatenate(pending)
+                yield start, merged[:chunk_size], search_kwargs
+                start, pending = start + chunk_size, [merged[chunk_size:]]
+        if pending and sum(map(len, pending)):
+            yield start, np.concatenate(pending), search_kwargs
+
+    def search(chunk):
+        start, chunk_queries, kwargs = chunk
+        scores, rows = index.search(np.asarray(chunk_queries, dtype=np.float32), k, **kwargs)
+        return start, scores, rows
+
+    yield from _parallel.imap(search, chunks(), workers)
+
+
+def _top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """the k highest scores of each row and their columns, best first, padded with -inf and -1
+
+    `scores` may be overwritten. For small k, k passes of argmax (over the maxima of blocks of
+    columns, then over the columns of the best blocks) are several times faster than
+    `np.argpartition`, which dominates the cost of exact search otherwise.
+    """
+    n, m = scores.shape
+    if 1 < k <= _ARGMAX_TOP_K and 4 * k * _BLOCK < m:
+        # the top k are in the k blocks of columns with the highest maxima
+        _, blocks = _top_k(np.maximum.reduceat(scores, np.arange(0, m, _BLOCK), axis=1), k)
+        columns = (blocks[:, :, None] * _BLOCK + np.arange(_BLOCK)).reshape(n, -1)
+        candidates = np.where(columns < m, np.take_along_axis(scores, np.minimum(columns, m - 1), axis=1), -np.inf)
+        top, positions = _top_k(candidates, k)
+        return top, np.where(positions == -1, -1, np.take_along_axis(columns, np.maximum(positions, 0), axis=1))
+    if k <= _ARGMAX_TOP_K:
+        top = np.full((n, k), -np.inf, dtype=scores.dtype)
+        columns = np.full((n, k), -1, dtype=np.int64)
+        rows = np.arange(n)
+        for i in range(min(k, m)):
+            columns[:, i] = scores.argmax(axis=1)
+            top[:, i] = scores[rows, columns[:, i]]
+            scores[rows, columns[:, i]] = -np.inf
+        return top, np.where(np.isneginf(top), -1, columns)
+    columns = np.argpartition(scores, m - k, axis=1)[:, m - k:] if k < m else np.broadcast_to(np.arange(m), (n, m))
+    top = np.take_along_axis(scores, columns, axis=1)
+    order = np.argsort(-top, axis=1, kind="stable")
+    top, columns = np.take_along_axis(top, order, axis=1), np.take_along_axis(columns, order, axis=1)
+    if m < k:
+        top = np.concatenate([top, np.full((n, k - m), -np.inf, dtype=top.dtype)], axis=1)
+        columns = np.concatenate([columns, np.full((n, k - m), -1, dtype=columns.dtype)], axis=1)
+    return top, np.where(np.isneginf(top), -1, columns)
+
+
+def _kmeans(vectors: np.ndarray, n_clusters: int, iterations: int, rng: np.random.Generator):
+    """Lloyd's k-means, with centroids initialized to random embeddings"""
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)]
+    assignments = _assign(vectors, centroids)
+    for _ in range(iterations):
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=n_clusters)
+        filled = np.flatnonzero(counts)
+        offsets = np.concatenate([[0], np.cumsum(counts)])[filled]
+        centroids = centroids.copy()
+        centroids[filled] = np.add.reduceat(vectors[order], offsets, axis=0) / counts[filled, None]
+        empty = counts == 0
+        if empty.any():  # restart empty clusters from random embeddings
+            centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        assignments = _assign(vectors, centroids)
+    return centroids, assignments
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 4096) -> np.ndarray:
+    """nearest centroid of each vector"""
+    half_norms = (centroids ** 2).sum(axis=1) / 2
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        assignments[start:start + chunk_size] = (vectors[start:start + chunk_size] @ centroids.T - half_norms).argmax(axis=1)
+    return assignments
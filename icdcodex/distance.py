@@ -0,0 +1,105 @@
+"""batched hierarchical distances and similarities between sets of ICD codes"""
+
+from typing import Callable, Optional
+import itertools
+import numpy as np
+from . import _parallel
+from .ancestry import AncestryIndex, Nodes
+
+METRICS = ["path", "wu_palmer", "resnik", "lin"]
+
+
+def information_content(index: AncestryIndex) -> np.ndarray:
+    """intrinsic information content of every node, -log(leaves under the node / all leaves)
+
+    Args:
+        index (AncestryIndex): index of the hierarchy
+
+    Returns:
+        np.ndarray: information content, indexed by node id (0 for the root)
+    """
+    tree = index.tree
+    is_leaf = np.diff(tree.child_offsets) == 0
+    leaves_before = np.concatenate([[0], np.cumsum(is_leaf)])
+    node_ids = np.arange(len(tree))
+    leaves_under = leaves_before[node_ids + tree.subtree_sizes] - leaves_before[node_ids]
+    return (np.log(leaves_before[-1]) - np.log(leaves_under)).astype(np.float32)
+
+
+def pairwise_distances(
+    index: AncestryIndex,
+    a: Nodes,
+    b: Optional[Nodes] = None,
+    metric: str = "path",
+    out: Optional[np.ndarray] = None,
+    callback: Optional[Callable[[int, int, np.ndarray], None]] = None,
+    chunk_size: int = 512,
+    workers: int = 1,
+) -> Optional[np.ndarray]:
+    """compute the distance (or similarity) between every code in `a` and every code in `b`
+
+    The matrix is computed in `chunk_size` x `chunk_size` blocks from the depth and lowest
+    common ancestor arrays of `index`. Blocks are written into `out` (which may be a
+    `np.memmap` when the matrix does not fit in memory) and/or passed to `callback`.
+
+    Metrics:
+        - path: number of edges on the path between the codes, through their lowest common ancestor
+        - wu_palmer: 2 * depth(lca) / (depth(a) + depth(b))
+        - resnik: information content of the lowest common ancestor
+        - lin: 2 * IC(lca) / (IC(a) + IC(b))
+
+    Args:
+        index (AncestryIndex): index of the hierarchy
+        a (Nodes): codes (or node ids) for the rows
+        b (Nodes, optional): codes (or node ids) for the columns. If None, use `a`. Defaults to None.
+        metric (str): one of "path", "wu_palmer", "resnik" or "lin". Defaults to "path".
+        out (np.ndarray, optional): len(a) x len(b) array to fill. If None and no `callback`
+            is given, a new array is allocated. Defaults to None.
+        callback (Callable[[int, int, np.ndarray], None], optional): called with the first row,
+            first column and values of each block, in row-major order, from the calling thread.
+            Defaults to None.
+        chunk_size (int): rows and columns per block. Defaults to 512.
+        workers (int): threads computing blocks. If -1, use all available. Defaults to 1.
+
+    Raises:
+        ValueError: If the metric is unknown
+
+    Returns:
+        Optional[np.ndarray]: `out`, or None if only `callback` was given
+    """
+    if metric not in METRICS:
+        raise ValueError(f"metric must be one of {METRICS}, but got {metric}")
+    a = index.ids(a).ravel()
+    b = a if b is None else index.ids(b).ravel()
+    if out is None and callback is None:
+        out = np.empty((len(a), len(b)), dtype=np.int32 if metric == "path" else np.float32)
+    ic = information_content(index) if metric in ("resnik", "lin") else None
+    depths = np.asarray(index.tree.depths, dtype=np.int32)
+
+    def block(origin):
+        i, j = origin
+        rows, cols = a[i:i + chunk_size, None], b[None, j:j + chunk_size]
+        lca = index.lca(rows, cols)
+        if metric == "path":
+            values = depths[rows] + depths[cols] - 2 * depths[lca]
+        elif metric == "wu_palmer":
+            values = _ratio(2 * depths[lca], depths[rows] + depths[cols])
+        elif metric == "resnik":
+            values = ic[lca]
+        else:
+            values = _ratio(2 * ic[lca], ic[rows] + ic[cols])
+        if out is not None:
+            out[i:i + values.shape[0], j:j + values.shape[1]] = values
+        return i, j, values
+
+    origins = itertools.product(range(0, len(a), chunk_size), range(0, len(b), chunk_size))
+    for i, j, values in _parallel.imap(block, origins, workers):
+        if callback is not None:
+            callback(i, j, values)
+    return out
+
+
+def _ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    """numerator / denominator, taking 0 / 0 to mean identical codes (similarity 1)"""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(denominator == 0, 1, numerator / denominator).astype(np.float32)
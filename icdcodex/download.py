@@ -0,0 +1,207 @@
+"""pooled, cached and resumable downloads of the files that the hierarchies are built from"""
+
+from typing import Dict, List, Optional, Sequence
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import warnings
+from pathlib import Path
+from . import _parallel
+
+# requests is imported when the first session is created, to keep `import icdcodex.download` cheap
+
+DEFAULT_CACHE_DIR = Path(os.environ.get("ICDCODEX_CACHE_DIR", Path.home() / ".cache" / "icdcodex"))
+
+
+class Downloader:
+    """download files through one pooled HTTP session into a content-addressed cache
+
+    Files are stored under `objects/` by the sha256 of their content, and each url
+    records which object it last resolved to along with its ETag and Last-Modified
+    headers. Fetching a cached url only revalidates it (a 304 costs no body), and an
+    interrupted download resumes from its partial file with a Range request.
+
+    Args:
+        cache_dir (Pathlike, optional): cache directory. Defaults to `DEFAULT_CACHE_DIR`, which
+            the ICDCODEX_CACHE_DIR environment variable overrides.
+        pool_size (int): maximum number of connections kept open per host. Defaults to 8.
+        retries (int): number of times to retry failed connections. Defaults to 3.
+        timeout (float): seconds to wait for the server to respond. Defaults to 60.
+        chunk_size (int): bytes read from the network at a time. Defaults to 64 KiB.
+    """
+
+    def __init__(
+        self,
+        cache_dir=None,
+        pool_size: int = 8,
+        retries: int = 3,
+        timeout: float = 60,
+        chunk_size: int = 1 << 16,
+    ):
+        self.cache_dir = Path(DEFAULT_CACHE_DIR if cache_dir is None else cache_dir)
+        self.pool_size = pool_size
+        self.retries = retries
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self._session = None
+        self._lock = threading.Lock()
+        self._url_locks: Dict[str, threading.Lock] = {}
+
+    @property
+    def session(self):
+        """the shared `requests.Session`, created on first use"""
+        with self._lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=self.retries
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            return self._session
+
+    def fetch(self, url: str) -> Path:
+        """download a url, unless the cached copy is still current
+
+        If the server cannot be reached but the url was downloaded before, the cached copy
+        is returned with a warning.
+
+        Args:
+            url (str): url to download
+
+        Returns:
+            Path: path of the downloaded file in the cache, which must not be modified
+        """
+        import requests
+
+        with self._url_lock(url):
+            record = self._read_record(url)
+            cached = None if record is None else self._object(record["sha256"])
+            if cached is not None and not cached.exists():
+                cached = None
+            try:
+                return self._fetch(url, record if cached is not None else None)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if cached is None:
+                    raise
+                warnings.warn(f"could not revalidate {url} ({e}), using the cached copy")
+                return cached
+
+    def fetch_all(self, urls: Sequence[str], workers: int = -1) -> List[Path]:
+        """download several urls concurrently, see `fetch`
+
+        Args:
+            urls (Sequence[str]): urls to download
+            workers (int): number of concurrent downloads, where -1 means one per url (up to the
+                connection pool size). Defaults to -1.
+
+        Returns:
+            List[Path]: paths of the downloaded files, in the order of `urls`
+        """
+        if workers == -1:
+            workers = min(len(urls), self.pool_size)
+        return list(_parallel.imap(self.fetch, urls, workers))
+
+    def _fetch(self, url: str, record: Optional[dict]) -> Path:
+        headers = {"Accept-Encoding": "identity"}  # byte ranges must refer to the stored bytes
+        if record is not None:
+            if record.get("etag"):
+                headers["If-None-Match"] = record["etag"]
+            if record.get("last_modified"):
+                headers["If-Modified-Since"] = record["last_modified"]
+        part, part_record = self._partial(url)
+        offset = part.stat().st_size if part.exists() else 0
+        validator = part_record.get("etag") or part_record.get("last_modified")
+        if offset and validator:
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = validator
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as r:
+            if r.status_code == 304 and record is not None:
+                return self._object(record["sha256"])
+            if r.status_code == 416:  # the partial file is stale, e.g. the file shrank
+                part.unlink()
+                return self._fetch(url, record)
+            r.raise_for_status()
+            validators = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+            h = hashlib.sha256()
+            if r.status_code == 206:
+                with open(part, "rb") as f:
+                    for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                        h.update(chunk)
+                mode = "ab"
+            else:
+                mode = "wb"
+            _write_json(part.with_name(part.name + ".json"), dict(validators, url=url))
+            with open(part, mode) as f:
+                for chunk in r.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+                    h.update(chunk)
+        sha256 = h.hexdigest()
+        fp = self._object(sha256)
+        fp.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(part, fp)
+        _write_json(self._record_path(url), dict(validators, url=url, sha256=sha256, size=fp.stat().st_size))
+        part.with_name(part.name + ".json").unlink()
+        return fp
+
+    def _url_lock(self, url: str) -> threading.Lock:
+        with self._lock:
+            return self._url_locks.setdefault(url, threading.Lock())
+
+    def _object(self, sha256: str) -> Path:
+        return self.cache_dir / "objects" / sha256
+
+    def _record_path(self, url: str) -> Path:
+        return self.cache_dir / "urls" / f"{_url_key(url)}.json"
+
+    def _read_record(self, url: str) -> Optional[dict]:
+        fp = self._record_path(url)
+        return json.loads(fp.read_text()) if fp.exists() else None
+
+    def _partial(self, url: str):
+        part = self.cache_dir / "partial" / f"{_url_key(url)}.part"
+        part.parent.mkdir(parents=True, exist_ok=True)
+        part_record = part.with_name(part.name + ".json")
+        if part.exists() and part_record.exists():
+            return part, json.loads(part_record.read_text())
+        return part, {}
+
+
+_downloaders: Dict[Path, Downloader] = {}
+_downloaders_lock = threading.Lock()
+
+
+def downloader(cache_dir=None) -> Downloader:
+    """the process-wide `Downloader` of a cache directory, so that its connections are reused"""
+    cache_dir = Path(DEFAULT_CACHE_DIR if cache_dir is None else cache_dir)
+    with _downloaders_lock:
+        if cache_dir not in _downloaders:
+            _downloaders[cache_dir] = Downloader(cache_dir)
+        return _downloaders[cache_dir]
+
+
+def fetch(url: str, cache_dir=None) -> Path:
+    """download a url through the shared `Downloader` of `cache_dir`, see `Downloader.fetch`"""
+    return downloader(cache_dir).fetch(url)
+
+
+def fetch_all(urls: Sequence[str], cache_dir=None, workers: int = -1) -> List[Path]:
+    """download urls concurrently through the shared `Downloader` of `cache_dir`"""
+    return downloader(cache_dir).fetch_all(urls, workers)
+
+
+def _url_key(url: str) -> str:
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+def _write_json(fp: Path, obj):
+    fp.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", dir=fp.parent, suffix=".tmp", delete=False) as f:
+        json.dump(obj, f)
+    os.replace(f.name, fp)
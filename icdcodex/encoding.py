@@ -0,0 +1,144 @@
+"""normalize ICD code formatting and encode codes as dense integer node ids, without a python loop per code"""
+
+from typing import Dict, Sequence, Union
+import re
+import numpy as np
+from .tree import IcdTree
+
+Codes = Union[Sequence[str], np.ndarray]
+
+# codes are packed into int64 keys as base-37 numbers: 0 pads, 1-10 are digits and 11-36 letters
+_BASE = 37
+_MAX_LENGTH = 12
+
+# node names that look like codes (e.g., "E10.32" or "0010"), unlike chapters and sections
+CODE_PATTERN = re.compile(r"[0-9A-Z][0-9A-Z.]*")
+
+
+def format_icd10cm(code: str) -> str:
+    """add the decimal point that the CMS code description files omit, e.g. E1032 -> E10.32"""
+    if 3 < len(code) and "." not in code:
+        code = "{}.{}".format(code[:3], code[3:])
+    return code
+
+
+def normalize(codes: Codes) -> np.ndarray:
+    """strip whitespace and decimal points and uppercase, e.g. " e10.32" -> "E1032"
+
+    Args:
+        codes (Codes): codes, e.g. a list, a numpy string array or a pandas Series
+
+    Returns:
+        np.ndarray: normalized codes, as a numpy string array of the same shape
+    """
+    codes = np.asarray(codes)
+    if codes.dtype.kind != "U":
+        codes = codes.astype(str)
+    width = max(1, codes.dtype.itemsize // 4)
+    chars = np.ascontiguousarray(codes, dtype=f"<U{width}").view(np.uint32).reshape(-1, width)
+    chars = np.where((97 <= chars) & (chars <= 122), chars - 32, chars)  # ascii uppercase
+    keep = (chars > 32) & (chars != 46) & (chars != 160)  # whitespace, ".", nbsp and padding
+    rows, _ = np.nonzero(keep)
+    out = np.zeros_like(chars)
+    out[rows, np.cumsum(keep, axis=1)[keep] - 1] = chars[keep]
+    return out.view(f"<U{width}").reshape(codes.shape)
+
+
+def _pack(codes: Codes) -> np.ndarray:
+    """normalize codes into base-37 int64 keys, or -1 if a code cannot be an ICD code
+
+    Keys are accumulated one character position at a time (Horner's rule), so the work is
+    a handful of numpy operations per character position rather than per code.
+    """
+    codes = np.asarray(codes)
+    if codes.dtype.kind != "U":
+        codes = codes.astype(str)
+    shape = codes.shape
+    codes = np.ascontiguousarray(codes).reshape(-1)
+    width = codes.dtype.itemsize // 4
+    chars = codes.view(np.uint32).reshape(len(codes), width)
+    keys = np.zeros(len(codes), dtype=np.int64)
+    lengths = np.zeros(len(codes), dtype=np.int64)
+    valid = np.ones(len(codes), dtype=bool)
+    for column in chars.T:
+        column = np.where((97 <= column) & (column <= 122), column - 32, column)  # ascii uppercase
+        digit = np.where(
+            (48 <= column) & (column <= 57), column - 47, np.where((65 <= column) & (column <= 90), column - 54, 0)
+        ).astype(np.int64)
+        skipped = (column <= 32) | (column == 46) | (column == 160)  # whitespace, ".", nbsp and padding
+        valid &= skipped | (digit > 0)
+        keys = np.where(skipped, keys, keys * _BASE + digit)
+        lengths += ~skipped
+    valid &= (0 < lengths) & (lengths <= _MAX_LENGTH)
+    keys *= _BASE ** (_MAX_LENGTH - np.minimum(lengths, _MAX_LENGTH))
+    return np.where(valid, keys, -1).reshape(shape)
+
+
+class CodeEncoder:
+    """map ICD codes in any common formatting to the dense integer node ids of a hierarchy
+
+    Codes are normalized (see `normalize`), so "E1032", "e10.32" and "E10.32 " all encode
+    to the node id of E10.32. Only nodes named like codes (e.g., "E10", "E10.3" or "0010")
+    can be looked up, not chapters or sections named by their description.
+
+    Args:
+        tree (IcdTree): ICD hierarchy
+    """
+
+    def __init__(self, tree: IcdTree):
+        self.tree = tree
+        names = list(tree.names)
+        node_ids = np.array([i for i, name in enumerate(names) if CODE_PATTERN.fullmatch(name)], dtype=np.int32)
+        keys = _pack([names[i] for i in node_ids])
+        order = np.argsort(keys, kind="stable")
+        # a sentinel that matches no code keeps searchsorted results in bounds
+        self._keys = np.append(keys[order], np.iinfo(np.int64).max)
+        self._node_ids = np.append(node_ids[order], -1).astype(np.int32)
+        self._names = np.array(names + [None], dtype=object)  # index -1 decodes to None
+
+    def encode(self, codes: Codes, errors: str = "raise") -> np.ndarray:
+        """node ids of codes
+
+        Args:
+            codes (Codes): codes, in any formatting accepted by `normalize`
+            errors (str): If "raise", raise a KeyError for unknown codes. If "coerce", encode them
+                as -1. Defaults to "raise".
+
+        Raises:
+            KeyError: If `errors` is "raise" and some codes are not in the hierarchy
+
+        Returns:
+            np.ndarray: int32 node ids, with the same shape as `codes`
+        """
+        if errors not in ("raise", "coerce"):
+            raise ValueError(f"errors must be 'raise' or 'coerce', but got {errors}")
+        codes = np.asarray(codes)
+        keys = _pack(codes)
+        position = np.searchsorted(self._keys, keys)
+        found = (self._keys[position] == keys) & (keys != -1)
+        ids = np.where(found, self._node_ids[position], -1).astype(np.int32)
+        if errors == "raise" and not found.all():
+            unknown = codes[~found]
+            raise KeyError(f"{len(unknown)} codes are not in the hierarchy, e.g. {list(unknown[:5])}")
+        return ids
+
+    def decode(self, ids: Union[Sequence[int], np.ndarray]) -> np.ndarray:
+        """canonical node names of node ids, with None for -1
+
+        Returns:
+            np.ndarray: object array of node names, with the same shape as `ids`
+        """
+        return self._names[np.asarray(ids)]
+
+    def unknown(self, codes: Codes) -> Dict[str, int]:
+        """report codes that are not in the hierarchy
+
+        Returns:
+            Dict[str, int]: number of occurrences of each unknown code, as written in `codes`
+        """
+        codes = np.asarray(codes)
+        unknown, counts = np.unique(codes[self.encode(codes, errors="coerce") == -1].astype(str), return_counts=True)
+        return dict(zip(unknown.tolist(), counts.tolist()))
+
+    def __contains__(self, code: str) -> bool:
+        return bool(self.encode([code], errors="coerce")[0] != -1)
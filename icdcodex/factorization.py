@@ -0,0 +1,79 @@
+"""closed-form embeddings of an ICD hierarchy, from a truncated SVD of its ancestor matrix"""
+
+from typing import TYPE_CHECKING, Optional
+import numpy as np
+from .tree import IcdTree
+
+if TYPE_CHECKING:
+    import scipy.sparse
+
+
+def ancestor_matrix(tree: IcdTree, alpha: float = 0.5) -> "scipy.sparse.csr_matrix":
+    """sparse matrix with a row per node and a column per ancestor, the root excepted
+
+    Entry (i, j) is `subtree_sizes[j] ** -alpha` if j is i or one of its ancestors, and 0
+    otherwise, so the dot product of two rows sums the weights of the ancestors they share.
+    With alpha=0.5, every column has unit norm, so that the few large chapters do not outweigh
+    the many small categories.
+
+    Args:
+        tree (IcdTree): ICD hierarchy
+        alpha (float): how much less the ancestors of larger subtrees weigh. Defaults to 0.5.
+
+    Returns:
+        scipy.sparse.csr_matrix: float64 matrix of shape (len(tree), len(tree))
+    """
+    import scipy.sparse
+
+    n = len(tree)
+    parent_ids = np.asarray(tree.parent_ids)
+    rows, cols = [], []
+    descendants, ancestors = np.arange(n), np.arange(n)
+    # climb one level per step, until every node has reached the root (which is left out)
+    while True:
+        below_root = parent_ids[ancestors] != -1
+        descendants, ancestors = descendants[below_root], ancestors[below_root]
+        if not len(ancestors):
+            break
+        rows.append(descendants)
+        cols.append(ancestors)
+        ancestors = parent_ids[ancestors]
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    weights = np.asarray(tree.subtree_sizes, dtype=np.float64)[cols] ** -alpha
+    return scipy.sparse.csr_matrix((weights, (rows, cols)), shape=(n, n))
+
+
+def svd_embedding(
+    tree: IcdTree,
+    num_embedding_dimensions: int = 128,
+    alpha: float = 0.5,
+    n_iter: int = 4,
+    seed: Optional[int] = None,
+) -> np.ndarray:
+    """embed every node of a hierarchy with a randomized truncated SVD of its `ancestor_matrix`
+
+    The embedding of a node is its row of U * S, so dot products between embeddings approximate
+    the weighted number of shared ancestors. Nodes under the same parent end up close, and each
+    node keeps its own direction, so that every code decodes back to itself. Unlike random
+    walks, this takes seconds and is deterministic given `seed`.
+
+    Args:
+        tree (IcdTree): ICD hierarchy
+        num_embedding_dimensions (int): number of dimensions. Defaults to 128.
+        alpha (float): weighting of the ancestors, see `ancestor_matrix`. Defaults to 0.5.
+        n_iter (int): power iterations of the randomized SVD. Defaults to 4.
+        seed (int, optional): seed of the randomized SVD. Defaults to None.
+
+    Returns:
+        np.ndarray: float32 embeddings of shape (len(tree), num_embedding_dimensions), in node id
+            order, padded with zeros when the tree has fewer nodes than dimensions
+    """
+    from sklearn.utils.extmath import randomized_svd
+
+    matrix = ancestor_matrix(tree, alpha)
+    embeddings = np.zeros((len(tree), num_embedding_dimensions), dtype=np.float32)
+    rank = min(num_embedding_dimensions, len(tree) - 1)
+    if rank > 0:
+        u, s, _ = randomized_svd(matrix, rank, n_iter=n_iter, random_state=seed)
+        embeddings[:, :rank] = u * s
+    return embeddings
@@ -1,54 +1,218 @@
 """deserialize icd hierarchies computed in datacleaning.py"""
 
-from typing import Optional, Sequence, Tuple
+from typing import TYPE_CHECKING, Any, Callable, Hashable, Optional, Sequence, Tuple, TypeVar, Union
 import json
+import threading
+from collections import OrderedDict, namedtuple
 from datetime import datetime
-import networkx as nx
 from . import data
+from .tree import IcdTree
+
+if TYPE_CHECKING:
+    import networkx as nx
 
 try:
     import importlib.resources as importlib_resources
 except ModuleNotFoundError:
     import importlib_resources
 
+ICD10CM_VERSIONS = ["2019", "2020", "2021", "2022", "2023", "2024"]
+
+T = TypeVar("T")
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class HierarchyCache:
+    """process-wide, thread-safe cache of deserialized hierarchies with LRU eviction
+
+    Entries are keyed by (revision, version) and hold each representation of that
+    hierarchy that has been requested so far (e.g., the `IcdTree` and its networkx graph).
+    At most `maxsize` versions stay resident; the least recently used one is evicted first.
+
+    Args:
+        maxsize (int, optional): maximum number of resident versions. If None, the cache is
+            unbounded. If 0, nothing is cached. Defaults to 4.
+    """
+
+    def __init__(self, maxsize: Optional[int] = 4):
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._lock = threading.RLock()
+        self._hits = self._misses = 0
+
+    @property
+    def maxsize(self) -> Optional[int]:
+        return self._maxsize
+
+    @maxsize.setter
+    def maxsize(self, maxsize: Optional[int]):
+        with self._lock:
+            self._maxsize = maxsize
+            self._evict()
+
+    def get(self, key: Tuple[str, Optional[str]], kind: Hashable, load: Callable[[], Any]) -> Any:
+        """return a cached representation, loading it if need be
 
-def icd9() -> Tuple[nx.Graph, Sequence[str]]:
+        Concurrent requests for the same missing representation load it only once.
+
+        Args:
+            key (Tuple[str, Optional[str]]): revision and version, e.g. ("icd10cm", "2022")
+            kind (Hashable): which representation of the hierarchy, e.g. `IcdTree` or "networkx"
+            load (Callable[[], Any]): loads the representation on a miss
+
+        Returns:
+            Any: the cached representation, shared with every other caller
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and kind in entry:
+                return self._hit(key, entry[kind])
+            loading = self._loading.setdefault((key, kind), threading.Lock())
+        with loading:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and kind in entry:
+                    return self._hit(key, entry[kind])
+                self._misses += 1
+            try:
+                value = load()
+                with self._lock:
+                    self._entries.setdefault(key, {})[kind] = value
+                    self._entries.move_to_end(key)
+                    self._evict()
+            finally:
+                with self._lock:
+                    self._loading.pop((key, kind), None)
+        return value
+
+    def invalidate(self, revision: str, version: Optional[str] = None):
+        """drop every representation of one hierarchy, e.g. after rebuilding its data files"""
+        with self._lock:
+            self._entries.pop((revision, version), None)
+
+    def clear(self):
+        """drop every cached hierarchy and reset the statistics"""
+        with self._lock:
+            self._entries.clear()
+            self._hits = self._misses = 0
+
+    def info(self) -> CacheInfo:
+        """hit and miss statistics, in the style of functools.lru_cache"""
+        with self._lock:
+            return CacheInfo(self._hits, self._misses, self._maxsize, len(self._entries))
+
+    def _hit(self, key, value):
+        self._entries.move_to_end(key)
+        self._hits += 1
+        return value
+
+    def _evict(self):
+        while self._maxsize is not None and len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+
+cache = HierarchyCache()
+
+
+def icd9(as_networkx: bool = True) -> Tuple[Union["nx.Graph", IcdTree], Sequence[str]]:
     """deserialize icd9 hierarchy
 
+    Hierarchies are cached (see `cache`), so repeated calls return the same read-only
+    objects. Use `nx.DiGraph(G)` to get a copy that can be modified.
+
+    Args:
+        as_networkx (bool): If False, return the memory-mapped `IcdTree` instead of building a
+            networkx graph. Defaults to True.
+
     Returns:
-        Tuple[nx.Graph, Sequence[str]]: ICD9 hierarchy and codes
+        Tuple[Union[nx.Graph, IcdTree], Sequence[str]]: ICD9 hierarchy and codes
     """
-    with importlib_resources.open_text(data, "icd-9-hierarchy.json") as f:
-        hierarchy = json.load(f)
-    return (
-        nx.readwrite.json_graph.tree_graph(
-            hierarchy["tree"],
-            attrs=dict(id='id', children='children', description='description')
-        ),
-        hierarchy["codes"],
-    )
+    return _cached("icd9", None, as_networkx)
 
 
-def icd10cm(version: Optional[str] = None) -> Tuple[nx.Graph, Sequence[str]]:
+def icd10cm(version: Optional[str] = None, as_networkx: bool = True) -> Tuple[Union["nx.Graph", IcdTree], Sequence[str]]:
     """deserialize icd-10-cm hierarchy
 
+    Hierarchies are cached (see `cache`), so repeated calls return the same read-only
+    objects. Use `nx.DiGraph(G)` to get a copy that can be modified.
+
     Args:
         version (str, optional): icd-10-cm version, including 2019 to 2024. If None, use the system
             year. Defaults to None.
+        as_networkx (bool): If False, return the memory-mapped `IcdTree` instead of building a
+            networkx graph. Defaults to True.
 
     Returns:
-        Tuple[nx.Graph, Sequence[str]]: ICD-10-CM hierarchy and codes
+        Tuple[Union[nx.Graph, IcdTree], Sequence[str]]: ICD-10-CM hierarchy and codes
     """
     if version is None:
         version = str(datetime.now().year)
-    if version not in ["2019", "2020", "2021", "2022", "2023", "2024"]:
+    if version not in ICD10CM_VERSIONS:
         raise ValueError(
             f"icd-10-cm available from 2019 to 2024, but got {version}. If you want to use "
             f"a more recent version, please open a GitHub issue at https://github.com/icd-codex/icd-codex"
         )
-    with importlib_resources.open_text(data, f"icd-10-{version}-hierarchy.json") as f:
-        hierarchy = json.loads(f.read())
-    return (
-        nx.readwrite.json_graph.tree_graph(hierarchy["tree"]),
-        hierarchy["codes"],
-    )
+    return _cached("icd10cm", version, as_networkx)
+
+
+def resource_stem(revision: str, version: Optional[str] = None) -> str:
+    """common prefix of the packaged data files of a hierarchy, e.g. "icd-10-2022"
+
+    Args:
+        revision (str): "icd9" or "icd10cm"
+        version (str, optional): icd-10-cm version. Defaults to None.
+    """
+    return "icd-9" if revision == "icd9" else f"icd-10-{version}"
+
+
+def load_resource(filename: str, load: Callable[[Any], T]) -> Optional[T]:
+    """load a packaged data file by passing its path to `load`
+
+    Args:
+        filename (str): name of the file in the `data` submodule
+        load (Callable[[Any], T]): function that loads the file from a path
+
+    Returns:
+        Optional[T]: result of `load`, or None if the file is not packaged
+    """
+    if not importlib_resources.is_resource(data, filename):
+        return None
+    with importlib_resources.path(data, filename) as fp:
+        return load(fp)
+
+
+def _cached(revision: str, version: Optional[str], as_networkx: bool):
+    key = (revision, version)
+
+    def tree():
+        return cache.get(key, IcdTree, lambda: _as_tree(_load_tree(revision, version)))
+
+    if as_networkx:
+        # built from the cached `IcdTree`, so that the hierarchy is only loaded once
+        return cache.get(key, "networkx", lambda: _as_networkx(tree()[0]))
+    return tree()
+
+
+def _as_networkx(tree: IcdTree) -> Tuple["nx.DiGraph", Sequence[str]]:
+    import networkx as nx
+
+    return nx.freeze(tree.to_networkx()), tuple(tree.codes)
+
+
+def _as_tree(tree: IcdTree) -> Tuple[IcdTree, Sequence[str]]:
+    return tree, tree.codes
+
+
+def _load_tree(revision: str, version: Optional[str]) -> IcdTree:
+    """memory-map the packaged binary hierarchy, falling back to its JSON serialization"""
+    stem = resource_stem(revision, version)
+    tree = load_resource(f"{stem}-hierarchy.bin", IcdTree.load)
+    if tree is not None:
+        return tree
+    with importlib_resources.open_text(data, f"{stem}-hierarchy.json") as f:
+        hierarchy = json.load(f)
+    meta = {"revision": revision} if version is None else {"revision": revision, "version": version}
+    return IcdTree.from_tree_data(hierarchy["tree"], hierarchy["codes"], meta=meta)
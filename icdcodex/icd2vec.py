@@ -1,11 +1,43 @@
 """Build a vector embedding from a networkX representation of the ICD hierarchy"""
 
-from typing import Sequence, Union
-import multiprocessing
-import networkx as nx
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
+import json
+import os
+import pickle
+import tempfile
+import warnings
+from pathlib import Path
 import numpy as np
-from node2vec import Node2Vec
-from sklearn.neighbors import NearestNeighbors
+from .decoding import DEFAULT_MEMORY_LIMIT, DecodingIndex, ExactIndex, Queries, TreeIndex, search_chunks
+from .encoding import Codes, _pack, normalize
+from .quantization import dequantize, quantize
+from .tree import IcdTree
+
+if TYPE_CHECKING:
+    import networkx as nx
+
+# files of a saved model, see `Icd2Vec.save`
+MODEL_FORMAT = 1
+MODEL_EMBEDDINGS = "embeddings.npy"
+MODEL_METADATA = "metadata.json"
+MODEL_NEAREST_NEIGHBORS = "nn.pkl"
+
+# constructor arguments saved with a model
+_PARAMS = (
+    "num_embedding_dimensions",
+    "num_walks",
+    "walk_length",
+    "window",
+    "workers",
+    "p",
+    "q",
+    "directed",
+    "seed",
+    "walker",
+    "corpus",
+    "temp_folder",
+    "method",
+)
 
 
 class Icd2Vec:
@@ -16,12 +48,20 @@ class Icd2Vec:
         walk_length: int = 10,
         window: int = 4,
         workers=1,
+        p: float = 1.0,
+        q: float = 1.0,
+        directed: bool = True,
+        seed: Optional[int] = None,
+        walker: Optional[str] = None,
+        corpus: str = "memory",
+        temp_folder: Optional[str] = None,
+        method: str = "node2vec",
         **kwargs
     ):
         """scikit-learn style transformer to learn embeddings from the ICD hierarchy
 
-        Arguments specified in the constructor are passed to node2vec.Node2vec gensim.models.Word2Vec, and the
-        descriptions below are taken from their documentation
+        Arguments specified in the constructor are passed to the random walks and to gensim.models.Word2Vec,
+        and the descriptions below are taken from their documentation
 
         Args:
             num_embedding_dimensions (int): number of dimensions in which to embed the ICD hierarchy
@@ -29,59 +69,734 @@ class Icd2Vec:
             num_walks: Number of walks per node. Defaults to 10.
             walk_length (int): Number of nodes in each walk. Defaults to 10.
             workers (int, optional): Numbers of workers to perform walks. If -1, use all available. Defaults to 1.
-            kwargs: arguments passed to the Node2Vec constructor
+            p (float): Return hyper parameter. Defaults to 1.
+            q (float): Input parameter. Defaults to 1.
+            directed (bool): If False, walks go up the hierarchy as well as down. Defaults to True.
+            seed (int, optional): Seed for the random walks. Defaults to None.
+            walker (str, optional): "native" to generate the walks with `walks.RandomWalker`, or
+                "node2vec" to use the node2vec package. Defaults to "native", unless Node2Vec
+                arguments are given in `kwargs`, which selects "node2vec" with a DeprecationWarning
+                (pass walker="node2vec" to keep using them).
+            corpus (str): how the native walker feeds walks to Word2Vec: "memory" to generate
+                them all up front, "stream" to generate them again on every epoch, or "disk" to
+                write them to an int32 file that is memory-mapped on every epoch. Memory use
+                of the last two does not grow with `num_walks`. Defaults to "memory".
+            temp_folder (str, optional): directory of the walk file when corpus="disk". Defaults to
+                the system's temporary directory.
+            method (str): "node2vec" to learn the embeddings from random walks with Word2Vec, or
+                "svd" to compute them in closed form from the structure of the hierarchy (see
+                `factorization.svd_embedding`), which is much faster and deterministic given
+                `seed`, and ignores the walk and Word2Vec arguments. Defaults to "node2vec".
+            kwargs: arguments passed to the Node2Vec constructor (only with walker="node2vec",
+                the native walker ignores them with a warning)
         """
+        if walker is None:
+            walker = "node2vec" if kwargs else "native"
+            if kwargs:
+                warnings.warn(
+                    f"Node2Vec arguments ({', '.join(kwargs)}) select walker=\"node2vec\", but the default "
+                    "walker is now the native one: pass walker=\"node2vec\" explicitly to keep using them",
+                    DeprecationWarning,
+                    stacklevel=2,
+                )
+        if method not in ("node2vec", "svd"):
+            raise ValueError(f'method must be "node2vec" or "svd", but got {method!r}')
+        if walker not in ("native", "node2vec"):
+            raise ValueError(f'walker must be "native" or "node2vec", but got {walker!r}')
+        if corpus not in ("memory", "stream", "disk"):
+            raise ValueError(f'corpus must be "memory", "stream" or "disk", but got {corpus!r}')
+        if walker == "node2vec" and corpus != "memory":
+            raise ValueError(f'the node2vec walker keeps its walks in memory, but got corpus={corpus!r}')
+        if walker == "native" and kwargs:
+            warnings.warn(f"the native walker ignores the Node2Vec arguments {', '.join(kwargs)}", stacklevel=2)
         self.num_embedding_dimensions = num_embedding_dimensions
-        self.workers = workers if workers != -1 else multiprocessing.cpu_count()
+        self.workers = workers if workers != -1 else os.cpu_count()
         self.window = window
         self.num_walks = num_walks
         self.walk_length = walk_length
+        self.p = p
+        self.q = q
+        self.directed = directed
+        self.seed = seed
+        self.walker = walker
+        self.corpus = corpus
+        self.temp_folder = temp_folder
+        self.method = method
         self.node2vec_kwargs = kwargs
         self.node2vec = None
+        self.embeddings: Optional[np.ndarray] = None
+        self.ancestors: List[str] = []
+        self.scales: Optional[np.ndarray] = None
+        self.hierarchy_meta: Dict[str, Any] = {}
+        self.fit_kwargs: Dict[str, Any] = {}
+        self._nn = None
+        self._index = None
 
-    def fit(self, icd_hierarchy: nx.Graph, icd_codes: Sequence[str], **kwargs):
+    def fit(self, icd_hierarchy: Union["nx.Graph", IcdTree], icd_codes: Optional[Sequence[str]] = None, **kwargs):
         """construct vector embedding of all ICD codes
 
         Args:
-            icd_hierarchy (nx.Graph): Graph of ICD hierarchy
-            kwargs: arguments passed to the Node2Vec.fit
+            icd_hierarchy (Union[nx.Graph, IcdTree]): Graph of ICD hierarchy
+            icd_codes (Sequence[str], optional): ICD codes to embed. Defaults to the codes of
+                `icd_hierarchy`, if it is an `IcdTree`.
+            kwargs: arguments passed to gensim.models.Word2Vec, or to `factorization.svd_embedding`
+                with method="svd"
+        """
+        if isinstance(icd_hierarchy, IcdTree):
+            if icd_codes is None:
+                icd_codes = list(icd_hierarchy.codes)
+        elif icd_codes is None:
+            raise ValueError("icd_codes are required unless icd_hierarchy is an IcdTree")
+        if self.method == "svd":
+            self.node2vec = None
+            self._freeze_nodes(icd_codes, *self._fit_svd(icd_hierarchy, icd_codes, **kwargs))
+        else:
+            if self.walker == "native":
+                self.node2vec = self._fit_native(icd_hierarchy, icd_codes, **kwargs)
+            else:
+                self.node2vec = self._fit_node2vec(icd_hierarchy, **kwargs)
+            self._freeze_nodes(icd_codes, self.node2vec.wv.index_to_key, self.node2vec.wv.vectors)
+        self.hierarchy_meta = dict(icd_hierarchy.meta if isinstance(icd_hierarchy, IcdTree) else icd_hierarchy.graph)
+        self.fit_kwargs = dict(kwargs)
+
+    def update(
+        self,
+        icd_hierarchy: Union["nx.Graph", IcdTree],
+        icd_codes: Optional[Sequence[str]] = None,
+        previous: Union["nx.Graph", IcdTree, None] = None,
+        radius: int = 0,
+        relearn: float = 0.0,
+        **kwargs
+    ) -> "Icd2Vec":
+        """warm-start the embeddings on a new release of the hierarchy, e.g. the next ICD-10-CM year
+
+        Instead of fitting again, only the nodes that changed are trained: the nodes that are new
+        to the vocabulary and their parents, and, if the `previous` hierarchy is given, both ends
+        of every edge that was added or removed. Walks start from them (and from the nodes at
+        most `radius` edges away). New nodes start from the vector of their parent, and the vectors
+        of the other nodes are frozen (or trained at `relearn` times the learning rate), so that
+        the embeddings of unchanged codes do not drift. Codes that are not in `icd_codes` anymore
+        are dropped from `embeddings`, quantized models are quantized again, and the decoding
+        index is updated (see `decoding.DecodingIndex.update`).
+
+        Walks are generated with `walks.RandomWalker`, whichever `walker` the model was fit with.
+
+        Args:
+            icd_hierarchy (Union[nx.Graph, IcdTree]): Graph of the new ICD hierarchy
+            icd_codes (Sequence[str], optional): ICD codes to embed. Defaults to the codes of
+                `icd_hierarchy`, if it is an `IcdTree`.
+            previous (Union[nx.Graph, IcdTree], optional): hierarchy the model was fit on, to also
+                train the nodes whose parent or children changed. Defaults to None.
+            radius (int): number of edges around the changed nodes that walks also start from.
+                Defaults to 0.
+            relearn (float): learning rate multiplier of the vectors of the other nodes, from 0
+                (frozen) to 1 (trained like new ones). Defaults to 0.
+            kwargs: arguments passed to gensim.models.Word2Vec.train, e.g. epochs
+
+        Raises:
+            ValueError: If the model has no gensim model, i.e. it was loaded or quantized without
+                keep_model=True
+
+        Returns:
+            Icd2Vec: the model itself
+        """
+        from .walks import RandomWalker
+
+        if self.method == "svd":
+            raise ValueError("svd embeddings are computed in seconds: fit them again instead")
+        if self.node2vec is None:
+            raise ValueError("update needs the gensim model of a fit, which loaded and quantized models drop")
+        if isinstance(icd_hierarchy, IcdTree):
+            if icd_codes is None:
+                icd_codes = list(icd_hierarchy.codes)
+        elif icd_codes is None:
+            raise ValueError("icd_codes are required unless icd_hierarchy is an IcdTree")
+        tree = icd_hierarchy if isinstance(icd_hierarchy, IcdTree) else IcdTree.from_networkx(icd_hierarchy, icd_codes)
+        model, wv = self.node2vec, self.node2vec.wv
+        names = list(tree.names)
+        parent_ids = np.asarray(tree.parent_ids)
+        new = np.array([name not in wv.key_to_index for name in names], dtype=bool)
+        changed = new.copy()
+        changed[parent_ids[new & (parent_ids != -1)]] = True
+        if previous is not None:
+            node_ids = {name: i for i, name in enumerate(names)}
+            for edge in _edges(tree) ^ _edges(previous):
+                changed[[node_ids[name] for name in edge if name in node_ids]] = True
+        starts = np.flatnonzero(_neighbourhood(parent_ids, changed, radius))
+        if len(starts):
+            walker = RandomWalker(
+                tree, self.walk_length, self.num_walks, self.p, self.q, self.directed, self.seed, self.workers,
+                starts=starts,
+            )
+            sentences = walker.sentences()
+            model.build_vocab(sentences, update=True)
+            # preorder ids put parents before children, so new parents are initialized first
+            for i in np.flatnonzero(new & (parent_ids != -1)).tolist():
+                wv.vectors[wv.key_to_index[names[i]]] += wv.vectors[wv.key_to_index[names[parent_ids[i]]]]
+            lockf = np.full(len(wv), relearn, dtype=np.float32)
+            lockf[[wv.key_to_index[names[i]] for i in np.flatnonzero(new).tolist()]] = 1
+            wv.vectors_lockf = lockf
+            try:
+                model.train(sentences, total_examples=len(sentences), epochs=kwargs.pop("epochs", model.epochs), **kwargs)
+            finally:
+                wv.vectors_lockf = np.ones(1, dtype=np.float32)
+        dtype, index = str(self.embeddings.dtype), self._index
+        # nodes of the previous hierarchy that were removed stay in the vocabulary, but not in the model
+        self._freeze_nodes(icd_codes, names, wv.vectors[[wv.key_to_index[name] for name in names]])
+        if dtype != "float32":
+            self.quantize(dtype, keep_model=True)
+        self.hierarchy_meta = dict(icd_hierarchy.meta if isinstance(icd_hierarchy, IcdTree) else icd_hierarchy.graph)
+        if isinstance(index, TreeIndex):
+            index = TreeIndex(tree, icd_codes, index.metric, index.chunk_size, index.dtype)
+            self._index = index.fit(self.embeddings, self.scales)
+        elif index is not None:
+            self._index = index.update(self.embeddings, self.scales)
+        return self
+
+    def _freeze_nodes(self, icd_codes: Sequence[str], names: Sequence[str], vectors: np.ndarray):
+        """`_freeze` the vectors of `icd_codes`, and of the other nodes named like codes, which
+        `code_ids` falls back to (e.g. the non-billable E10.32 for E10.329)"""
+        rows = {str(name): row for row, name in enumerate(names)}
+        codes = {str(code) for code in icd_codes}
+        others = [str(name) for name in names if str(name) not in codes]
+        ancestors = [name for name, key in zip(others, _pack(others).tolist()) if key != -1]
+        rows = [rows[str(code)] for code in icd_codes] + [rows[name] for name in ancestors]
+        self._freeze(icd_codes, vectors[rows], ancestors=ancestors)
+
+    def _freeze(
+        self,
+        icd_codes: Sequence[str],
+        vectors: np.ndarray,
+        scales: Optional[np.ndarray] = None,
+        ancestors: Sequence[str] = (),
+    ):
+        """keep the vectors of `icd_codes` followed by those of `ancestors` as one contiguous
+        matrix, whose first rows are `embeddings`, and index its rows
+
+        float16 and int8 vectors (see `quantize`) are kept as they are, other types become float32.
+        """
+        self.icd_codes = icd_codes
+        dtype = vectors.dtype if vectors.dtype in (np.float16, np.int8) else np.float32
+        self._vectors = np.ascontiguousarray(vectors, dtype=dtype)
+        self.embeddings = self._vectors[:len(icd_codes)]
+        self.ancestors = list(ancestors)
+        self.scales = None if scales is None else np.asarray(scales, dtype=np.float32)
+        self._nn = None
+        self._code_names = np.array([*icd_codes, None], dtype=object)
+        self._index = None
+        self.code_index: Dict[str, int] = {str(code): row for row, code in enumerate(icd_codes)}
+        # codes are also looked up by their packed keys (see `encoding`), which is vectorized and
+        # ignores formatting; names that are not codes (key -1) go through `code_index` instead
+        keys = _pack([str(code) for code in icd_codes])
+        order = np.argsort(keys, kind="stable")
+        self._keys = np.append(keys[order], np.iinfo(np.int64).max)
+        self._key_rows = np.append(order, -1)
+        keys = _pack(self.ancestors)
+        order = np.argsort(keys, kind="stable")
+        self._ancestor_keys = np.append(keys[order], np.iinfo(np.int64).max)
+        self._ancestor_rows = np.append(len(icd_codes) + order, -1)
+
+    def quantize(self, dtype: str = "int8", keep_model: bool = False) -> "Icd2Vec":
+        """store the embeddings in fewer bytes, see `quantization.quantize`
+
+        float16 halves the memory of the embeddings and int8 divides it by about 4. Encoding
+        still returns float32 vectors, dequantized on the fly, and decoding scores the quantized
+        embeddings directly. Use `quantization_report` to measure what it costs in accuracy
+        before quantizing.
+
+        Args:
+            dtype (str): "float16", "int8", or "float32" to undo the quantization (which does
+                not recover the lost precision). Defaults to "int8".
+            keep_model (bool): If False, drop the gensim model (`node2vec`), which holds another
+                float32 copy of the embeddings. Defaults to False.
+
+        Raises:
+            ValueError: If model is not fit beforehand
+
+        Returns:
+            Icd2Vec: the model itself
         """
-        self.node2vec = Node2Vec(
+        if self.embeddings is None:
+            raise ValueError("model needs to be fit before")
+        vectors, scales = quantize(dequantize(self._vectors, self.scales), dtype)
+        self._freeze(self.icd_codes, vectors, scales, self.ancestors)
+        if not keep_model:
+            self.node2vec = None
+        return self
+
+    def quantization_report(self, dtypes: Sequence[str] = ("float16", "int8"), **kwargs) -> Dict[str, Dict[str, float]]:
+        """memory savings and decoding accuracy of each quantized type, see `quantization.report`
+
+        Args:
+            dtypes (Sequence[str]): quantized types to evaluate. Defaults to ("float16", "int8").
+            kwargs: arguments passed to `quantization.report`
+
+        Raises:
+            ValueError: If model is not fit beforehand, or is already quantized
+        """
+        from .quantization import report
+
+        if self.embeddings is None:
+            raise ValueError("model needs to be fit before")
+        if self.embeddings.dtype != np.float32:
+            raise ValueError(f"the embeddings are already quantized to {self.embeddings.dtype}")
+        return report(self.embeddings, dtypes, **kwargs)
+
+    def _fit_native(self, icd_hierarchy: Union["nx.Graph", IcdTree], icd_codes: Sequence[str], **kwargs):
+        from gensim.models import Word2Vec
+        from .walks import RandomWalker, WalkCorpus
+
+        tree = icd_hierarchy if isinstance(icd_hierarchy, IcdTree) else IcdTree.from_networkx(icd_hierarchy, icd_codes)
+        walker = RandomWalker(
+            tree, self.walk_length, self.num_walks, self.p, self.q, self.directed, self.seed, self.workers
+        )
+        kwargs = {"window": self.window, "min_count": 1, "sg": 1, "workers": self.workers, **kwargs}
+        if self.seed is not None:
+            kwargs.setdefault("seed", self.seed)
+        if self.corpus == "memory":
+            return Word2Vec(walker.sentences(), vector_size=self.num_embedding_dimensions, **kwargs)
+        if self.corpus == "stream":
+            return Word2Vec(WalkCorpus(walker), vector_size=self.num_embedding_dimensions, **kwargs)
+        with tempfile.TemporaryDirectory(dir=self.temp_folder) as temp_folder:
+            corpus = WalkCorpus(walker, spill=os.path.join(temp_folder, "walks.npy"))
+            try:
+                return Word2Vec(corpus, vector_size=self.num_embedding_dimensions, **kwargs)
+            finally:
+                corpus.close()  # the memory map must be released before the file is removed
+
+    def _fit_svd(
+        self, icd_hierarchy: Union["nx.Graph", IcdTree], icd_codes: Sequence[str], **kwargs
+    ) -> Tuple[Sequence[str], np.ndarray]:
+        from .factorization import svd_embedding
+
+        tree = icd_hierarchy if isinstance(icd_hierarchy, IcdTree) else IcdTree.from_networkx(icd_hierarchy, icd_codes)
+        return list(tree.names), svd_embedding(tree, self.num_embedding_dimensions, seed=self.seed, **kwargs)
+
+    def _fit_node2vec(self, icd_hierarchy: Union["nx.Graph", IcdTree], **kwargs):
+        from node2vec import Node2Vec
+
+        if isinstance(icd_hierarchy, IcdTree):
+            icd_hierarchy = icd_hierarchy.to_networkx()
+        if not self.directed:
+            icd_hierarchy = icd_hierarchy.to_undirected(as_view=True)
+        return Node2Vec(
             icd_hierarchy,
             dimensions=self.num_embedding_dimensions,
+            walk_length=self.walk_length,
+            num_walks=self.num_walks,
+            p=self.p,
+            q=self.q,
             workers=self.workers,
+            seed=self.seed,
             quiet=True,
+            **({} if self.temp_folder is None else {"temp_folder": self.temp_folder}),
             **self.node2vec_kwargs
         ).fit(window=self.window, min_count=1, **kwargs)
-        self.icd_codes = icd_codes
-        self.nn = NearestNeighbors(n_neighbors=1)
-        self.nn.fit(self.to_vec(self.icd_codes))
 
-    def to_vec(self, icd_codes: Sequence[str]) -> np.ndarray:
+    def get_params(self) -> Dict[str, Any]:
+        """constructor arguments, including those passed on to the Node2Vec constructor"""
+        params = {name: getattr(self, name) for name in _PARAMS}
+        params.update(self.node2vec_kwargs)
+        return params
+
+    @property
+    def nn(self):
+        """`sklearn.neighbors.NearestNeighbors` fit on `embeddings`, built on first use"""
+        if self._nn is None:
+            from sklearn.neighbors import NearestNeighbors
+
+            if self.embeddings is None:
+                raise ValueError("model needs to be fit before")
+            self._nn = NearestNeighbors(n_neighbors=1).fit(dequantize(self.embeddings, self.scales))
+        return self._nn
+
+    @nn.setter
+    def nn(self, nn):
+        self._nn = nn
+
+    def save(self, path, nearest_neighbors: bool = False):
+        """write the fitted embeddings to a directory
+
+        The directory holds the embedding matrix, followed by the vectors of `ancestors`, as
+        `embeddings.npy` (quantized, if the model is), the hyperparameters, hierarchy metadata,
+        codes, ancestors and int8 scales as `metadata.json` and, if `nearest_neighbors` is
+        True, the pickled `nn` as `nn.pkl`. The gensim model is not saved.
+
+        Args:
+            path (Pathlike): directory, created if need be
+            nearest_neighbors (bool): If True, also save the nearest neighbor index, so that it
+                does not need to be rebuilt after loading. Defaults to False.
+
+        Raises:
+            ValueError: If model is not fit beforehand
+        """
+        if self.embeddings is None:
+            raise ValueError("model needs to be fit before")
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        metadata = {
+            "format": MODEL_FORMAT,
+            "params": self.get_params(),
+            "fit_kwargs": self.fit_kwargs,
+            "hierarchy": self.hierarchy_meta,
+            "icd_codes": [str(code) for code in self.icd_codes],
+            "ancestors": self.ancestors,
+            "dtype": str(self.embeddings.dtype),
+            "scales": None if self.scales is None else self.scales.tolist(),
+        }
+        _replace(path / MODEL_EMBEDDINGS, lambda f: np.save(f, self._vectors))
+        nn_fp = path / MODEL_NEAREST_NEIGHBORS
+        if nearest_neighbors:
+            _replace(nn_fp, lambda f: pickle.dump(self.nn, f, protocol=pickle.HIGHEST_PROTOCOL))
+        elif nn_fp.exists():
+            nn_fp.unlink()
+        # written last, so a directory with metadata always has matching embeddings
+        _replace(path / MODEL_METADATA, lambda f: f.write(json.dumps(metadata).encode()))
+
+    @classmethod
+    def load(cls, path, mmap: bool = True) -> "Icd2Vec":
+        """read embeddings written by `save`
+
+        The loaded model encodes and decodes codes like the fitted one, but has no gensim model
+        (`node2vec` is None).
+
+        Args:
+            path (Pathlike): directory written by `save`
+            mmap (bool): If True, memory-map the embedding matrix read-only, so that processes
+                loading the same directory share one copy of it. Defaults to True.
+
+        Returns:
+            Icd2Vec: the fitted model
+        """
+        metadata = _read_metadata(Path(path))
+        model = cls(**metadata["params"])
+        model._load_fitted(Path(path), metadata, mmap)
+        return model
+
+    def _load_fitted(self, path: Path, metadata: Dict[str, Any], mmap: bool = True):
+        vectors = np.load(path / MODEL_EMBEDDINGS, mmap_mode="r" if mmap else None)
+        ancestors = metadata.get("ancestors", [])
+        if vectors.shape != (len(metadata["icd_codes"]) + len(ancestors), self.num_embedding_dimensions):
+            raise ValueError(f"the embeddings in {path} do not match its codes")
+        self.node2vec = None
+        if str(vectors.dtype) != metadata.get("dtype", "float32"):
+            raise ValueError(f"the embeddings in {path} are not {metadata.get('dtype', 'float32')}")
+        self._freeze(metadata["icd_codes"], vectors, metadata.get("scales"), ancestors)
+        self.hierarchy_meta = metadata["hierarchy"]
+        self.fit_kwargs = metadata["fit_kwargs"]
+        nn_fp = path / MODEL_NEAREST_NEIGHBORS
+        if nn_fp.exists():
+            with open(nn_fp, "rb") as f:
+                self._nn = pickle.load(f)
+
+    def fit_or_load(
+        self,
+        icd_hierarchy: Union["nx.Graph", IcdTree],
+        icd_codes: Optional[Sequence[str]] = None,
+        registry=None,
+        **kwargs
+    ) -> "Icd2Vec":
+        """like `fit`, but reuse the embeddings if a model with the same hierarchy, codes and
+        arguments was fit before, see `registry.EmbeddingRegistry`
+
+        On a hit, the embeddings are memory-mapped from the cache and `node2vec` is None.
+
+        Args:
+            icd_hierarchy (Union[nx.Graph, IcdTree]): Graph of ICD hierarchy
+            icd_codes (Sequence[str], optional): ICD codes to embed. Defaults to the codes of
+                `icd_hierarchy`, if it is an `IcdTree`.
+            registry (EmbeddingRegistry, optional): cache to use. Defaults to `registry.registry()`.
+            kwargs: arguments passed to gensim.models.Word2Vec
+
+        Returns:
+            Icd2Vec: the model itself
+        """
+        if registry is None:
+            from .registry import registry as default_registry
+
+            registry = default_registry()
+        return registry.fit_or_load(self, icd_hierarchy, icd_codes, **kwargs)
+
+    def code_ids(self, icd_codes: Codes, unknown: str = "raise") -> np.ndarray:
+        """rows of ICD codes in `embeddings` (i.e., their positions in `icd_codes`)
+
+        With unknown="parent", codes that were not embedded fall back to their nearest ancestor
+        in the hierarchy, which may be a node that is not in `icd_codes`, e.g. a non-billable
+        category when only billable codes were embedded. Those get rows past `embeddings`
+        (len(icd_codes) + their position in `ancestors`) that `ids_to_vec` and `to_vec` accept.
+
+        Codes may be formatted in any way that `encoding.normalize` accepts, e.g. "E1032" or
+        "e10.32" for E10.32.
+
+        Args:
+            icd_codes (Codes): ICD codes, e.g. a list, a numpy string array or a pandas Series
+            unknown (str): what to do with codes that were not embedded: "raise" a KeyError,
+                return -1 for them ("zeros"), or fall back to the nearest embedded code or
+                ancestor that the code starts with, e.g. E10.329 -> E10.32 ("parent"), returning
+                -1 if there is none.
+                Defaults to "raise".
+
+        Raises:
+            ValueError: If model is not fit beforehand
+            KeyError: If `unknown` is "raise" and some codes were not embedded
+
+        Returns:
+            np.ndarray: int64 rows, with the same shape as `icd_codes`
+        """
+        if self.embeddings is None:
+            raise ValueError("model needs to be fit before")
+        if unknown not in ("raise", "zeros", "parent"):
+            raise ValueError(f'unknown must be "raise", "zeros" or "parent", but got {unknown!r}')
+        icd_codes = np.asarray(icd_codes)
+        rows = self._rows(icd_codes)
+        missing = rows == -1
+        if unknown == "parent" and missing.any():
+            prefixes = normalize(icd_codes[missing])
+            parent_rows = np.full(len(prefixes), -1, dtype=np.int64)
+            # the whole code first, which may be an ancestor of embedded codes itself
+            for length in range(prefixes.dtype.itemsize // 4, 0, -1):
+                unresolved = parent_rows == -1
+                if not unresolved.any():
+                    break
+                truncated = prefixes[unresolved].astype(f"<U{length}")
+                keys = _pack(truncated)
+                found = self._rows(truncated)
+                position = np.searchsorted(self._ancestor_keys, keys)
+                ancestor_rows = np.where(self._ancestor_keys[position] == keys, self._ancestor_rows[position], -1)
+                parent_rows[unresolved] = np.where((found == -1) & (keys != -1), ancestor_rows, found)
+            rows[missing] = parent_rows
+        elif unknown == "raise" and missing.any():
+            codes = icd_codes[missing]
+            raise KeyError(f"{len(codes)} codes were not embedded, e.g. {codes[:5].tolist()}")
+        return rows
+
+    def _rows(self, icd_codes: np.ndarray) -> np.ndarray:
+        keys = _pack(icd_codes)
+        position = np.searchsorted(self._keys, keys)
+        rows = np.where((self._keys[position] == keys) & (keys != -1), self._key_rows[position], -1)
+        not_codes = keys == -1
+        if not_codes.any():
+            rows[not_codes] = [self.code_index.get(str(code), -1) for code in icd_codes[not_codes]]
+        return rows
+
+    def ids_to_vec(self, ids: Union[Sequence[int], np.ndarray], out: Optional[np.ndarray] = None) -> np.ndarray:
+        """embeddings of codes given by their rows (see `code_ids`), with zeros for -1
+
+        Quantized embeddings (see `quantize`) are dequantized as they are gathered.
+
+        Args:
+            ids (Union[Sequence[int], np.ndarray]): rows in `embeddings`, or of `ancestors` past
+                them (see `code_ids`), of any shape
+            out (np.ndarray, optional): float32 array of shape ids.shape + (num_embedding_dimensions,)
+                to write the embeddings to. Defaults to None.
+
+        Raises:
+            ValueError: If model is not fit beforehand
+
+        Returns:
+            np.ndarray: float32 embeddings, i.e. `out` if it was given
+        """
+        if self.embeddings is None:
+            raise ValueError("model needs to be fit before")
+        ids = np.asarray(ids, dtype=np.int64)
+        if ids.size and (ids.min() < -1 or len(self._vectors) <= ids.max()):
+            raise IndexError(f"ids must be between -1 and {len(self._vectors) - 1}")
+        missing = ids == -1
+        # mode="clip" skips the intermediate buffer that take uses with out= (ids are checked above)
+        if self._vectors.dtype == np.float32:
+            out = np.take(self._vectors, ids, axis=0, out=out, mode="clip")
+        else:
+            out = dequantize(np.take(self._vectors, ids, axis=0, mode="clip"), self.scales, out=out)
+        if missing.any():
+            out[missing] = 0
+        return out
+
+    def to_vec(self, icd_codes: Codes, out: Optional[np.ndarray] = None, unknown: str = "raise") -> np.ndarray:
         """encode ICD code(s) into a matrix of continuously-valued representations of
-        shape m x n where m = self.num_embedding_dimensions and n = len(icd_codes)
+        shape n x m where n = len(icd_codes) and m = self.num_embedding_dimensions
 
         Args:
-            icd_codes (Sequence[str]): list of icd code(s)
+            icd_codes (Codes): list of icd code(s)
+            out (np.ndarray, optional): float32 array of shape (len(icd_codes), num_embedding_dimensions)
+                to write the embeddings to, e.g. a slice of a larger array. Defaults to None.
+            unknown (str): "raise", "zeros" or "parent", see `code_ids`. Defaults to "raise".
 
         Raises:
             ValueError: If model is not fit beforehand
+            KeyError: If `unknown` is "raise" and some codes were not embedded
 
         Returns:
             np.ndarray: continuously-valued representations if ICD codes
         """
-        if not self.node2vec:
+        return self.ids_to_vec(self.code_ids(icd_codes, unknown), out=out)
+
+    @property
+    def index(self) -> DecodingIndex:
+        """index that `to_code` searches, an exact euclidean `decoding.ExactIndex` by default
+
+        Assign another index fit on `embeddings` to decode differently, e.g.
+        `decoding.IVFIndex(n_probe=16).fit(model.embeddings, model.scales)`.
+        """
+        if self._index is None:
+            if self.embeddings is None:
+                raise ValueError("model needs to be fit before")
+            # shares `embeddings`, quantized or not
+            self._index = ExactIndex("euclidean", dtype=str(self.embeddings.dtype)).fit(self.embeddings, self.scales)
+        return self._index
+
+    @index.setter
+    def index(self, index: DecodingIndex):
+        if self.embeddings is None:
             raise ValueError("model needs to be fit before")
-        return np.stack([self.node2vec.wv.get_vector(icd_code) for icd_code in icd_codes])
+        if len(index) != len(self.icd_codes):
+            raise ValueError(f"the index holds {len(index)} embeddings, but the model has {len(self.icd_codes)} codes")
+        self._index = index
 
-    def to_code(self, vecs: Union[Sequence[Sequence], np.ndarray]) -> Sequence[str]:
+    def to_code(
+        self,
+        vecs: Union[Sequence[Sequence], np.ndarray],
+        k: int = 1,
+        return_scores: bool = False,
+        **search_kwargs
+    ) -> Union[Sequence, Tuple[Sequence, np.ndarray]]:
         """decode continuous representation of ICD code(s) into the code itself
 
         Args:
             vecs (Union[Sequence[Sequence], np.ndarray]): continuous representation of ICD code(s)
+            k (int): number of codes per vector, best first. Defaults to 1.
+            return_scores (bool): If True, also return the scores of the codes (distances for the
+                euclidean metric, similarities otherwise). Defaults to False.
+            search_kwargs: arguments of the `search` method of `index`, e.g. `within` for a
+                `decoding.TreeIndex`
+
+        Returns:
+            Union[Sequence, Tuple[Sequence, np.ndarray]]: ICD code(s) if k is 1, or lists of k codes
+                (None where fewer were found), and the (len(vecs), k) scores if `return_scores` is True
+        """
+        scores, rows = self.index.search(np.asarray(vecs, dtype=np.float32), k, **search_kwargs)
+        codes = self._code_names[rows].tolist()  # row -1 decodes to None
+        if k == 1:
+            codes = [code for code, in codes]
+        return (codes, scores) if return_scores else codes
+
+    def decode(
+        self,
+        vecs: Queries,
+        k: int = 1,
+        out: Optional[np.ndarray] = None,
+        scores_out: Optional[np.ndarray] = None,
+        workers: int = 1,
+        memory_limit: int = DEFAULT_MEMORY_LIMIT,
+        chunk_size: Optional[int] = None,
+        **search_kwargs
+    ) -> np.ndarray:
+        """decode many vectors in chunks on a thread pool with bounded memory, see `decoding.search_chunks`
+
+        Args:
+            vecs (Queries): vectors of shape (n, num_embedding_dimensions), e.g. a `np.memmap`, or
+                batches of them
+            k (int): number of codes per vector. Defaults to 1.
+            out (np.ndarray, optional): array of shape (n,) if k is 1 and (n, k) otherwise, which
+                receives rows in `embeddings` (-1 if not found) if it is an integer array, or codes
+                ("" or None if not found) if it is a string or object array. Defaults to a new
+                int32 array of rows.
+            scores_out (np.ndarray, optional): float array of the same shape as `out`, which
+                receives the scores. Defaults to None.
+            workers (int): number of threads, where -1 means one per CPU. Defaults to 1.
+            memory_limit (int): bytes for the score matrices. Defaults to 256 MiB.
+            chunk_size (int, optional): vectors per chunk. Defaults to the most that fit in `memory_limit`.
+            search_kwargs: arguments of the `search` method of `index`
 
         Returns:
-            Sequence[str]: ICD code(s)
+            np.ndarray: `out`
+        """
+        names = None if out is None or out.dtype.kind in "iu" else self._output_names(out.dtype)
+        results = []
+        for start, scores, rows in search_chunks(
+            self.index, vecs, k, workers, memory_limit, chunk_size, **search_kwargs
+        ):
+            if k == 1:
+                scores, rows = scores[:, 0], rows[:, 0]
+            if out is None:
+                results.append(rows.astype(np.int32))
+            else:
+                out[start:start + len(rows)] = rows if names is None else names[rows]
+            if scores_out is not None:
+                scores_out[start:start + len(rows)] = scores
+        if out is None:
+            out = np.concatenate(results) if results else np.empty((0,) if k == 1 else (0, k), dtype=np.int32)
+        return out
+
+    def decode_stream(
+        self,
+        batches: Queries,
+        k: int = 1,
+        as_codes: bool = True,
+        return_scores: bool = False,
+        workers: int = 1,
+        memory_limit: int = DEFAULT_MEMORY_LIMIT,
+        chunk_size: Optional[int] = None,
+        **search_kwargs
+    ) -> Iterator:
+        """like `decode`, but yield the results of each chunk in order instead of storing them
+
+        Yields:
+            np.ndarray: codes (an object array, None if not found) if `as_codes` is True and int32
+                rows otherwise, of shape (chunk size,) if k is 1 and (chunk size, k) otherwise, and
+                the scores if `return_scores` is True
         """
-        _, nbr_idxs = self.nn.kneighbors(vecs)
-        return [self.icd_codes[i] for i in nbr_idxs.reshape(-1)]
+        for _, scores, rows in search_chunks(
+            self.index, batches, k, workers, memory_limit, chunk_size, **search_kwargs
+        ):
+            if k == 1:
+                scores, rows = scores[:, 0], rows[:, 0]
+            result = self._code_names[rows] if as_codes else rows.astype(np.int32)
+            yield (result, scores) if return_scores else result
+
+    def _output_names(self, dtype: np.dtype) -> np.ndarray:
+        """codes indexed by row (with -1 for codes that were not found) in the dtype of an output"""
+        if dtype.kind == "O":
+            return self._code_names
+        return np.array([*map(str, self.icd_codes), ""], dtype=dtype)
+
+
+def _replace(fp: Path, write: Callable):
+    """write a file through `write(f)` and move it into place atomically"""
+    fd, tmp_fp = tempfile.mkstemp(dir=fp.parent, prefix=fp.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_fp, fp)
+    except BaseException:
+        os.unlink(tmp_fp)
+        raise
+
+
+def _edges(icd_hierarchy: Union["nx.Graph", IcdTree]) -> Set[Tuple[str, str]]:
+    """(parent, child) names of the edges of a hierarchy, whatever its representation"""
+    if isinstance(icd_hierarchy, IcdTree):
+        names = list(icd_hierarchy.names)
+        return {
+            (names[parent], names[child])
+            for child, parent in enumerate(icd_hierarchy.parent_ids.tolist())
+            if parent != -1
+        }
+    return {(str(parent), str(child)) for parent, child in icd_hierarchy.edges}
+
+
+def _neighbourhood(parent_ids: np.ndarray, mask: np.ndarray, radius: int) -> np.ndarray:
+    """mask of the nodes at most `radius` edges away from the nodes in `mask`"""
+    has_parent = parent_ids != -1
+    for _ in range(radius):
+        grown = mask.copy()
+        grown[parent_ids[mask & has_parent]] = True
+        grown[has_parent] |= mask[parent_ids[has_parent]]
+        mask = grown
+    return mask
+
+
+def _read_metadata(path: Path) -> Dict[str, Any]:
+    metadata = json.loads((path / MODEL_METADATA).read_text())
+    if metadata.get("format") != MODEL_FORMAT:
+        raise ValueError(f"{path} does not hold an Icd2Vec model (format {MODEL_FORMAT})")
+    return metadata
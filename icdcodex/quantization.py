@@ -0,0 +1,107 @@
+"""compact float16 and int8 storage of embedding matrices"""
+
+from typing import Dict, Optional, Sequence, Tuple
+import numpy as np
+
+DTYPES = ["float32", "float16", "int8"]
+
+
+def quantize(embeddings: np.ndarray, dtype: str = "int8") -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """store embeddings in fewer bytes per value
+
+    int8 embeddings are scaled per dimension, so that the largest magnitude in each column
+    maps to 127: x ~ values * scales. float16 and float32 embeddings are not scaled.
+
+    Args:
+        embeddings (np.ndarray): float embeddings of shape (n, num_embedding_dimensions)
+        dtype (str): "float32", "float16" or "int8". Defaults to "int8".
+
+    Returns:
+        Tuple[np.ndarray, Optional[np.ndarray]]: contiguous values, and the float32 scale of each
+            dimension for int8 (None otherwise)
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"dtype must be one of {DTYPES}, but got {dtype}")
+    if dtype != "int8":
+        return np.ascontiguousarray(embeddings, dtype=dtype), None
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    scales = np.abs(embeddings).max(axis=0) / 127 if len(embeddings) else np.ones(embeddings.shape[1:])
+    scales = np.where(scales == 0, 1, scales).astype(np.float32)
+    return np.rint(embeddings / scales).astype(np.int8), scales
+
+
+def dequantize(values: np.ndarray, scales: Optional[np.ndarray] = None, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """float32 embeddings from quantized values, see `quantize`
+
+    Args:
+        values (np.ndarray): quantized values, of any shape ending with num_embedding_dimensions
+        scales (np.ndarray, optional): scale of each dimension, for int8 values. Defaults to None.
+        out (np.ndarray, optional): float32 array of the same shape to write to. Defaults to None.
+
+    Returns:
+        np.ndarray: float32 embeddings, i.e. `out` if it was given, and `values` itself if they are
+            already float32 and no `out` was given
+    """
+    if scales is not None:
+        return np.multiply(values, scales, out=out, dtype=np.float32)
+    if out is None:
+        return np.asarray(values, dtype=np.float32)
+    out[...] = values
+    return out
+
+
+def report(
+    embeddings: np.ndarray,
+    dtypes: Sequence[str] = ("float16", "int8"),
+    metric: str = "euclidean",
+    num_queries: int = 2000,
+    noise: float = 0.1,
+    seed: Optional[int] = 0,
+) -> Dict[str, Dict[str, float]]:
+    """measure what quantization costs in memory and accuracy
+
+    Queries are the embeddings of random rows plus gaussian noise (`noise` times the mean norm
+    of the embeddings, spread over the dimensions), decoded with exact search.
+
+    Args:
+        embeddings (np.ndarray): float32 embeddings
+        dtypes (Sequence[str]): quantized types to evaluate. Defaults to ("float16", "int8").
+        metric (str): metric of the decoding index. Defaults to "euclidean".
+        num_queries (int): number of noisy queries. Defaults to 2000.
+        noise (float): relative amount of noise in the queries. Defaults to 0.1.
+        seed (int, optional): seed of the queries. Defaults to 0.
+
+    Returns:
+        Dict[str, Dict[str, float]]: for each dtype, the size of the embeddings ("bytes"), how much
+            smaller they are than float32 ("compression"), the reconstruction error relative to
+            the norm of the embeddings ("relative_rmse") and at worst ("max_abs_error"), the
+            fraction of rows whose own quantized embedding decodes to them ("self_accuracy") and
+            the fraction of noisy queries that decode to the same row as with float32
+            ("agreement")
+    """
+    from .decoding import ExactIndex
+
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(embeddings), num_queries)
+    scale = noise * np.linalg.norm(embeddings, axis=1).mean() / np.sqrt(embeddings.shape[1])
+    queries = embeddings[rows] + scale * rng.standard_normal((num_queries, embeddings.shape[1])).astype(np.float32)
+    _, expected = ExactIndex(metric).fit(embeddings).search(queries)
+    results = {}
+    for dtype in dtypes:
+        values, scales = quantize(embeddings, dtype)
+        reconstructed = dequantize(values, scales)
+        index = ExactIndex(metric, dtype=dtype).fit(values, scales)
+        _, decoded = index.search(queries)
+        _, self_decoded = index.search(reconstructed)
+        results[dtype] = {
+            "bytes": int(values.nbytes + (0 if scales is None else scales.nbytes)),
+            "compression": embeddings.nbytes / (values.nbytes + (0 if scales is None else scales.nbytes)),
+            "relative_rmse": float(
+                np.sqrt(((reconstructed - embeddings) ** 2).sum(axis=1).mean() / (embeddings ** 2).sum(axis=1).mean())
+            ),
+            "max_abs_error": float(np.abs(reconstructed - embeddings).max()),
+            "self_accuracy": float(np.mean(self_decoded[:, 0] == np.arange(len(embeddings)))),
+            "agreement": float(np.mean(decoded[:, 0] == expected[:, 0])),
+        }
+    return results
@@ -0,0 +1,290 @@
+"""local, content-addressed cache of fitted `Icd2Vec` embeddings"""
+
+from typing import TYPE_CHECKING, Any, Dict, List, NamedTuple, Optional, Sequence, Union
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from .download import DEFAULT_CACHE_DIR
+from .icd2vec import MODEL_FORMAT, MODEL_METADATA, Icd2Vec, _edges, _read_metadata
+from .tree import IcdTree
+
+if TYPE_CHECKING:
+    import networkx as nx
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REGISTRY_DIR = DEFAULT_CACHE_DIR / "embeddings"
+
+# bump when walks or training change, so that embeddings fit by older code are not reused
+KEY_VERSION = 1
+
+# constructor arguments that do not change the embeddings, and are left out of keys (the number
+# of workers only changes how fast a model is fit, and is resolved from the machine's CPU count)
+_UNKEYED_PARAMS = ("corpus", "temp_folder", "workers")
+
+
+class Entry(NamedTuple):
+    """a cached model"""
+
+    key: str
+    path: Path
+    size: int
+    last_used: float
+    hierarchy: Dict[str, Any]
+
+
+class EmbeddingRegistry:
+    """content-addressed cache of fitted models, bounded in size
+
+    A model is stored under the sha256 of everything its embeddings depend on: the hierarchy
+    (its revision and version, its edges and the embedded codes), every constructor argument,
+    including the seed, and the keyword arguments of `fit`. A hit loads the saved model (see
+    `Icd2Vec.load`) instead of fitting it again. When the cache grows over `max_bytes`, the
+    least recently used models are evicted.
+
+    Args:
+        root (Pathlike, optional): cache directory. Defaults to `DEFAULT_REGISTRY_DIR`, which the
+            ICDCODEX_CACHE_DIR environment variable moves.
+        max_bytes (int, optional): maximum total size of the cached models, or None for no
+            limit. Defaults to 2 GiB.
+    """
+
+    def __init__(self, root=None, max_bytes: Optional[int] = 2 << 30):
+        self.root = Path(DEFAULT_REGISTRY_DIR if root is None else root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def key(
+        self,
+        model: Icd2Vec,
+        icd_hierarchy: Union["nx.Graph", IcdTree],
+        icd_codes: Optional[Sequence[str]] = None,
+        **kwargs
+    ) -> str:
+        """key of the embeddings that `model.fit(icd_hierarchy, icd_codes, **kwargs)` would learn"""
+        if icd_codes is None:
+            if not isinstance(icd_hierarchy, IcdTree):
+                raise ValueError("icd_codes are required unless icd_hierarchy is an IcdTree")
+            icd_codes = icd_hierarchy.codes
+        params = {name: value for name, value in model.get_params().items() if name not in _UNKEYED_PARAMS}
+        meta = icd_hierarchy.meta if isinstance(icd_hierarchy, IcdTree) else icd_hierarchy.graph
+        description = {
+            "key_version": KEY_VERSION,
+            "format": MODEL_FORMAT,
+            "hierarchy": {name: meta.get(name) for name in ("revision", "version")},
+            "edges": _edges_digest(icd_hierarchy),
+            "codes": hashlib.sha256("\n".join(map(str, icd_codes)).encode()).hexdigest(),
+            "params": params,
+            "fit_kwargs": kwargs,
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=repr).encode()).hexdigest()
+
+    def get(self, key: str, mmap: bool = True) -> Optional[Icd2Vec]:
+        """load a cached model, or return None on a miss"""
+        path = self._lookup(key)
+        return None if path is None else Icd2Vec.load(path, mmap=mmap)
+
+    def put(self, key: str, model: Icd2Vec, nearest_neighbors: bool = False) -> Path:
+        """cache a fitted model, then evict models until the cache fits in `max_bytes`
+
+        Returns:
+            Path: directory of the cached model
+        """
+        path = self.root / key
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = Path(tempfile.mkdtemp(dir=self.root, prefix=".tmp-"))
+        try:
+            model.save(tmp_path, nearest_neighbors=nearest_neighbors)
+            try:
+                os.rename(tmp_path, path)
+            except OSError:  # another process cached the same model first
+                if not (path / MODEL_METADATA).exists():
+                    raise
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        self.evict(keep=key)
+        return path
+
+    def fit_or_load(
+        self,
+        model: Icd2Vec,
+        icd_hierarchy: Union["nx.Graph", IcdTree],
+        icd_codes: Optional[Sequence[str]] = None,
+        **kwargs
+    ) -> Icd2Vec:
+        """fit `model`, unless the embeddings it would learn are cached, in which case they are
+        memory-mapped into it (and `model.node2vec` is None)
+
+        Returns:
+            Icd2Vec: `model`
+        """
+        key = self.key(model, icd_hierarchy, icd_codes, **kwargs)
+        path = self._lookup(key)
+        if path is not None:
+            try:
+                model._load_fitted(path, _read_metadata(path))
+                return model
+            except FileNotFoundError:  # evicted in the meantime
+                pass
+        model.fit(icd_hierarchy, icd_codes, **kwargs)
+        self.put(key, model)
+        return model
+
+    def _lookup(self, key: str) -> Optional[Path]:
+        """directory of a cached model, marked as used, or None on a miss"""
+        path = self.root / key
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path if (path / MODEL_METADATA).exists() else None
+
+    def entries(self) -> List[Entry]:
+        """cached models, least recently used first"""
+        entries = []
+        if not self.root.exists():
+            return entries
+        for path in self.root.iterdir():
+            try:
+                metadata = json.loads((path / MODEL_METADATA).read_text())
+                size = sum(fp.stat().st_size for fp in path.iterdir())
+                last_used = path.stat().st_mtime
+            except (FileNotFoundError, NotADirectoryError, ValueError):
+                continue  # not a model, being written or being evicted
+            entries.append(Entry(path.name, path, size, last_used, metadata["hierarchy"]))
+        return sorted(entries, key=lambda entry: entry.last_used)
+
+    def size(self) -> int:
+        """total size of the cached models, in bytes"""
+        return sum(entry.size for entry in self.entries())
+
+    def evict(self, max_bytes: Optional[int] = None, keep: Optional[str] = None) -> List[str]:
+        """remove the least recently used models until the cache fits in `max_bytes`
+
+        Args:
+            max_bytes (int, optional): size to shrink the cache to. Defaults to `self.max_bytes`.
+            keep (str, optional): key of a model to keep regardless. Defaults to None.
+
+        Returns:
+            List[str]: keys of the evicted models
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        if max_bytes is None:
+            return []
+        evicted = []
+        with self._lock:
+            entries = self.entries()
+            size = sum(entry.size for entry in entries)
+            for entry in entries:
+                if size <= max_bytes:
+                    break
+                if entry.key == keep:
+                    continue
+                shutil.rmtree(entry.path, ignore_errors=True)
+                size -= entry.size
+                evicted.append(entry.key)
+        return evicted
+
+    def clear(self) -> List[str]:
+        """remove every cached model"""
+        return self.evict(max_bytes=0)
+
+
+def _edges_digest(icd_hierarchy: Union["nx.Graph", IcdTree]) -> str:
+    """hash of the edges of a hierarchy that does not depend on its representation"""
+    edges = sorted(f"{parent}\t{child}" for parent, child in _edges(icd_hierarchy))
+    return hashlib.sha256("\n".join(edges).encode()).hexdigest()
+
+
+_registries: Dict[Path, EmbeddingRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def registry(root=None) -> EmbeddingRegistry:
+    """the process-wide `EmbeddingRegistry` of a cache directory"""
+    root = Path(DEFAULT_REGISTRY_DIR if root is None else root)
+    with _registries_lock:
+        if root not in _registries:
+            _registries[root] = EmbeddingRegistry(root)
+        return _registries[root]
+
+
+def prebuild(hierarchies: Sequence[str], params: Dict[str, Any], root=None) -> Dict[str, Path]:
+    """fit and cache the embeddings of packaged hierarchies
+
+    Args:
+        hierarchies (Sequence[str]): "icd9", or "icd10cm-<version>" (e.g. "icd10cm-2022")
+        params (Dict[str, Any]): arguments of the `Icd2Vec` constructor
+        root (Pathlike, optional): cache directory. Defaults to `DEFAULT_REGISTRY_DIR`.
+
+    Returns:
+        Dict[str, Path]: directory of the cached model of each hierarchy
+    """
+    from . import hierarchy as hierarchy_
+
+    cache = registry(root)
+    paths = {}
+    for name in hierarchies:
+        revision, _, version = name.partition("-")
+        if revision == "icd9":
+            tree, _ = hierarchy_.icd9(as_networkx=False)
+        elif revision == "icd10cm":
+            tree, _ = hierarchy_.icd10cm(version or None, as_networkx=False)
+        else:
+            raise ValueError(f'hierarchies are "icd9" or "icd10cm-<version>", but got {name!r}')
+        start = time.perf_counter()
+        model = Icd2Vec(**params)
+        key = cache.key(model, tree)
+        if cache._lookup(key) is None:
+            model.fit(tree)
+            cache.put(key, model)
+        paths[name] = cache.root / key
+        logger.info(f"{name}: {key[:12]} ({time.perf_counter() - start:.1f}s)")
+    return paths
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="manage the cache of fitted Icd2Vec embeddings")
+    parser.add_argument("--root", default=None, help="cache directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("prebuild", help="fit and cache the embeddings of packaged hierarchies")
+    build.add_argument(
+        "hierarchies", nargs="*", default=["icd9"] + [f"icd10cm-{version}" for version in ("2022", "2023", "2024")]
+    )
+    build.add_argument(
+        "--param", action="append", default=[], metavar="NAME=VALUE",
+        help="Icd2Vec argument, e.g. seed=0 (values are parsed as JSON when possible)",
+    )
+    commands.add_parser("list", help="list the cached models, least recently used first")
+    evict = commands.add_parser("evict", help="evict the least recently used models")
+    evict.add_argument("max_bytes", type=int)
+    commands.add_parser("clear", help="remove every cached model")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.command == "prebuild":
+        params = {}
+        for param in args.param:
+            name, _, value = param.partition("=")
+            try:
+                params[name] = json.loads(value)
+            except ValueError:
+                params[name] = value
+        prebuild(args.hierarchies, params, args.root)
+    elif args.command == "list":
+        for entry in registry(args.root).entries():
+            hierarchy = "-".join(str(value) for value in entry.hierarchy.values() if value is not None)
+            used = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry.last_used))
+            print(f"{entry.key[:12]}  {hierarchy or '?':<16} {entry.size / 2**20:8.1f} MiB  {used}")
+    elif args.command == "evict":
+        print("\n".join(registry(args.root).evict(args.max_bytes)))
+    else:
+        print("\n".join(registry(args.root).clear()))
@@ -0,0 +1,361 @@
+"""search ICD codes by code prefix or by the words of their descriptions"""
+
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+import re
+from collections import Counter
+import numpy as np
+from . import _arrays, hierarchy
+from .encoding import CODE_PATTERN, normalize
+from .tree import IcdTree
+
+_TOKEN = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """lowercase words of a description or query"""
+    return _TOKEN.findall(text.lower())
+
+
+def node_texts(tree: IcdTree) -> List[str]:
+    """searchable text of every node: its description or, for chapters and sections named
+    by their description, its name"""
+    return [
+        tree.description(i) or ("" if CODE_PATTERN.fullmatch(name) else name)
+        for i, name in enumerate(tree.names)
+    ]
+
+
+def _postings(documents: Sequence[int], tokens: Sequence[Sequence[str]]) -> Dict[str, np.ndarray]:
+    """inverted index of `tokens`, as a sorted vocabulary and CSR postings of `documents` ids
+    with the number of times each token occurs in each document"""
+    counts = Counter((token.encode(), document) for document, words in zip(documents, tokens) for token in words)
+    pairs = sorted(counts)
+    vocabulary, first = np.unique(np.array([token for token, _ in pairs], dtype=bytes), return_index=True)
+    return {
+        "vocabulary": vocabulary,
+        "posting_offsets": np.append(first, len(pairs)).astype(np.int64),
+        "postings": np.array([document for _, document in pairs], dtype=np.int32),
+        "frequencies": np.array([counts[pair] for pair in pairs], dtype=np.int32),
+    }
+
+
+def _subtree(tree: IcdTree, within: Union[str, int]) -> Tuple[int, int]:
+    """range of node ids under `within`, given by name or node id"""
+    root = tree.node_id(within)
+    return root, root + int(tree.subtree_sizes[root])
+
+
+def _prefix_range(sorted_keys: np.ndarray, prefix: bytes) -> Tuple[int, int]:
+    """range of `sorted_keys` that start with `prefix`"""
+    # 0xff never occurs in UTF-8, so it sorts after every extension of the prefix
+    return (
+        int(np.searchsorted(sorted_keys, prefix, "left")),
+        int(np.searchsorted(sorted_keys, prefix + b"\xff", "left")),
+    )
+
+
+class PrefixIndex:
+    """type-ahead completion over code prefixes and description word prefixes
+
+    Nodes are ranked once, when the index is built: shallower (more general) nodes first,
+    then codes in order (for code matches) or nodes with shorter descriptions (for word
+    matches). Postings store ranks rather than node ids, so the best completions are simply
+    the smallest ranks that match every word of the query.
+
+    Args:
+        tree (IcdTree): ICD hierarchy
+    """
+
+    def __init__(self, tree: IcdTree, arrays: Optional[Dict[str, np.ndarray]] = None):
+        self.tree = tree
+        if arrays is None:
+            arrays = self._build(tree)
+        self._arrays = arrays
+        self._node_ids = arrays["node_ids"]
+        self._billable = tree.is_billable
+
+    @staticmethod
+    def _build(tree: IcdTree) -> Dict[str, np.ndarray]:
+        names, texts = list(tree.names), node_texts(tree)
+        node_ids = np.array(sorted(range(len(tree)), key=lambda i: (tree.depths[i], len(texts[i]), names[i])), dtype=np.int32)
+        ranks = np.empty(len(tree), dtype=np.int32)
+        ranks[node_ids] = np.arange(len(tree))
+        arrays = _postings(ranks.tolist(), [tokenize(text) for text in texts])
+        del arrays["frequencies"]
+        code_like = [i for i, name in enumerate(names) if CODE_PATTERN.fullmatch(name)]
+        code_keys = np.char.encode(normalize([names[i] for i in code_like]))
+        # code matches are ranked separately, by depth and then by code
+        code_nodes = np.array(sorted(code_like, key=lambda i: (tree.depths[i], names[i])), dtype=np.int32)
+        code_ranks = np.empty(len(tree), dtype=np.int32)
+        code_ranks[code_nodes] = np.arange(len(code_nodes))
+        order = np.argsort(code_keys, kind="stable")
+        arrays.update(
+            node_ids=node_ids,
+            code_keys=code_keys[order],
+            code_ranks=code_ranks[code_like][order],
+            code_nodes=code_nodes,
+        )
+        return arrays
+
+    def save(self, fp):
+        """write the index to a single binary file
+
+        Args:
+            fp (Pathlike): destination file
+        """
+        _arrays.dump(fp, "PrefixIndex", self._arrays, self.tree.meta)
+
+    @classmethod
+    def load(cls, fp, tree: IcdTree, mmap: bool = True) -> "PrefixIndex":
+        """read an index written by `save`
+
+        Args:
+            fp (Pathlike): file written by `save`
+            tree (IcdTree): the hierarchy the index was built from
+            mmap (bool): If True, memory-map the file. Defaults to True.
+
+        Returns:
+            PrefixIndex: the deserialized index
+        """
+        arrays, _ = _arrays.load(fp, "PrefixIndex", mmap=mmap)
+        return cls(tree, arrays)
+
+    def complete(
+        self, query: str, k: int = 10, billable: bool = False, within: Optional[Union[str, int]] = None
+    ) -> List[Tuple[str, Optional[str]]]:
+        """rank the nodes whose code starts with `query`, or whose description has words starting
+        with every word of `query`
+
+        Code matches are ranked before description matches.
+
+        Args:
+            query (str): partial code (e.g. "e10.3") or words (e.g. "diab retin")
+            k (int): maximum number of completions. Defaults to 10.
+            billable (bool): If True, only complete billable codes. Defaults to False.
+            within (Union[str, int], optional): only complete nodes under this node (e.g., a chapter),
+                given by name or node id. Defaults to None.
+
+        Returns:
+            List[Tuple[str, Optional[str]]]: names and descriptions of the completions
+        """
+        return [(self.tree.names[i], self.tree.description(i)) for i in self.complete_ids(query, k, billable, within)]
+
+    def complete_ids(
+        self, query: str, k: int = 10, billable: bool = False, within: Optional[Union[str, int]] = None
+    ) -> np.ndarray:
+        """like `complete`, but return node ids"""
+        code_ranks = self._code_matches(query)
+        word_ranks = self._word_matches(tokenize(query))
+        if within is not None or billable:
+            code_ranks = self._filter(code_ranks, self._arrays["code_nodes"], billable, within)
+            word_ranks = self._filter(word_ranks, self._node_ids, billable, within)
+        code_nodes = self._arrays["code_nodes"][_smallest(code_ranks, k)]
+        word_nodes = self._node_ids[_smallest(word_ranks, k + len(code_nodes))]
+        word_nodes = word_nodes[~np.isin(word_nodes, code_nodes)][:k - len(code_nodes)]
+        return np.concatenate([code_nodes, word_nodes])
+
+    def _code_matches(self, query: str) -> np.ndarray:
+        prefix = normalize([query])[0].encode()
+        if not prefix:
+            return np.zeros(0, dtype=np.int32)
+        start, end = _prefix_range(self._arrays["code_keys"], prefix)
+        return self._arrays["code_ranks"][start:end]
+
+    def _word_matches(self, words: List[str]) -> np.ndarray:
+        vocabulary, offsets, postings = self._arrays["vocabulary"], self._arrays["posting_offsets"], self._arrays["postings"]
+        matches = None
+        for word in sorted(words, key=len, reverse=True):  # longer words match fewer nodes
+            start, end = _prefix_range(vocabulary, word.encode())
+            ranks = postings[offsets[start]:offsets[end]]
+            matches = ranks if matches is None else matches[np.isin(matches, ranks)]
+            if not len(matches):
+                break
+        return np.zeros(0, dtype=np.int32) if matches is None else matches
+
+    def _filter(
+        self, ranks: np.ndarray, nodes_by_rank: np.ndarray, billable: bool, within: Optional[Union[str, int]]
+    ) -> np.ndarray:
+        nodes = nodes_by_rank[ranks]
+        keep = self._billable[nodes] if billable else np.ones(len(nodes), dtype=bool)
+        if within is not None:
+            start, end = _subtree(self.tree, within)
+            keep &= (start <= nodes) & (nodes < end)
+        return ranks[keep]
+
+
+def _smallest(ranks: np.ndarray, k: int) -> np.ndarray:
+    """the k smallest distinct ranks, in increasing order"""
+    if k <= 0:
+        return ranks[:0]
+    if len(ranks) > 4 * k:
+        # partial sort: duplicates (nodes matched through several words) are rare, so the
+        # 4k smallest values almost always contain k distinct ones
+        candidates = np.unique(np.partition(ranks, 4 * k)[:4 * k + 1])
+        if len(candidates) >= k:
+            return candidates[:k]
+    return np.unique(ranks)[:k]
+
+
+class SearchIndex:
+    """full-text search over node descriptions, ranked with Okapi BM25
+
+    Descriptions include the seventh-character extension text that datacleaning.py appends
+    to the codes it generates (e.g. "... with macular edema, left eye"). The BM25 weight of
+    every (word, node) posting is computed when the index is built, so a query only gathers
+    the postings of its words and sums them with `np.bincount`.
+
+    Args:
+        tree (IcdTree): ICD hierarchy
+        k1 (float): BM25 term frequency saturation. Defaults to 1.2.
+        b (float): BM25 length normalization. Defaults to 0.75.
+    """
+
+    def __init__(self, tree: IcdTree, k1: float = 1.2, b: float = 0.75, arrays: Optional[Dict[str, np.ndarray]] = None):
+        self.tree = tree
+        if arrays is None:
+            arrays = self._build(tree, k1, b)
+        self._arrays = arrays
+        self._billable = tree.is_billable
+
+    @staticmethod
+    def _build(tree: IcdTree, k1: float, b: float) -> Dict[str, np.ndarray]:
+        tokens = [tokenize(text) for text in node_texts(tree)]
+        arrays = _postings(range(len(tree)), tokens)
+        lengths = np.array([len(words) for words in tokens], dtype=np.float64)
+        document_frequencies = np.diff(arrays["posting_offsets"])
+        num_documents = np.count_nonzero(lengths)
+        idf = np.log1p((num_documents - document_frequencies + 0.5) / (document_frequencies + 0.5))
+        frequencies = arrays.pop("frequencies")
+        normalized_lengths = lengths[arrays["postings"]] / lengths[lengths > 0].mean()
+        saturation = frequencies + k1 * (1 - b + b * normalized_lengths)
+        weights = np.repeat(idf, document_frequencies) * frequencies * (k1 + 1) / saturation
+        arrays["weights"] = weights.astype(np.float32)
+        return arrays
+
+    def save(self, fp):
+        """write the index to a single binary file
+
+        Args:
+            fp (Pathlike): destination file
+        """
+        _arrays.dump(fp, "SearchIndex", self._arrays, self.tree.meta)
+
+    @classmethod
+    def load(cls, fp, tree: IcdTree, mmap: bool = True) -> "SearchIndex":
+        """read an index written by `save`
+
+        Args:
+            fp (Pathlike): file written by `save`
+            tree (IcdTree): the hierarchy the index was built from
+            mmap (bool): If True, memory-map the file. Defaults to True.
+
+        Returns:
+            SearchIndex: the deserialized index
+        """
+        arrays, _ = _arrays.load(fp, "SearchIndex", mmap=mmap)
+        return cls(tree, arrays=arrays)
+
+    def search(
+        self, query: str, k: int = 10, billable: bool = False, within: Optional[Union[str, int]] = None
+    ) -> List[Tuple[str, Optional[str], float]]:
+        """find the nodes whose descriptions best match `query`
+
+        Args:
+            query (str): words to search for, e.g. "diabetic retinopathy left eye"
+            k (int): maximum number of results. Defaults to 10.
+            billable (bool): If True, only return billable codes. Defaults to False.
+            within (Union[str, int], optional): only return nodes under this node (e.g., a chapter),
+                given by name or node id. Defaults to None.
+
+        Returns:
+            List[Tuple[str, Optional[str], float]]: names, descriptions and scores of the results
+        """
+        return self.search_batch([query], k, billable, within)[0]
+
+    def search_batch(
+        self, queries: Sequence[str], k: int = 10, billable: bool = False, within: Optional[Union[str, int]] = None
+    ) -> List[List[Tuple[str, Optional[str], float]]]:
+        """`search` for several queries at once"""
+        ids, scores = self.search_ids(queries, k, billable, within)
+        return [
+            [(self.tree.names[i], self.tree.description(i), float(score)) for i, score in zip(row_ids, row_scores) if i != -1]
+            for row_ids, row_scores in zip(ids, scores)
+        ]
+
+    def search_ids(
+        self,
+        queries: Sequence[str],
+        k: int = 10,
+        billable: bool = False,
+        within: Optional[Union[str, int]] = None,
+        batch_size: int = 64,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """like `search_batch`, but return arrays of node ids and scores
+
+        Args:
+            batch_size (int): queries scored together, each needing one float per node. Defaults to 64.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: len(queries) x k node ids (-1 past the last match) and scores
+        """
+        n = len(self.tree)
+        k = min(k, n)
+        keep = self._billable.copy() if billable else np.ones(n, dtype=bool)
+        if within is not None:
+            start, end = _subtree(self.tree, within)
+            keep[:start] = keep[end:] = False
+        vocabulary, offsets = self._arrays["vocabulary"], self._arrays["posting_offsets"]
+        ids = np.full((len(queries), k), -1, dtype=np.int32)
+        scores = np.zeros((len(queries), k), dtype=np.float32)
+        for batch_start in range(0, len(queries), batch_size):
+            batch = queries[batch_start:batch_start + batch_size]
+            slices, rows = [], []
+            for row, query in enumerate(batch):
+                for word in tokenize(query):
+                    word = word.encode()
+                    i = np.searchsorted(vocabulary, word)
+                    if i < len(vocabulary) and vocabulary[i] == word:
+                        slices.append(slice(offsets[i], offsets[i + 1]))
+                        rows.append(row)
+            if not slices:
+                continue
+            postings = np.concatenate([self._arrays["postings"][s] for s in slices])
+            weights = np.concatenate([self._arrays["weights"][s] for s in slices])
+            rows = np.repeat(rows, [s.stop - s.start for s in slices])
+            batch_scores = np.bincount(rows * n + postings, weights, minlength=len(batch) * n).reshape(len(batch), n)
+            batch_scores[:, ~keep] = 0
+            top = np.argpartition(-batch_scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(batch_scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind="stable")
+            top, top_scores = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+            rows_out = slice(batch_start, batch_start + len(batch))
+            ids[rows_out] = np.where(top_scores > 0, top, -1)
+            scores[rows_out] = top_scores
+        return ids, scores
+
+
+def icd9() -> SearchIndex:
+    """search index of the icd9 hierarchy, memory-mapped from the packaged data if available"""
+    tree, _ = hierarchy.icd9(as_networkx=False)
+    return _packaged(tree)
+
+
+def icd10cm(version: Optional[str] = None) -> SearchIndex:
+    """search index of an icd-10-cm hierarchy, memory-mapped from the packaged data if available
+
+    Args:
+        version (str, optional): icd-10-cm version, as in `hierarchy.icd10cm`. Defaults to None.
+    """
+    tree, _ = hierarchy.icd10cm(version, as_networkx=False)
+    return _packaged(tree)
+
+
+def _packaged(tree: IcdTree) -> SearchIndex:
+    revision, version = tree.meta["revision"], tree.meta.get("version")
+
+    def load():
+        filename = f"{hierarchy.resource_stem(revision, version)}-search.bin"
+        index = hierarchy.load_resource(filename, lambda fp: SearchIndex.load(fp, tree))
+        return SearchIndex(tree) if index is None else index
+
+    return hierarchy.cache.get((revision, version), SearchIndex, load)
@@ -0,0 +1,391 @@
+"""array-backed representation of an ICD hierarchy that can be memory-mapped"""
+
+from typing import Any, Dict, Iterable, Iterator, Mapping, Optional, Sequence, Union
+from collections import abc
+import numpy as np
+from . import _arrays
+
+# a node, given by its node id or by its name
+Node = Union[int, str]
+
+
+class StringTable(abc.Sequence):
+    """read-only sequence of strings stored as one UTF-8 buffer and offsets into it
+
+    Args:
+        offsets (np.ndarray): the i-th string is data[offsets[i]:offsets[i + 1]]
+        data (np.ndarray): UTF-8 encoded strings, concatenated
+        ids (np.ndarray, optional): if given, the table only exposes these strings, in this order.
+            Defaults to None.
+    """
+
+    __slots__ = ("offsets", "data", "ids")
+
+    def __init__(self, offsets: np.ndarray, data: np.ndarray, ids: Optional[np.ndarray] = None):
+        self.offsets = offsets
+        self.data = data
+        self.ids = ids
+
+    @classmethod
+    def from_strings(cls, strings: Sequence[str]) -> "StringTable":
+        encoded = [s.encode() for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(s) for s in encoded], out=offsets[1:])
+        return cls(offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1 if self.ids is None else len(self.ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if not -len(self) <= i < len(self):
+            raise IndexError("string table index out of range")
+        if self.ids is not None:
+            i = self.ids[i]
+        elif i < 0:
+            i += len(self)
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode()
+
+    def __iter__(self) -> Iterator[str]:
+        data, offsets = self.data.tobytes(), self.offsets.tolist()
+        ids = range(len(self)) if self.ids is None else self.ids.tolist()
+        for i in ids:
+            yield data[offsets[i]:offsets[i + 1]].decode()
+
+    def __repr__(self):
+        return f"StringTable({len(self)} strings)"
+
+
+class IcdTree:
+    """ICD hierarchy stored as flat numpy arrays instead of per-node python objects
+
+    Nodes are identified by integers assigned in depth-first preorder, so the root
+    is node 0 and the subtree of node `i` is exactly the nodes `i` up to (but not including)
+    `i + subtree_sizes[i]`. Trees are saved to a single file that `load` memory-maps,
+    so that loading takes milliseconds and processes share the same pages.
+
+    Attributes:
+        parent_ids (np.ndarray): parent of each node, -1 for the root
+        child_offsets (np.ndarray): the children of node i are child_ids[child_offsets[i]:child_offsets[i + 1]]
+        child_ids (np.ndarray): children of every node, grouped by parent
+        depths (np.ndarray): number of edges between each node and the root
+        subtree_sizes (np.ndarray): number of nodes in the subtree of each node, including itself
+        description_ids (np.ndarray): index of each node's description in `descriptions`, -1 if it has none
+        code_ids (np.ndarray): node ids of the ICD codes
+        names (StringTable): node names, indexed by node id
+        descriptions (StringTable): distinct node descriptions
+        meta (dict): provenance of the tree, such as its revision and version
+    """
+
+    __slots__ = (
+        "parent_ids",
+        "child_offsets",
+        "child_ids",
+        "depths",
+        "subtree_sizes",
+        "description_ids",
+        "code_ids",
+        "names",
+        "descriptions",
+        "meta",
+        "_name_order",
+    )
+
+    def __init__(self, arrays: Mapping[str, np.ndarray], meta: Optional[Dict[str, Any]] = None):
+        self.parent_ids = arrays["parent_ids"]
+        self.child_offsets = arrays["child_offsets"]
+        self.child_ids = arrays["child_ids"]
+        self.depths = arrays["depths"]
+        self.subtree_sizes = arrays["subtree_sizes"]
+        self.description_ids = arrays["description_ids"]
+        self.code_ids = arrays["code_ids"]
+        self.names = StringTable(arrays["name_offsets"], arrays["name_data"])
+        self.descriptions = StringTable(arrays["description_offsets"], arrays["description_data"])
+        self._name_order = arrays["name_order"]
+        self.meta = dict(meta or {})
+
+    # -------- construction -------- #
+
+    @classmethod
+    def from_networkx(cls, G, codes: Iterable[str], meta: Optional[Dict[str, Any]] = None) -> "IcdTree":
+        """convert a directed ICD hierarchy, such as those built in datacleaning.py
+
+        Args:
+            G (nx.DiGraph): ICD hierarchy, with edges pointing from parents to children
+            codes (Iterable[str]): ICD codes, all of which must be nodes of `G`
+            meta (Dict[str, Any], optional): provenance of the tree. Defaults to None.
+
+        Raises:
+            ValueError: If `G` is not a directed tree or a code is missing from it
+
+        Returns:
+            IcdTree: the same hierarchy, with node names converted to strings
+        """
+        if not G.is_directed():
+            raise ValueError("expected a directed hierarchy, with edges from parents to children")
+        roots = [n for n, in_degree in G.in_degree() if in_degree == 0]
+        if len(roots) != 1:
+            raise ValueError(f"expected a tree with one root, but found {len(roots)} roots")
+        names, parent_ids, depths, descriptions = [], [], [], []
+        stack = [(roots[0], -1, 0)]
+        while stack:
+            node, parent, depth = stack.pop()
+            i = len(names)
+            if i == len(G):
+                raise ValueError("hierarchy is not a tree")
+            names.append(str(node))
+            parent_ids.append(parent)
+            depths.append(depth)
+            descriptions.append(G.nodes[node].get("description"))
+            stack.extend((child, i, depth + 1) for child in reversed(list(G.successors(node))))
+        if len(names) != len(G):
+            raise ValueError("hierarchy is not a tree")
+        return cls._from_preorder(names, parent_ids, depths, descriptions, codes, meta)
+
+    @classmethod
+    def from_tree_data(cls, data: Mapping, codes: Iterable[str], meta: Optional[Dict[str, Any]] = None) -> "IcdTree":
+        """convert the nested dictionaries produced by `nx.readwrite.json_graph.tree_data`
+
+        Args:
+            data (Mapping): tree data with "id", "children" and (optionally) "description" keys
+            codes (Iterable[str]): ICD codes, all of which must be nodes of the tree
+            meta (Dict[str, Any], optional): provenance of the tree. Defaults to None.
+
+        Returns:
+            IcdTree: the same hierarchy, with node names converted to strings
+        """
+        names, parent_ids, depths, descriptions = [], [], [], []
+        stack = [(data, -1, 0)]
+        while stack:
+            node, parent, depth = stack.pop()
+            i = len(names)
+            names.append(str(node["id"]))
+            parent_ids.append(parent)
+            depths.append(depth)
+            descriptions.append(node.get("description"))
+            stack.extend((child, i, depth + 1) for child in reversed(node.get("children", ())))
+        return cls._from_preorder(names, parent_ids, depths, descriptions, codes, meta)
+
+    @classmethod
+    def _from_preorder(cls, names, parent_ids, depths, descriptions, codes, meta) -> "IcdTree":
+        n = len(names)
+        node_ids = {name: i for i, name in enumerate(names)}
+        if len(node_ids) != n:
+            raise ValueError("node names must be unique")
+        codes = list(codes)
+        missing_codes = [code for code in codes if code not in node_ids]
+        if missing_codes:
+            raise ValueError(f"some codes are not represented in the hierarchy: {missing_codes[:10]}")
+        parent_ids = np.asarray(parent_ids, dtype=np.int32)
+        depths = np.asarray(depths, dtype=np.int16)
+        child_offsets = np.zeros(n + 1, dtype=np.int32)
+        np.cumsum(np.bincount(parent_ids[1:], minlength=n), out=child_offsets[1:])
+        child_ids = (np.argsort(parent_ids[1:], kind="stable") + 1).astype(np.int32)
+        subtree_sizes = np.ones(n, dtype=np.int32)
+        for depth in range(int(depths.max()), 0, -1):
+            at_depth = np.flatnonzero(depths == depth)
+            np.add.at(subtree_sizes, parent_ids[at_depth], subtree_sizes[at_depth])
+        interned = {}
+        description_ids = np.array(
+            [-1 if d is None else interned.setdefault(d, len(interned)) for d in descriptions],
+            dtype=np.int32,
+        )
+        name_table = StringTable.from_strings(names)
+        description_table = StringTable.from_strings(list(interned))
+        encoded_names = [name.encode() for name in names]
+        arrays = {
+            "parent_ids": parent_ids,
+            "child_offsets": child_offsets,
+            "child_ids": child_ids,
+            "depths": depths,
+            "subtree_sizes": subtree_sizes,
+            "description_ids": description_ids,
+            "code_ids": np.array([node_ids[code] for code in codes], dtype=np.int32),
+            "name_offsets": name_table.offsets,
+            "name_data": name_table.data,
+            "name_order": np.array(sorted(range(n), key=encoded_names.__getitem__), dtype=np.int32),
+            "description_offsets": description_table.offsets,
+            "description_data": description_table.data,
+        }
+        return cls(arrays, meta)
+
+    def to_networkx(self):
+        """build the networkx representation of the hierarchy
+
+        Returns:
+            nx.DiGraph: ICD hierarchy with edges from parents to children and description attributes
+        """
+        import networkx as nx
+
+        names = list(self.names)
+        descriptions = list(self.descriptions)
+        G = nx.DiGraph(**self.meta)
+        G.add_nodes_from(
+            (name, {"description": descriptions[d]} if d != -1 else {})
+            for name, d in zip(names, self.description_ids.tolist())
+        )
+        G.add_edges_from((names[parent], names[child]) for child, parent in enumerate(self.parent_ids.tolist()) if parent != -1)
+        return G
+
+    # -------- serialization -------- #
+
+    def save(self, fp):
+        """write the tree to a single binary file
+
+        Args:
+            fp (Pathlike): destination file, conventionally with a .bin suffix
+        """
+        _arrays.dump(fp, "IcdTree", self._arrays(), self.meta)
+
+    @classmethod
+    def load(cls, fp, mmap: bool = True) -> "IcdTree":
+        """read a tree written by `save`
+
+        Args:
+            fp (Pathlike): file written by `save`
+            mmap (bool): If True, memory-map the file (read-only) instead of reading it. Defaults to True.
+
+        Returns:
+            IcdTree: the deserialized tree
+        """
+        arrays, meta = _arrays.load(fp, "IcdTree", mmap=mmap)
+        return cls(arrays, meta)
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            "parent_ids": self.parent_ids,
+            "child_offsets": self.child_offsets,
+            "child_ids": self.child_ids,
+            "depths": self.depths,
+            "subtree_sizes": self.subtree_sizes,
+            "description_ids": self.description_ids,
+            "code_ids": self.code_ids,
+            "name_offsets": self.names.offsets,
+            "name_data": self.names.data,
+            "name_order": self._name_order,
+            "description_offsets": self.descriptions.offsets,
+            "description_data": self.descriptions.data,
+        }
+
+    # -------- lookups -------- #
+
+    @property
+    def codes(self) -> StringTable:
+        """ICD codes, in the order they were given when the tree was built"""
+        return StringTable(self.names.offsets, self.names.data, self.code_ids)
+
+    @property
+    def nbytes(self) -> int:
+        """total size of the arrays backing the tree"""
+        return sum(arr.nbytes for arr in self._arrays().values())
+
+    def description(self, node: int) -> Optional[str]:
+        """description of a node, or None if it has none"""
+        description_id = self.description_ids[node]
+        return None if description_id == -1 else self.descriptions[description_id]
+
+    def id_of(self, name: str) -> int:
+        """node id of a node name, found by binary search over the sorted names
+
+        Raises:
+            KeyError: If there is no node called `name`
+        """
+        key = str(name).encode()
+        offsets, data, order = self.names.offsets, self.names.data, self._name_order
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            i = order[mid]
+            if data[offsets[i]:offsets[i + 1]].tobytes() < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(order):
+            i = order[lo]
+            if data[offsets[i]:offsets[i + 1]].tobytes() == key:
+                return int(i)
+        raise KeyError(name)
+
+    def ids(self, names: Iterable[str]) -> np.ndarray:
+        """node ids of several node names
+
+        Raises:
+            KeyError: If any name is not in the tree
+        """
+        return np.array([self.id_of(name) for name in names], dtype=np.int32)
+
+    # -------- navigation -------- #
+
+    def node_id(self, node: Node) -> int:
+        """node id of a node given by node id (any integer) or by name
+
+        Raises:
+            KeyError: If there is no node called `node`
+        """
+        if isinstance(node, (int, np.integer)) and not isinstance(node, bool):
+            if not 0 <= node < len(self):
+                raise KeyError(node)
+            return int(node)
+        return self.id_of(node)
+
+    def parent(self, node: Node) -> int:
+        """node id of the parent of a node, or -1 for the root"""
+        return int(self.parent_ids[self.node_id(node)])
+
+    def children(self, node: Node) -> np.ndarray:
+        """node ids of the children of a node, in order"""
+        i = self.node_id(node)
+        return self.child_ids[self.child_offsets[i]:self.child_offsets[i + 1]]
+
+    def ancestors(self, node: Node) -> np.ndarray:
+        """node ids of the ancestors of a node, from its parent up to the root"""
+        i = self.node_id(node)
+        ancestors = np.empty(int(self.depths[i]), dtype=np.int32)
+        for k in range(len(ancestors)):
+            i = ancestors[k] = self.parent_ids[i]
+        return ancestors
+
+    def subtree(self, node: Node) -> np.ndarray:
+        """node ids of a node and all of its descendants, in preorder"""
+        i = self.node_id(node)
+        return np.arange(i, i + self.subtree_sizes[i], dtype=np.int32)
+
+    def leaves(self, node: Optional[Node] = None) -> np.ndarray:
+        """node ids of the leaves under a node, or of the whole tree if `node` is None"""
+        i = 0 if node is None else self.node_id(node)
+        j = i + int(self.subtree_sizes[i])
+        return (np.flatnonzero(self.child_offsets[i + 1:j + 1] == self.child_offsets[i:j]) + i).astype(np.int32)
+
+    def depth(self, node: Node) -> int:
+        """number of edges between a node and the root"""
+        return int(self.depths[self.node_id(node)])
+
+    def at_depth(self, depth: int) -> np.ndarray:
+        """node ids of every node at a depth, e.g. 1 for chapters"""
+        return np.flatnonzero(self.depths == depth).astype(np.int32)
+
+    @property
+    def is_leaf(self) -> np.ndarray:
+        """mask of the nodes without children"""
+        return self.child_offsets[1:] == self.child_offsets[:-1]
+
+    @property
+    def is_billable(self) -> np.ndarray:
+        """mask of the codes without children, i.e. the codes that are valid for billing"""
+        billable = np.zeros(len(self), dtype=bool)
+        billable[self.code_ids] = True
+        return billable & self.is_leaf
+
+    def __contains__(self, name) -> bool:
+        try:
+            self.id_of(name)
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self) -> int:
+        return len(self.parent_ids)
+
+    def __repr__(self):
+        return f"IcdTree({self.meta}, {len(self)} nodes, {len(self.code_ids)} codes)"
@@ -0,0 +1,211 @@
+"""which ICD-10-CM codes are valid in which release, and what changed between releases"""
+
+from typing import Dict, List, Mapping, NamedTuple, Optional, Sequence, Union
+import numpy as np
+from . import _arrays, hierarchy
+from .encoding import Codes, _pack
+from .tree import IcdTree, StringTable
+
+Years = Union[int, str, Sequence[Union[int, str]], np.ndarray]
+
+VERSION_INDEX = "icd-10-versions.bin"
+
+
+class Changes(NamedTuple):
+    """codes added, removed and re-described by a release, compared to an earlier one"""
+
+    added: List[str]
+    removed: List[str]
+    revised: List[str]
+
+
+class VersionIndex:
+    """the codes of every ICD-10-CM release in one table
+
+    Every code that is valid in any release is stored once, with a bitmask of the releases
+    it is valid in (bit k stands for `versions[k]`) and its description in each of them.
+    Codes are sorted by their packed integer keys (see `encoding`), so validity checks over
+    arrays of (code, year) pairs are a binary search and a bit test, without a python loop.
+
+    Args:
+        arrays (Dict[str, np.ndarray]): arrays built by `from_trees` or read by `load`
+        meta (Dict[str, Any]): metadata, including the list of "versions"
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray], meta: Dict):
+        self._arrays = arrays
+        self.meta = dict(meta)
+        self.versions: List[str] = list(meta["versions"])
+        self.codes = StringTable(arrays["code_offsets"], arrays["code_data"])
+        self.masks = arrays["masks"]
+        self.description_ids = arrays["description_ids"]
+        self.descriptions = StringTable(arrays["description_offsets"], arrays["description_data"])
+        # sentinels keep searchsorted results in bounds
+        self._keys = np.append(arrays["keys"], np.iinfo(np.int64).max)
+        self._masks = np.append(self.masks, 0).astype(self.masks.dtype)
+        self._years = np.array([int(version) for version in self.versions], dtype=np.int64)
+
+    @classmethod
+    def from_trees(cls, trees: Mapping[str, IcdTree]) -> "VersionIndex":
+        """index the codes of several releases
+
+        Args:
+            trees (Mapping[str, IcdTree]): hierarchy of each release, keyed by version (e.g. "2022")
+
+        Returns:
+            VersionIndex: the index, with releases sorted by year
+        """
+        versions = sorted(trees, key=int)
+        if 32 < len(versions):
+            raise ValueError(f"at most 32 releases fit in a bitmask, but got {len(versions)}")
+        descriptions_by_version = []
+        for version in versions:
+            tree = trees[version]
+            descriptions_by_version.append({code: tree.description(i) for code, i in zip(tree.codes, tree.code_ids)})
+        codes = sorted(set().union(*descriptions_by_version))
+        keys = _pack(codes)
+        order = np.argsort(keys, kind="stable")
+        codes = [codes[i] for i in order]
+        interned = {}
+        masks = np.zeros(len(codes), dtype=np.uint32)
+        description_ids = np.full((len(codes), len(versions)), -1, dtype=np.int32)
+        for k, descriptions in enumerate(descriptions_by_version):
+            for row, code in enumerate(codes):
+                if code in descriptions:
+                    masks[row] |= np.uint32(1 << k)
+                    description = descriptions[code]
+                    if description is not None:
+                        description_ids[row, k] = interned.setdefault(description, len(interned))
+        code_table = StringTable.from_strings(codes)
+        description_table = StringTable.from_strings(list(interned))
+        arrays = {
+            "keys": keys[order],
+            "masks": masks,
+            "description_ids": description_ids,
+            "code_offsets": code_table.offsets,
+            "code_data": code_table.data,
+            "description_offsets": description_table.offsets,
+            "description_data": description_table.data,
+        }
+        return cls(arrays, {"revision": "icd10cm", "versions": versions})
+
+    def save(self, fp):
+        """write the index to a single binary file
+
+        Args:
+            fp (Pathlike): destination file
+        """
+        _arrays.dump(fp, "VersionIndex", self._arrays, self.meta)
+
+    @classmethod
+    def load(cls, fp, mmap: bool = True) -> "VersionIndex":
+        """read an index written by `save`
+
+        Args:
+            fp (Pathlike): file written by `save`
+            mmap (bool): If True, memory-map the file. Defaults to True.
+
+        Returns:
+            VersionIndex: the deserialized index
+        """
+        arrays, meta = _arrays.load(fp, "VersionIndex", mmap=mmap)
+        return cls(arrays, meta)
+
+    def rows(self, codes: Codes) -> np.ndarray:
+        """row of each code in the index, or -1 if it is not valid in any release
+
+        Codes may be formatted in any way that `encoding.normalize` accepts.
+        """
+        keys = _pack(codes)
+        position = np.searchsorted(self._keys, keys)
+        return np.where((self._keys[position] == keys) & (keys != -1), position, -1)
+
+    def bits(self, years: Years) -> np.ndarray:
+        """bit of each year in the masks, or -1 if there is no release for that year"""
+        years = np.asarray(years).astype(np.int64)
+        position = np.minimum(np.searchsorted(self._years, years), len(self._years) - 1)
+        return np.where(self._years[position] == years, position, -1)
+
+    def is_valid(self, codes: Codes, years: Years) -> np.ndarray:
+        """test whether each code is valid in the corresponding year
+
+        Args:
+            codes (Codes): codes, in any formatting accepted by `encoding.normalize`
+            years (Years): years (e.g. 2022 or "2022"), broadcast against `codes`
+
+        Returns:
+            np.ndarray: boolean mask, False for unknown codes and years without a release
+        """
+        rows, bits = np.broadcast_arrays(self.rows(codes), self.bits(years))
+        masks = self._masks[rows].astype(np.int64)  # row -1 hits the empty sentinel
+        return (bits != -1) & ((masks >> np.maximum(bits, 0)) & 1).astype(bool)
+
+    def valid_in(self, code: str) -> List[str]:
+        """releases in which a code is valid"""
+        row = int(self.rows([code])[0])
+        mask = int(self._masks[row])
+        return [version for k, version in enumerate(self.versions) if mask >> k & 1]
+
+    def description(self, code: str, version: str) -> Optional[str]:
+        """description of a code in a release, or None if it is not valid in that release"""
+        row, bit = int(self.rows([code])[0]), int(self.bits([version])[0])
+        if row == -1 or bit == -1:
+            return None
+        description_id = self.description_ids[row, bit]
+        return None if description_id == -1 else self.descriptions[description_id]
+
+    def changes(self, version: str, since: Optional[str] = None) -> Changes:
+        """codes added, removed and re-described by a release
+
+        Args:
+            version (str): release, e.g. "2022"
+            since (str, optional): earlier release to compare with. Defaults to the release just
+                before `version`.
+
+        Returns:
+            Changes: sorted lists of codes
+        """
+        new = self._bit(version)
+        if since is None:
+            if new == 0:
+                raise ValueError(f"{version} is the first release in the index")
+            old = new - 1
+        else:
+            old = self._bit(since)
+        in_old = (self.masks >> old & 1).astype(bool)
+        in_new = (self.masks >> new & 1).astype(bool)
+        old_descriptions, new_descriptions = self.description_ids[:, old], self.description_ids[:, new]
+        revised = in_old & in_new & (old_descriptions != new_descriptions)
+        return Changes(
+            self._codes(in_new & ~in_old), self._codes(in_old & ~in_new), self._codes(revised)
+        )
+
+    def _bit(self, version: str) -> int:
+        bit = int(self.bits([version])[0])
+        if bit == -1:
+            raise ValueError(f"no release {version} in the index, which covers {self.versions}")
+        return bit
+
+    def _codes(self, mask: np.ndarray) -> List[str]:
+        return sorted(self.codes[int(i)] for i in np.flatnonzero(mask))
+
+    def __len__(self) -> int:
+        return len(self.masks)
+
+    def __repr__(self):
+        return f"VersionIndex({len(self)} codes, versions {self.versions[0]}-{self.versions[-1]})"
+
+
+def icd10cm() -> VersionIndex:
+    """version index of every packaged icd-10-cm release, memory-mapped from the packaged data
+    if available and built from the packaged hierarchies otherwise"""
+
+    def load():
+        index = hierarchy.load_resource(VERSION_INDEX, VersionIndex.load)
+        if index is None:
+            index = VersionIndex.from_trees(
+                {version: hierarchy.icd10cm(version, as_networkx=False)[0] for version in hierarchy.ICD10CM_VERSIONS}
+            )
+        return index
+
+    return hierarchy.cache.get(("icd10cm", None), VersionIndex, load)
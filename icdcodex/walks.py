@@ -0,0 +1,250 @@
+"""node2vec random walks over the array representation of an ICD hierarchy"""
+
+from typing import Dict, Iterator, List, Optional
+from pathlib import Path
+import numpy as np
+from . import _parallel
+from .tree import IcdTree
+
+# arrays of the tree being walked, set in each worker process by `_init_worker`
+_arrays: Dict[str, np.ndarray] = {}
+
+
+class RandomWalker:
+    """generate node2vec random walks with numpy, advancing a whole block of walks per step
+
+    Walks start from every node (or from `starts`), `num_walks` times, in a random order each round. Instead of
+    precomputing transition probabilities for every edge like the node2vec package, the
+    p/q bias is computed on the fly: in a tree, a neighbour of the current node is either the
+    node the walk came from (weight 1/p) or farther away from it (weight 1/q).
+
+    By default walks only move from parents to children, which is what node2vec does with the
+    directed hierarchies in `hierarchy`, so they end early at leaves. Walks are padded with -1.
+
+    Args:
+        tree (IcdTree): ICD hierarchy
+        walk_length (int): maximum number of nodes in each walk. Defaults to 10.
+        num_walks (int): number of walks from each node. Defaults to 10.
+        p (float): return parameter; the higher, the less likely walks go back. Defaults to 1.
+        q (float): in-out parameter; the higher, the more walks stay local. Defaults to 1.
+        directed (bool): If False, walks move along edges in both directions. Defaults to True.
+        seed (int, optional): seed for reproducible walks, whatever the number of workers. Defaults to None.
+        workers (int): number of processes, where -1 means one per CPU. Defaults to 1.
+        block_size (int): number of walks advanced together, and the unit of work of each
+            process. Defaults to 8192.
+        starts (np.ndarray, optional): ids of the nodes to start walks from, e.g. the
+            neighbourhood of the nodes that changed since the last fit. Defaults to every node.
+    """
+
+    def __init__(
+        self,
+        tree: IcdTree,
+        walk_length: int = 10,
+        num_walks: int = 10,
+        p: float = 1.0,
+        q: float = 1.0,
+        directed: bool = True,
+        seed: Optional[int] = None,
+        workers: int = 1,
+        block_size: int = 8192,
+        starts: Optional[np.ndarray] = None,
+    ):
+        if p <= 0 or q <= 0:
+            raise ValueError(f"p and q must be positive, but got p={p} and q={q}")
+        self.tree = tree
+        self.walk_length = walk_length
+        self.num_walks = num_walks
+        self.p = p
+        self.q = q
+        self.directed = directed
+        self.seed = seed
+        self.workers = workers
+        self.block_size = block_size
+        self.starts = np.arange(len(tree), dtype=np.int32) if starts is None else np.asarray(starts, dtype=np.int32)
+        # the seed is fixed once so that every pass over the walks yields the same walks
+        self._entropy = np.random.SeedSequence(seed).entropy
+
+    def __len__(self) -> int:
+        """total number of walks"""
+        return self.num_walks * len(self.starts)
+
+    def blocks(self) -> Iterator[np.ndarray]:
+        """generate the walks block by block, in a process pool if `workers` is not 1
+
+        Yields:
+            np.ndarray: int32 node ids of shape (number of walks, walk_length), padded with -1
+        """
+        tree = self.tree
+        n = len(tree)
+        child_positions = np.empty(n, dtype=np.int64)
+        child_positions[tree.child_ids] = np.arange(len(tree.child_ids))
+        child_ranks = np.zeros(n, dtype=np.int32)
+        child_ranks[1:] = child_positions[1:] - tree.child_offsets[tree.parent_ids[1:]]
+        arrays = {
+            "child_offsets": np.asarray(tree.child_offsets),
+            "child_ids": np.asarray(tree.child_ids),
+            "parent_ids": np.asarray(tree.parent_ids),
+            "child_ranks": child_ranks,
+        }
+        options = (self.walk_length, self.p, self.q, self.directed)
+        yield from _parallel.imap(
+            _walk_block, self._tasks(options), self.workers, processes=True, initializer=_init_worker, initargs=(arrays,)
+        )
+
+    def walks(self) -> np.ndarray:
+        """every walk, as one int32 array of shape (len(self), walk_length) padded with -1"""
+        return np.concatenate(list(self.blocks()))
+
+    def sentences(self) -> List[List[str]]:
+        """every walk, as lists of node names (the input that gensim's Word2Vec expects)"""
+        names = _names(self.tree)
+        return [sentence for block in self.blocks() for sentence in _sentences(block, names)]
+
+    def spill(self, fp) -> np.ndarray:
+        """write every walk to an int32 .npy file, one block at a time
+
+        Args:
+            fp (Pathlike): destination file
+
+        Returns:
+            np.ndarray: the walks, memory-mapped from `fp`
+        """
+        walks = np.lib.format.open_memmap(fp, mode="w+", dtype=np.int32, shape=(len(self), self.walk_length))
+        start = 0
+        for block in self.blocks():
+            walks[start:start + len(block)] = block
+            start += len(block)
+        walks.flush()
+        del walks
+        return np.load(fp, mmap_mode="r")
+
+    def _tasks(self, options):
+        n = len(self.starts)
+        rounds = np.random.SeedSequence(self._entropy).spawn(self.num_walks)
+        for seed_sequence in rounds:
+            order_seed, *block_seeds = seed_sequence.spawn(1 + -(-n // self.block_size))
+            order = self.starts[np.random.default_rng(order_seed).permutation(n)]
+            for k, block_seed in enumerate(block_seeds):
+                yield order[k * self.block_size:(k + 1) * self.block_size], block_seed, options
+
+
+class WalkCorpus:
+    """the walks of a `RandomWalker` as a restartable iterable of sentences, for gensim's Word2Vec
+
+    Word2Vec iterates over its corpus once to build the vocabulary and once per epoch. Instead
+    of holding every sentence in memory, each pass either generates the (identical) walks again,
+    block by block, or reads them from an int32 file written by `RandomWalker.spill` on the
+    first pass. Either way, memory use depends on the block size and not on `num_walks`.
+
+    Args:
+        walker (RandomWalker): walks to iterate over
+        spill (Pathlike, optional): file to write the walks to, or None to generate them on every
+            pass. Defaults to None.
+    """
+
+    def __init__(self, walker: RandomWalker, spill=None):
+        self.walker = walker
+        self.spill = None if spill is None else Path(spill)
+        self._names = _names(walker.tree)
+        self._walks: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.walker)
+
+    def __iter__(self) -> Iterator[List[str]]:
+        for block in self.blocks():
+            yield from _sentences(block, self._names)
+
+    def blocks(self) -> Iterator[np.ndarray]:
+        """the walks, block by block, as in `RandomWalker.blocks`"""
+        if self.spill is None:
+            yield from self.walker.blocks()
+            return
+        if self._walks is None:
+            self._walks = self.walker.spill(self.spill)
+        block_size = self.walker.block_size
+        for start in range(0, len(self._walks), block_size):
+            yield np.asarray(self._walks[start:start + block_size])
+
+    def close(self):
+        """release the spilled walks, if any"""
+        self._walks = None
+
+
+def _names(tree: IcdTree) -> np.ndarray:
+    return np.array(list(tree.names) + [None], dtype=object)  # -1 pads map to None
+
+
+def _sentences(block: np.ndarray, names: np.ndarray) -> Iterator[List[str]]:
+    lengths = np.count_nonzero(block != -1, axis=1).tolist()
+    return (walk[:length] for walk, length in zip(names[block].tolist(), lengths))
+
+
+def _init_worker(arrays: Dict[str, np.ndarray]):
+    global _arrays
+    _arrays = arrays
+
+
+def _walk_block(task) -> np.ndarray:
+    starts, seed_sequence, (walk_length, p, q, directed) = task
+    return walk(starts, np.random.default_rng(seed_sequence), walk_length, p, q, directed, **_arrays)
+
+
+def walk(
+    starts: np.ndarray,
+    rng: np.random.Generator,
+    walk_length: int,
+    p: float,
+    q: float,
+    directed: bool,
+    child_offsets: np.ndarray,
+    child_ids: np.ndarray,
+    parent_ids: np.ndarray,
+    child_ranks: np.ndarray,
+) -> np.ndarray:
+    """advance one walk from each start node in lock-step
+
+    The neighbours of a node are its parent (unless it is the root, or the walk is directed)
+    followed by its children, and `child_ranks` gives the position of each node among its
+    parent's children. Tracking the position of the previous node among the current node's
+    neighbours is enough to apply the p/q bias without looking up any edge.
+
+    Returns:
+        np.ndarray: int32 node ids of shape (len(starts), walk_length), padded with -1
+    """
+    walks = np.full((len(starts), walk_length), -1, dtype=np.int32)
+    if walk_length == 0:
+        return walks
+    walks[:, 0] = starts
+    rows = np.arange(len(starts))
+    current = starts.astype(np.int64)
+    previous_positions = np.zeros(len(starts), dtype=np.int64)
+    biased = not directed and (p != 1 or q != 1)
+    for step in range(1, walk_length):
+        num_children = child_offsets[current + 1] - child_offsets[current]
+        has_parent = np.zeros(len(current), dtype=np.int64) if directed else (parent_ids[current] != -1).astype(np.int64)
+        degrees = num_children + has_parent
+        moving = degrees > 0
+        if not moving.all():
+            rows, current, degrees = rows[moving], current[moving], degrees[moving]
+            has_parent, previous_positions = has_parent[moving], previous_positions[moving]
+        if not len(rows):
+            break
+        u = rng.random(len(rows))
+        if biased and step > 1:
+            # go back with weight 1/p, or to one of the other degrees - 1 neighbours with weight 1/q each
+            back = 1 / p
+            x = u * (back + (degrees - 1) / q)
+            others = np.minimum(((x - back) * q).astype(np.int64), degrees - 2)
+            others += others >= previous_positions
+            positions = np.where(x < back, previous_positions, others)
+        else:
+            positions = (u * degrees).astype(np.int64)
+        to_parent = (positions == 0) & (has_parent == 1)
+        child_index = np.maximum(child_offsets[current] + positions - has_parent, 0)
+        following = np.where(to_parent, parent_ids[current], child_ids[np.minimum(child_index, len(child_ids) - 1)])
+        # position of the current node among the neighbours of the next one
+        previous_positions = np.where(to_parent, child_ranks[current] + (parent_ids[following] != -1), 0)
+        current = following.astype(np.int64)
+        walks[rows, step] = current
+    return walks
@@ -14,6 +14,7 @@ except FileNotFoundError: # tox
 
 requirements = [
     'networkx',
+    'numpy',
     'node2vec',
     'untangle',
     'scikit-learn',
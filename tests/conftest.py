@@ -1,5 +1,6 @@
 import pytest
 from icdcodex import datacleaning
+from icdcodex.tree import IcdTree
 
 
 @pytest.fixture(scope="session")
@@ -9,4 +10,10 @@ def hierarchy_construction_intermediates():
         "tests/testdata/2020-ICD-10-CM-Code-Tables.zip",
         return_intermediates=True
     )
-    return H, untangle_elem, codes
\ No newline at end of file
+    return H, untangle_elem, codes
+
+
+@pytest.fixture(scope="session")
+def sample_tree():
+    G, codes = datacleaning.build_icd9_hierarchy("tests/testdata/icd9Hierarchy-sample.json")
+    return IcdTree.from_networkx(G, list(codes), meta={"revision": "icd9"})
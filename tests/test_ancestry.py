@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+import networkx as nx
+from icdcodex import hierarchy
+from icdcodex.ancestry import AncestryIndex
+
+
+@pytest.fixture(scope="module")
+def icd9():
+    G, _ = hierarchy.icd9()
+    tree, _ = hierarchy.icd9(as_networkx=False)
+    return G, AncestryIndex(tree)
+
+
+@pytest.mark.unit
+def test_lca_matches_networkx(icd9):
+    G, index = icd9
+    rng = np.random.default_rng(0)
+    a, b = rng.integers(0, len(index.tree), size=(2, 50))
+    lcas = index.lca(a, b)
+    for u, v, w in zip(a, b, lcas):
+        u, v, w = index.tree.names[u], index.tree.names[v], index.tree.names[w]
+        assert w == nx.lowest_common_ancestor(G, u, v)
+
+
+@pytest.mark.unit
+def test_lca_of_names_and_self():
+    G = nx.DiGraph([("root", "A"), ("A", "A1"), ("A", "A2"), ("A2", "A21"), ("root", "B")])
+    index = AncestryIndex(G)
+    names = index.tree.names
+    assert [names[i] for i in index.lca(["A1", "A21", "A2", "B", "A"], ["A21", "A21", "A21", "A21", "root"])] == [
+        "A", "A21", "A2", "root", "root"
+    ]
+
+
+@pytest.mark.unit
+def test_is_descendant_and_depth(icd9):
+    G, index = icd9
+    section = "Intestinal Infectious Diseases"
+    descendants = nx.descendants(G, section)
+    codes = ["0010", "0020", "042", section]
+    expected = [code in descendants or code == section for code in codes]
+    assert index.is_descendant(codes, section).tolist() == expected
+    assert index.is_descendant([section], [section], strict=True).tolist() == [False]
+    assert index.depth(codes).tolist() == [nx.shortest_path_length(G, "root", code) for code in codes]
+
+
+@pytest.mark.unit
+def test_ancestor_at_depth(icd9):
+    G, index = icd9
+    chapter, = [n for n in G.predecessors("Intestinal Infectious Diseases")]
+    chapters = index.ancestor_at_depth(["0010", "0020", "root"], 1)
+    assert index.tree.names[chapters[0]] == chapter
+    assert chapters[0] == chapters[1]
+    assert chapters[2] == -1
+
+
+@pytest.mark.unit
+def test_ancestor_at_negative_depth(icd9):
+    _, index = icd9
+    assert index.ancestor_at_depth(["0010"], -1).tolist() == [-1]
+    assert index.ancestor_at_depth(["0010", "0010"], [-2, 0]).tolist() == [-1, 0]
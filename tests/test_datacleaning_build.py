@@ -0,0 +1,59 @@
+import json
+import shutil
+import pytest
+from icdcodex import datacleaning
+from icdcodex.tree import IcdTree
+
+ICD9_SAMPLE = "tests/testdata/icd9Hierarchy-sample.json"
+
+
+@pytest.fixture
+def sources(tmp_path):
+    fp = tmp_path / "icd9Hierarchy.json"
+    shutil.copy(ICD9_SAMPLE, fp)
+    return [("icd9", None, (str(fp),))]
+
+
+@pytest.mark.unit
+def test_build_writes_outputs_and_manifest(tmp_path, sources):
+    manifest = datacleaning.main(tmp_path, sources, workers=1)
+    entry = manifest["icd-9"]
+    assert entry["codes"] == 11
+    assert set(entry["outputs"]) == {"icd-9-hierarchy.json", "icd-9-hierarchy.bin", "icd-9-search.bin"}
+    assert json.loads((tmp_path / datacleaning.BUILD_MANIFEST).read_text()) == manifest
+    tree = IcdTree.load(tmp_path / "icd-9-hierarchy.bin")
+    assert len(tree) == entry["nodes"]
+    assert tree.meta == {"revision": "icd9"}
+
+
+@pytest.mark.unit
+def test_build_skips_current_outputs(tmp_path, sources):
+    first = datacleaning.main(tmp_path, sources, workers=1)
+    output = tmp_path / "icd-9-hierarchy.bin"
+    output.write_bytes(output.read_bytes())  # a rebuild would overwrite it with a new file
+    inode = output.stat().st_ino
+    assert datacleaning.main(tmp_path, sources, workers=1) == first
+    assert output.stat().st_ino == inode
+    forced = datacleaning.main(tmp_path, sources, workers=1, force=True)
+    assert forced["icd-9"]["fingerprint"] == first["icd-9"]["fingerprint"]
+    assert output.stat().st_ino != inode
+
+
+@pytest.mark.unit
+def test_build_reruns_when_sources_change(tmp_path, sources):
+    first = datacleaning.main(tmp_path, sources, workers=1)
+    (_, _, (fp,)), = sources
+    records = json.loads(open(fp).read())
+    with open(fp, "w") as f:
+        json.dump(records[1:], f)
+    second = datacleaning.main(tmp_path, sources, workers=1)
+    assert second["icd-9"]["fingerprint"] != first["icd-9"]["fingerprint"]
+    assert second["icd-9"]["codes"] == 10
+
+
+@pytest.mark.unit
+def test_build_reruns_when_outputs_are_missing(tmp_path, sources):
+    datacleaning.main(tmp_path, sources, workers=1)
+    (tmp_path / "icd-9-search.bin").unlink()
+    datacleaning.main(tmp_path, sources, workers=1)
+    assert (tmp_path / "icd-9-search.bin").exists()
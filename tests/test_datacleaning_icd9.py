@@ -0,0 +1,72 @@
+import json
+import random
+import networkx as nx
+import pytest
+from icdcodex import datacleaning, hierarchy
+
+ICD9_SAMPLE = "tests/testdata/icd9Hierarchy-sample.json"
+
+INFECTIOUS = "Infectious And Parasitic Diseases"
+BLOOD = "Diseases Of The Blood And Blood-Forming Organs"
+SUPPLEMENTARY = "Supplementary Classification Of Factors Influencing Health Status And Contact With Health Services"
+CONTACT = "Persons With Potential Health Hazards Related To Communicable Diseases"
+
+
+@pytest.mark.unit
+def test_icd9_edges_in_insertion_order():
+    G, codes = datacleaning.build_icd9_hierarchy(ICD9_SAMPLE)
+    assert list(codes) == ["0010", "0011", "0019", "0020", "0030", "0100", "2800", "2801", "2810", "7400", "V010"]
+    assert list(G.edges()) == [
+        ("root", INFECTIOUS),
+        ("root", BLOOD),
+        ("root", "Congenital Anomalies"),
+        ("root", SUPPLEMENTARY),
+        (INFECTIOUS, "Intestinal Infectious Diseases"),
+        (INFECTIOUS, "Tuberculosis"),
+        (BLOOD, "Iron deficiency anemias"),
+        (BLOOD, "Other deficiency anemias"),
+        ("Congenital Anomalies", "Anencephalus and similar anomalies"),
+        (SUPPLEMENTARY, CONTACT),
+        ("Intestinal Infectious Diseases", "Cholera"),
+        ("Intestinal Infectious Diseases", "Typhoid and paratyphoid fevers"),
+        ("Intestinal Infectious Diseases", "Other salmonella infections"),
+        ("Tuberculosis", "Primary tuberculous infection"),
+        ("Iron deficiency anemias", "2800"),
+        ("Iron deficiency anemias", "2801"),
+        ("Other deficiency anemias", "2810"),
+        ("Anencephalus and similar anomalies", "7400"),
+        (CONTACT, "Contact with or exposure to communicable diseases"),
+        ("Cholera", "0010"),
+        ("Cholera", "0011"),
+        ("Cholera", "0019"),
+        ("Typhoid and paratyphoid fevers", "0020"),
+        ("Other salmonella infections", "0030"),
+        ("Primary tuberculous infection", "0100"),
+        ("Contact with or exposure to communicable diseases", "V010"),
+    ]
+    descriptions = nx.get_node_attributes(G, "description")
+    assert set(descriptions) == set(codes)
+    assert descriptions["2801"] == "Iron deficiency anemia secondary to inadequate dietary iron intake"
+
+
+@pytest.mark.unit
+def test_icd9_rebuilds_packaged_hierarchy(tmp_path):
+    """rebuild the packaged hierarchy from a source file reconstructed from it"""
+    packaged, _ = hierarchy.icd9()
+    rows = []
+    for code in (n for n in packaged.nodes() if packaged.out_degree(n) == 0):
+        chapter, *subchapter, major = nx.shortest_path(packaged, "root", code)[1:-1]
+        rows.append({
+            "icd9": code,
+            "descLong": packaged.nodes[code].get("description"),
+            "major": major,
+            "subchapter": subchapter[0] if subchapter else None,
+            "chapter": chapter,
+        })
+    random.Random(0).shuffle(rows)
+    fp = tmp_path / "icd9Hierarchy.json"
+    fp.write_text(json.dumps(rows))
+    G, codes = datacleaning.build_icd9_hierarchy(fp)
+    assert set(G.edges()) == set(packaged.edges())
+    assert nx.get_node_attributes(G, "description") == nx.get_node_attributes(packaged, "description")
+    assert sorted(codes) == sorted(row["icd9"] for row in rows)
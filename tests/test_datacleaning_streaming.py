@@ -0,0 +1,235 @@
+import io
+import pytest
+import networkx as nx
+import untangle
+from icdcodex import datacleaning
+
+tabular_xml = """\
+<?xml version="1.0" encoding="utf-8"?>
+<ICD10CM.tabular>
+    <version>2020</version>
+    <introduction>
+        <introSection type="title"><title>ICD-10-CM TABULAR LIST of DISEASES and INJURIES</title></introSection>
+    </introduction>
+    <chapter>
+        <name>2</name>
+        <desc>Neoplasms (C00-D49)</desc>
+        <sectionIndex>
+            <sectionRef first="C00" last="C96" id="C00-C96">Malignant neoplasms</sectionRef>
+        </sectionIndex>
+        <section id="C00-C96">
+            <desc>Malignant neoplasms (C00-C96)</desc>
+        </section>
+        <section id="C00-C14">
+            <desc>Malignant neoplasms of lip, oral cavity and pharynx (C00-C14)</desc>
+            <diag>
+                <name>C00</name>
+                <desc>Malignant neoplasm of lip</desc>
+                <excludes1><note>malignant melanoma of lip (C43.0)</note></excludes1>
+                <diag>
+                    <name>C00.0</name>
+                    <desc>Malignant neoplasm of external upper lip</desc>
+                    <inclusionTerm><note>Malignant neoplasm of lipstick area of upper lip</note></inclusionTerm>
+                </diag>
+                <diag>
+                    <name>C00.9</name>
+                    <desc>Malignant neoplasm of lip, unspecified</desc>
+                </diag>
+            </diag>
+        </section>
+    </chapter>
+    <chapter>
+        <name>19</name>
+        <desc>Injury, poisoning and certain other consequences of external causes (S00-T88)</desc>
+        <section id="S00-S09">
+            <desc>Injuries to the head (S00-S09)</desc>
+            <diag>
+                <name>S06</name>
+                <desc>Intracranial injury</desc>
+                <sevenChrNote><note>The appropriate 7th character is to be added to each code from category S06</note></sevenChrNote>
+                <sevenChrDef>
+                    <extension char="A">initial encounter</extension>
+                    <extension char="D">subsequent encounter</extension>
+                    <extension char="S">sequela</extension>
+                </sevenChrDef>
+                <diag>
+                    <name>S06.0</name>
+                    <desc>Concussion</desc>
+                    <diag>
+                        <name>S06.0X0</name>
+                        <desc>Concussion without loss of consciousness</desc>
+                    </diag>
+                    <diag>
+                        <name>S06.0X1A</name>
+                        <desc>Concussion with loss of consciousness of 30 minutes or less, initial encounter</desc>
+                    </diag>
+                </diag>
+                <diag>
+                    <name>S06.1</name>
+                    <desc>Traumatic cerebral edema</desc>
+                    <sevenChrDef>
+                        <extension char="A">initial encounter</extension>
+                    </sevenChrDef>
+                </diag>
+            </diag>
+        </section>
+        <section id="T07-T07">
+            <desc>Injuries involving multiple body regions (T07)</desc>
+            <diag>
+                <name>T07</name>
+                <desc>Unspecified multiple injuries</desc>
+                <sevenChrDef>
+                    <extension char="A">initial encounter</extension>
+                    <extension char="D">subsequent encounter</extension>
+                    <extension char="S">sequela</extension>
+                </sevenChrDef>
+            </diag>
+        </section>
+    </chapter>
+</ICD10CM.tabular>"""
+
+
+def baseline_traverse_diag(G, parent, untangle_elem, extensions=None):
+    """frozen copy of `traverse_diag` from the undirected builder"""
+    self = untangle_elem.name.cdata
+    description = untangle_elem.desc.cdata
+    G.add_node(self, description=description)
+    G.add_edge(self, parent)
+    try:
+        extension_elems = untangle_elem.sevenChrDef.extension
+    except AttributeError:
+        extensions = [] if extensions is None else extensions
+    else:
+        extensions = [(ext["char"], ext.cdata) for ext in extension_elems]
+    try:
+        children = untangle_elem.diag
+    except AttributeError:
+        if extensions:
+            if 7 < len(self):
+                return
+            for extension, extension_desc in extensions:
+                if "." not in self:
+                    extension = "." + ("X" * (7 - len(self) - len(extension))) + extension
+                else:
+                    extension = ("X" * (8 - len(self) - len(extension))) + extension
+                G.add_node(self + extension, description=description + " " + extension_desc)
+                G.add_edge(self + extension, self)
+    else:
+        for child in children:
+            baseline_traverse_diag(G, self, child, extensions)
+
+
+def baseline_build_icd10_hierarchy(xml_root, codes, root_name=None, prune_extra_codes=True):
+    """frozen copy of the undirected builder: add every node and extension, prune the leaves
+    that are not codes, then copy the graph with `bfs_tree`"""
+    if root_name is None:
+        root_name = "root"
+    G = nx.Graph()
+    G.add_node(root_name)
+    for chapter_elem in xml_root.ICD10CM_tabular.chapter:
+        chapter = chapter_elem.desc.cdata
+        G.add_node(chapter, chapter_num=chapter_elem.name.cdata)
+        G.add_edge(chapter, root_name)
+        for section_elem in chapter_elem.section:
+            section = section_elem.desc.cdata
+            try:
+                diag_elems = section_elem.diag
+            except AttributeError:
+                pass
+            else:
+                G.add_node(section)
+                G.add_edge(section, chapter)
+                for diag_elem in diag_elems:
+                    baseline_traverse_diag(G, section, diag_elem)
+    leafs = [n for n in G.nodes() if G.degree[n] == 1]
+    if prune_extra_codes:
+        codes_ = set(codes)
+        G.remove_nodes_from(leaf for leaf in leafs if leaf not in codes_)
+    G_directed = nx.algorithms.traversal.breadth_first_search.bfs_tree(G, source=root_name)
+    for node in G_directed.nodes():
+        description = G.nodes[node].get("description", None)
+        if description:
+            G_directed.nodes[node]["description"] = description
+    return G_directed
+
+
+def build_both(xml, codes, **kwargs):
+    expected = baseline_build_icd10_hierarchy(untangle.parse(xml), codes, **kwargs)
+    for actual, _ in (
+        datacleaning.build_icd10_hierarchy(untangle.parse(xml), codes, **kwargs),
+        datacleaning.build_icd10_hierarchy_from_xml(io.BytesIO(xml.encode()), codes, **kwargs),
+    ):
+        assert_same_graph(expected, actual)
+    return expected, actual
+
+
+def assert_same_graph(expected, actual):
+    assert dict(actual.nodes(data=True)) == dict(expected.nodes(data=True))
+    assert set(actual.edges()) == set(expected.edges())
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("prune_extra_codes", [True, False])
+def test_builders_match_baseline(prune_extra_codes):
+    codes = ["C00.0", "S06.0X0A", "S06.0X0D", "S06.0X1A", "S06.1XXA", "T07.XXXA", "T07.XXXD"]
+    expected, actual = build_both(tabular_xml, codes, root_name="r00t", prune_extra_codes=prune_extra_codes)
+    assert "T07.XXXA" in actual.nodes()
+    assert "C00-C96" not in actual.nodes()
+    assert_same_graph(expected, actual)
+
+
+@pytest.mark.unit
+def test_streaming_inherits_extensions():
+    _, H = build_both(tabular_xml, [], prune_extra_codes=False)
+    assert set(H.successors("S06.0X0")) == {"S06.0X0A", "S06.0X0D", "S06.0X0S"}
+    assert set(H.successors("S06.1")) == {"S06.1XXA"}  # its own <sevenChrDef> overrides S06's
+    assert not set(H.successors("S06.0X1A"))
+    assert H.nodes["S06.0X0D"]["description"] == "Concussion without loss of consciousness subsequent encounter"
+
+
+@pytest.mark.unit
+def test_builders_match_baseline_on_code_tables(hierarchy_construction_intermediates):
+    H, untangle_elem, codes = hierarchy_construction_intermediates
+    G, _ = datacleaning.build_icd10cm_hierarchy_from_zip(
+        "tests/testdata/2020-ICD-10-CM-Codes.zip",
+        "tests/testdata/2020-ICD-10-CM-Code-Tables.zip",
+    )
+    expected = baseline_build_icd10_hierarchy(untangle_elem, codes)
+    assert_same_graph(expected, H)
+    assert_same_graph(expected, G)
+
+
+@pytest.mark.unit
+def test_children_in_document_order():
+    expected, actual = build_both(tabular_xml, [], prune_extra_codes=False)
+    for H in (expected, actual):
+        assert list(H.successors("S06")) == ["S06.0", "S06.1"]
+        assert list(H.successors("S06.0X0")) == ["S06.0X0A", "S06.0X0D", "S06.0X0S"]
+
+
+@pytest.mark.unit
+@pytest.mark.filterwarnings("ignore: parsing strangeness")
+def test_pruning_keeps_the_root_of_a_single_chapter():
+    xml = tabular_xml.replace(tabular_xml[tabular_xml.index("    <chapter>"):tabular_xml.index("    <chapter>\n        <name>19")], "")
+    # the baseline pruned the root here, as a leaf, and `bfs_tree` then failed
+    expected, _ = datacleaning.build_icd10_hierarchy(untangle.parse(xml), ["T07.XXXA"], root_name="r00t")
+    actual, _ = datacleaning.build_icd10_hierarchy_from_xml(io.BytesIO(xml.encode()), ["T07.XXXA"], root_name="r00t")
+    assert_same_graph(expected, actual)
+    assert "r00t" in actual.nodes()
+    assert "S06.0X0A" not in actual.nodes()
+
+
+@pytest.mark.unit
+def test_pruning_keeps_diagnoses_whose_extensions_are_not_codes():
+    _, H = build_both(tabular_xml, ["C00.0", "S06.0X1A", "S06.1XXA"])
+    assert {"T07", "S06.0X0"} <= set(H.nodes())
+    assert not set(H.successors("T07"))
+    assert "C00.9" not in H.nodes()
+
+
+@pytest.mark.unit
+def test_traverse_diag_is_deprecated():
+    G = nx.Graph()
+    with pytest.warns(DeprecationWarning, match="traverse_diag"):
+        datacleaning.traverse_diag(G, "section", untangle.parse(tabular_xml).ICD10CM_tabular.chapter[1].section[0].diag)
+    assert set(G.neighbors("S06.0X0")) == {"S06.0", "S06.0X0A", "S06.0X0D", "S06.0X0S"}
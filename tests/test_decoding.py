@@ -0,0 +1,146 @@
+import numpy as np
+import pytest
+from icdcodex.decoding import DecodingIndex, ExactIndex, IVFIndex, TreeIndex
+
+
+@pytest.fixture(scope="module")
+def embeddings():
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((20, 16))
+    return (centers[rng.integers(0, 20, 2000)] + 0.3 * rng.standard_normal((2000, 16))).astype(np.float32)
+
+
+@pytest.fixture(scope="module")
+def queries(embeddings):
+    rng = np.random.default_rng(1)
+    return embeddings[:300] + 0.1 * rng.standard_normal((300, 16)).astype(np.float32)
+
+
+def brute_force(embeddings, queries, metric, k):
+    if metric == "cosine":
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    if metric == "euclidean":
+        scores = np.linalg.norm(queries[:, None] - embeddings[None], axis=2)
+        rows = np.argsort(scores, axis=1)[:, :k]
+    else:
+        scores = queries @ embeddings.T
+        rows = np.argsort(-scores, axis=1)[:, :k]
+    return np.take_along_axis(scores, rows, axis=1), rows
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("metric", ["cosine", "euclidean", "dot"])
+@pytest.mark.parametrize("k", [1, 5, 40])
+def test_exact_index(embeddings, queries, metric, k):
+    scores, rows = ExactIndex(metric, chunk_size=64).fit(embeddings).search(queries, k)
+    expected_scores, expected_rows = brute_force(embeddings, queries, metric, k)
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-4, atol=1e-4)
+    assert np.mean(rows == expected_rows) > 0.999  # up to near ties
+
+
+@pytest.mark.unit
+def test_results_are_padded(embeddings, queries):
+    scores, rows = ExactIndex().fit(embeddings[:3]).search(queries[:2], k=5)
+    assert (rows[:, 3:] == -1).all() and np.isnan(scores[:, 3:]).all()
+    assert sorted(rows[0, :3]) == [0, 1, 2]
+
+
+@pytest.mark.unit
+def test_ivf_index_is_exact_when_probing_every_list(embeddings, queries):
+    index = IVFIndex(n_lists=16, n_probe=16, seed=0).fit(embeddings)
+    _, rows = index.search(queries, k=5)
+    _, expected = ExactIndex().fit(embeddings).search(queries, k=5)
+    np.testing.assert_array_equal(rows, expected)
+    assert index.list_offsets[-1] == len(embeddings)
+
+
+@pytest.mark.unit
+def test_decoding_index_is_abstract():
+    class Incomplete(DecodingIndex):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+@pytest.mark.unit
+def test_ivf_cosine_centroids_are_normalized(embeddings):
+    index = IVFIndex(n_lists=16, seed=0).fit(embeddings)
+    np.testing.assert_allclose(np.linalg.norm(index.centroids, axis=1), 1, rtol=1e-5)
+    _, expected = ExactIndex().fit(index.centroids).search(embeddings)
+    members = np.repeat(np.arange(16), np.diff(index.list_offsets))
+    np.testing.assert_array_equal(members, expected[index._order, 0])
+
+
+@pytest.mark.unit
+def test_ivf_update_keeps_lists(embeddings, queries):
+    index = IVFIndex(n_lists=16, n_probe=16, seed=0).fit(embeddings[:1500])
+    centroids = index.centroids
+    _, rows = index.update(embeddings).search(queries, k=5)
+    _, expected = ExactIndex().fit(embeddings).search(queries, k=5)
+    np.testing.assert_array_equal(rows, expected)
+    assert index.centroids is centroids and index.list_offsets[-1] == len(embeddings)
+
+
+@pytest.mark.unit
+def test_ivf_recall_grows_with_probes(embeddings, queries):
+    _, expected = ExactIndex().fit(embeddings).search(queries, k=10)
+    index = IVFIndex(n_lists=64, seed=0).fit(embeddings)
+
+    def recall(n_probe):
+        index.n_probe = n_probe
+        _, rows = index.search(queries, k=10)
+        return np.mean([len(set(a) & set(b)) / 10 for a, b in zip(rows.tolist(), expected.tolist())])
+
+    assert recall(1) <= recall(4) <= recall(16)
+    assert 0.9 < recall(16)
+
+
+@pytest.mark.unit
+def test_tree_index_searches_subtrees(sample_tree):
+    codes = list(sample_tree.codes)
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((len(codes), 8)).astype(np.float32)
+    index = TreeIndex(sample_tree, codes).fit(embeddings)
+    queries = embeddings + 0.01
+    _, rows = index.search(queries)
+    assert rows[:, 0].tolist() == list(range(len(codes)))
+    # constrained to the subtree of cholera, every query decodes to a cholera code
+    cholera = sample_tree.node_id("Cholera")
+    under = set(sample_tree.subtree(cholera).tolist())
+    _, rows = index.search(queries, k=len(codes), within="Cholera")
+    found = {sample_tree.node_id(codes[row]) for row in rows.reshape(-1) if row != -1}
+    assert found == under & set(sample_tree.code_ids.tolist())
+    # per-query constraints, by node id
+    within = np.array([cholera if i % 2 else sample_tree.node_id("Tuberculosis") for i in range(len(codes))])
+    _, rows = index.search(queries, within=within)
+    for row, node in zip(rows[:, 0].tolist(), within.tolist()):
+        assert sample_tree.node_id(codes[row]) in sample_tree.subtree(node)
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("workers", [1, 3])
+def test_search_chunks(embeddings, queries, workers):
+    from icdcodex.decoding import search_chunks
+
+    index = ExactIndex().fit(embeddings)
+    expected_scores, expected_rows = index.search(queries, k=3)
+    chunks = list(search_chunks(index, queries, k=3, workers=workers, chunk_size=64))
+    assert [start for start, _, _ in chunks] == list(range(0, len(queries), 64))
+    np.testing.assert_array_equal(np.concatenate([rows for _, _, rows in chunks]), expected_rows)
+    np.testing.assert_allclose(np.concatenate([scores for _, scores, _ in chunks]), expected_scores)
+    # batches of any size are re-chunked
+    batches = np.array_split(queries, 7)
+    chunks = list(search_chunks(index, iter(batches), k=3, workers=workers, chunk_size=64))
+    assert [len(rows) for _, _, rows in chunks] == [64] * 4 + [44]
+    np.testing.assert_array_equal(np.concatenate([rows for _, _, rows in chunks]), expected_rows)
+
+
+@pytest.mark.unit
+def test_search_chunks_bounds_memory(embeddings, queries):
+    from icdcodex.decoding import search_chunks
+
+    index = ExactIndex().fit(embeddings)
+    chunks = list(search_chunks(index, queries, workers=2, memory_limit=5 * 4 * 2001 * 10))
+    assert max(len(rows) for _, _, rows in chunks) == 10
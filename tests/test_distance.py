@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+import networkx as nx
+from icdcodex import hierarchy
+from icdcodex.ancestry import AncestryIndex
+from icdcodex.distance import information_content, pairwise_distances
+
+
+@pytest.fixture(scope="module")
+def index():
+    tree, _ = hierarchy.icd9(as_networkx=False)
+    return AncestryIndex(tree)
+
+
+CODES = ["0010", "0011", "0020", "042", "V090"]
+
+
+@pytest.mark.unit
+def test_path_distance_matches_networkx(index):
+    G = index.tree.to_networkx().to_undirected()
+    D = pairwise_distances(index, CODES)
+    assert D.tolist() == [[nx.shortest_path_length(G, u, v) for v in CODES] for u in CODES]
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("metric", ["wu_palmer", "lin"])
+def test_similarities_are_normalized(index, metric):
+    S = pairwise_distances(index, CODES, metric=metric)
+    assert np.allclose(np.diag(S), 1)
+    assert ((0 <= S) & (S <= 1)).all()
+    assert S[0, 1] > S[0, 3]  # siblings are more similar than codes in different chapters
+
+
+@pytest.mark.unit
+def test_information_content(index):
+    ic = information_content(index)
+    assert ic[0] == 0
+    assert (ic[index.ids(CODES)] == ic.max()).all()  # codes are leaves
+
+
+@pytest.mark.unit
+def test_chunked_parallel_memmap_and_callback(index, tmp_path):
+    rng = np.random.default_rng(0)
+    a, b = rng.choice(index.tree.code_ids, 300), rng.choice(index.tree.code_ids, 200)
+    expected = pairwise_distances(index, a, b, metric="lin")
+    out = np.lib.format.open_memmap(tmp_path / "lin.npy", mode="w+", dtype=np.float32, shape=(300, 200))
+    blocks = []
+    pairwise_distances(
+        index, a, b, metric="lin", out=out, chunk_size=64, workers=4,
+        callback=lambda i, j, block: blocks.append((i, j, block.shape)),
+    )
+    assert np.array_equal(out, expected)
+    assert [(i, j) for i, j, _ in blocks] == [(i, j) for i in range(0, 300, 64) for j in range(0, 200, 64)]
+    assert blocks[-1][2] == (300 - 256, 200 - 192)
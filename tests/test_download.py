@@ -0,0 +1,117 @@
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from icdcodex import download
+
+BODY = bytes(range(256)) * 1024
+ETAG = '"v1"'
+LAST_MODIFIED = "Wed, 01 Jan 2020 00:00:00 GMT"
+
+
+class Handler(BaseHTTPRequestHandler):
+    """serves BODY with validators and byte ranges; /truncated drops the connection halfway once"""
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        if self.path == "/missing":
+            self.send_error(404)
+            return
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+        start = 0
+        if self.headers.get("Range") and self.headers.get("If-Range") == ETAG:
+            start = int(self.headers["Range"][len("bytes="):-1])
+        self.send_response(206 if start else 200)
+        self.send_header("ETag", ETAG)
+        self.send_header("Last-Modified", LAST_MODIFIED)
+        self.send_header("Content-Length", str(len(BODY) - start))
+        if start:
+            self.send_header("Content-Range", f"bytes {start}-{len(BODY) - 1}/{len(BODY)}")
+        self.end_headers()
+        if self.path == "/truncated" and not self.server.truncated:
+            self.server.truncated = True
+            self.wfile.write(BODY[:len(BODY) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(BODY[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.requests, httpd.truncated = [], False
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def url(server, path):
+    host, port = server.server_address
+    return f"http://{host}:{port}{path}"
+
+
+@pytest.mark.unit
+def test_fetch_is_content_addressed(tmp_path, server):
+    fp = download.Downloader(tmp_path).fetch(url(server, "/a.zip"))
+    assert fp.read_bytes() == BODY
+    assert fp.name == hashlib.sha256(BODY).hexdigest()
+
+
+@pytest.mark.unit
+def test_fetch_revalidates_cached_copy(tmp_path, server):
+    downloader = download.Downloader(tmp_path)
+    first = downloader.fetch(url(server, "/a.zip"))
+    second = download.Downloader(tmp_path).fetch(url(server, "/a.zip"))
+    assert first == second
+    _, headers = server.requests[-1]
+    assert headers["If-None-Match"] == ETAG
+    assert headers["If-Modified-Since"] == LAST_MODIFIED
+
+
+@pytest.mark.unit
+def test_fetch_resumes_interrupted_download(tmp_path, server):
+    downloader = download.Downloader(tmp_path, retries=0, chunk_size=4096)
+    with pytest.raises(Exception):
+        downloader.fetch(url(server, "/truncated"))
+    fp = downloader.fetch(url(server, "/truncated"))
+    assert fp.read_bytes() == BODY
+    _, headers = server.requests[-1]
+    offset = int(headers["Range"][len("bytes="):-1])
+    assert 0 < offset <= len(BODY) // 2
+    assert not list((tmp_path / "partial").iterdir())
+
+
+@pytest.mark.unit
+def test_fetch_all_keeps_order(tmp_path, server):
+    urls = [url(server, f"/{i}.zip") for i in range(4)]
+    fps = download.Downloader(tmp_path).fetch_all(urls)
+    assert len(fps) == 4
+    assert len(set(fps)) == 1  # same content, same object
+    assert sorted(path for path, _ in server.requests) == [f"/{i}.zip" for i in range(4)]
+
+
+@pytest.mark.unit
+def test_fetch_raises_for_http_errors(tmp_path, server):
+    import requests
+
+    with pytest.raises(requests.HTTPError):
+        download.Downloader(tmp_path).fetch(url(server, "/missing"))
+
+
+@pytest.mark.unit
+def test_fetch_falls_back_to_cache_when_offline(tmp_path, server):
+    fp = download.Downloader(tmp_path).fetch(url(server, "/a.zip"))
+    address = url(server, "/a.zip")
+    server.shutdown()
+    server.server_close()
+    with pytest.warns(UserWarning, match="cached copy"):
+        assert download.Downloader(tmp_path, retries=0, timeout=1).fetch(address) == fp
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+from icdcodex import hierarchy
+from icdcodex.encoding import CodeEncoder, format_icd10cm, normalize
+
+
+@pytest.fixture(scope="module")
+def encoder():
+    tree, _ = hierarchy.icd9(as_networkx=False)
+    return CodeEncoder(tree)
+
+
+@pytest.mark.unit
+def test_normalize():
+    assert normalize(["E1032", "e10.32", " E10.32 ", "v09.0"]).tolist() == ["E1032", "E1032", "E1032", "V090"]
+    assert normalize(np.array([["a.1"], ["b"]])).shape == (2, 1)
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("code,expected", [("E1032", "E10.32"), ("E10", "E10"), ("E10.32", "E10.32")])
+def test_format_icd10cm(code, expected):
+    assert format_icd10cm(code) == expected
+
+
+@pytest.mark.unit
+def test_encode_and_decode(encoder):
+    tree = encoder.tree
+    codes = ["0010", "001.0", " v09.0", "V090 "]
+    ids = encoder.encode(codes)
+    assert ids.dtype == np.int32
+    assert ids.tolist() == [tree.id_of("0010")] * 2 + [tree.id_of("V090")] * 2
+    assert encoder.decode(ids).tolist() == ["0010", "0010", "V090", "V090"]
+    assert (encoder.encode(pd.Series(codes)) == ids).all()
+
+
+@pytest.mark.unit
+def test_encode_all_codes(encoder):
+    codes = np.array(list(encoder.tree.codes))
+    assert (encoder.encode(codes) == encoder.tree.code_ids).all()
+
+
+@pytest.mark.unit
+def test_unknown_codes(encoder):
+    codes = ["0010", "XYZ", "root", "", "XYZ", "Cholera"]
+    with pytest.raises(KeyError, match="5 codes"):
+        encoder.encode(codes)
+    assert encoder.encode(codes, errors="coerce").tolist()[1:] == [-1] * 5
+    assert encoder.unknown(codes) == {"XYZ": 2, "root": 1, "": 1, "Cholera": 1}
+    assert "001.0" in encoder and "XYZ" not in encoder
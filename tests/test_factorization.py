@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+from icdcodex.factorization import ancestor_matrix, svd_embedding
+
+
+@pytest.mark.unit
+def test_ancestor_matrix(sample_tree):
+    matrix = ancestor_matrix(sample_tree).toarray()
+    node = sample_tree.id_of("0011")
+    expected = [node] + [ancestor for ancestor in sample_tree.ancestors(node) if ancestor != 0]
+    assert sorted(np.flatnonzero(matrix[node]).tolist()) == sorted(expected)
+    assert not matrix[:, 0].any()  # the root is shared by every node
+    np.testing.assert_allclose(np.linalg.norm(matrix[:, 1:], axis=0), 1)
+    np.testing.assert_allclose(ancestor_matrix(sample_tree, alpha=0).toarray(), matrix != 0)
+
+
+@pytest.mark.unit
+def test_svd_embedding(sample_tree):
+    embeddings = svd_embedding(sample_tree, 8, seed=0)
+    assert embeddings.dtype == np.float32 and embeddings.shape == (len(sample_tree), 8)
+    np.testing.assert_array_equal(embeddings, svd_embedding(sample_tree, 8, seed=0))
+    a, b, c = (embeddings[sample_tree.id_of(code)] for code in ("0010", "0011", "V010"))
+    assert np.linalg.norm(a - b) < np.linalg.norm(a - c)  # siblings are closer than cousins
+    padded = svd_embedding(sample_tree, 64, seed=0)
+    assert padded.shape == (len(sample_tree), 64) and not padded[:, len(sample_tree) - 1:].any()
@@ -0,0 +1,74 @@
+import threading
+import pytest
+import networkx as nx
+from icdcodex import hierarchy
+from icdcodex.hierarchy import HierarchyCache
+
+
+@pytest.mark.unit
+def test_lru_eviction_and_statistics():
+    cache = HierarchyCache(maxsize=2)
+    loads = []
+
+    def loader(key):
+        return lambda: loads.append(key) or key
+
+    for key in [("icd10cm", "2019"), ("icd10cm", "2020"), ("icd10cm", "2019"), ("icd10cm", "2021")]:
+        assert cache.get(key, "tree", loader(key)) == key
+    assert cache.info() == (1, 3, 2, 2)
+    cache.get(("icd10cm", "2020"), "tree", loader(("icd10cm", "2020")))  # evicted
+    assert loads == [("icd10cm", "2019"), ("icd10cm", "2020"), ("icd10cm", "2021"), ("icd10cm", "2020")]
+    cache.maxsize = 1
+    assert cache.info().currsize == 1
+    cache.invalidate("icd10cm", "2020")
+    assert cache.info().currsize == 0
+    cache.clear()
+    assert cache.info() == (0, 0, 1, 0)
+
+
+@pytest.mark.unit
+def test_concurrent_misses_load_once():
+    cache = HierarchyCache()
+    barrier = threading.Barrier(8)
+    loads = []
+
+    def load():
+        loads.append(None)
+        return object()
+
+    def get():
+        barrier.wait()
+        results.append(cache.get(("icd9", None), "tree", load))
+
+    results = []
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(loads) == 1
+    assert all(result is results[0] for result in results)
+
+
+@pytest.mark.unit
+def test_icd9_is_cached_and_read_only():
+    hierarchy.cache.clear()
+    G, codes = hierarchy.icd9()
+    H, _ = hierarchy.icd9()
+    assert G is H
+    assert hierarchy.cache.info().hits == 1
+    with pytest.raises(nx.NetworkXError):
+        G.add_node("not a code")
+
+
+@pytest.mark.unit
+def test_networkx_is_built_from_the_cached_tree(monkeypatch):
+    hierarchy.cache.clear()
+    loads = []
+    load_tree = hierarchy._load_tree
+    monkeypatch.setattr(hierarchy, "_load_tree", lambda *args: loads.append(args) or load_tree(*args))
+    tree, _ = hierarchy.icd9(as_networkx=False)
+    G, _ = hierarchy.icd9()
+    assert loads == [("icd9", None)]
+    assert G.number_of_nodes() == len(tree)
+    hierarchy.cache.clear()
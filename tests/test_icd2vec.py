@@ -0,0 +1,239 @@
+import numpy as np
+import pytest
+from icdcodex.icd2vec import Icd2Vec
+
+
+@pytest.mark.unit
+def test_fit_accepts_icd_tree(sample_tree):
+    embedder = Icd2Vec(num_embedding_dimensions=8, workers=1)
+    embedder.fit(sample_tree)
+    assert list(embedder.icd_codes) == list(sample_tree.codes)
+    vecs = embedder.to_vec(["0010", "V010"])
+    assert vecs.shape == (2, 8)
+    assert embedder.to_code(vecs) == ["0010", "V010"]
+
+
+@pytest.mark.unit
+def test_fit_requires_codes_for_graphs(sample_tree):
+    with pytest.raises(ValueError):
+        Icd2Vec(num_embedding_dimensions=8).fit(sample_tree.to_networkx())
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("walker", ["native", "node2vec"])
+def test_walkers(sample_tree, walker):
+    embedder = Icd2Vec(num_embedding_dimensions=8, directed=False, seed=0, walker=walker)
+    embedder.fit(sample_tree.to_networkx(), list(sample_tree.codes))
+    assert embedder.to_vec(["0010"]).shape == (1, 8)
+
+
+@pytest.mark.unit
+def test_node2vec_arguments_select_node2vec_walker():
+    with pytest.deprecated_call():
+        assert Icd2Vec(weight_key="weight").walker == "node2vec"
+    with pytest.warns(UserWarning, match="ignores"):
+        assert Icd2Vec(walker="native", weight_key="weight").walker == "native"
+    assert Icd2Vec(num_embedding_dimensions=8, workers=1, p=2, q=0.5).walker == "native"
+    with pytest.raises(ValueError):
+        Icd2Vec(walker="deepwalk")
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("corpus", ["stream", "disk"])
+def test_streamed_corpus_matches_memory(sample_tree, tmp_path, corpus):
+    def fit(**kwargs):
+        embedder = Icd2Vec(num_embedding_dimensions=8, directed=False, seed=0, **kwargs)
+        embedder.fit(sample_tree)
+        return embedder.to_vec(embedder.icd_codes)
+
+    streamed = fit(corpus=corpus, temp_folder=str(tmp_path))
+    np.testing.assert_allclose(streamed, fit())
+    assert not list(tmp_path.iterdir())
+
+
+@pytest.fixture(scope="module")
+def embedder(sample_tree):
+    embedder = Icd2Vec(num_embedding_dimensions=8, seed=0)
+    embedder.fit(sample_tree)
+    return embedder
+
+
+@pytest.mark.unit
+def test_embeddings_are_aligned_to_codes(embedder):
+    assert embedder.embeddings.dtype == np.float32
+    assert embedder.embeddings.flags["C_CONTIGUOUS"]
+    assert embedder.embeddings.shape == (len(embedder.icd_codes), 8)
+    for row, code in enumerate(embedder.icd_codes):
+        np.testing.assert_array_equal(embedder.embeddings[row], embedder.node2vec.wv[code])
+
+
+@pytest.mark.unit
+def test_to_vec_accepts_arrays_and_out(embedder):
+    codes = np.array([["0010", "V010"], ["0019", "0010"]])
+    out = np.empty((2, 2, 8), dtype=np.float32)
+    assert embedder.to_vec(codes, out=out) is out
+    np.testing.assert_array_equal(out[1, 1], embedder.embeddings[embedder.code_index["0010"]])
+    np.testing.assert_array_equal(embedder.to_vec(["v01.0"]), embedder.to_vec(["V010"]))
+
+
+@pytest.mark.unit
+def test_unknown_codes(embedder):
+    with pytest.raises(KeyError):
+        embedder.to_vec(["0010", "9999"])
+    vecs = embedder.to_vec(["0010", "9999"], unknown="zeros")
+    assert not vecs[1].any()
+    assert embedder.code_ids(["00109", "0012", "9999"], unknown="parent").tolist() == [
+        embedder.code_index["0010"], -1, -1
+    ]
+    np.testing.assert_array_equal(embedder.ids_to_vec([embedder.code_index["0010"], -1])[1], 0)
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("nearest_neighbors", [False, True])
+def test_save_and_load(embedder, tmp_path, nearest_neighbors):
+    embedder.save(tmp_path / "model", nearest_neighbors=nearest_neighbors)
+    loaded = Icd2Vec.load(tmp_path / "model")
+    assert loaded.node2vec is None
+    assert not loaded.embeddings.flags["WRITEABLE"]  # memory-mapped
+    assert loaded.get_params() == embedder.get_params()
+    assert loaded.hierarchy_meta == {"revision": "icd9"}
+    assert list(loaded.icd_codes) == list(embedder.icd_codes)
+    np.testing.assert_array_equal(loaded.to_vec(["0010", "V010"]), embedder.to_vec(["0010", "V010"]))
+    assert loaded.to_code(embedder.to_vec(["0019"])) == ["0019"]
+    assert (tmp_path / "model" / "nn.pkl").exists() == nearest_neighbors
+
+
+@pytest.mark.unit
+def test_save_requires_fit(tmp_path):
+    with pytest.raises(ValueError):
+        Icd2Vec().save(tmp_path)
+
+
+@pytest.mark.unit
+def test_to_code_top_k(embedder):
+    from icdcodex.decoding import ExactIndex
+
+    vecs = embedder.to_vec(["0010", "V010"])
+    codes, scores = embedder.to_code(vecs, k=3, return_scores=True)
+    assert [row[0] for row in codes] == ["0010", "V010"]
+    assert scores.shape == (2, 3) and (np.diff(scores, axis=1) >= 0).all()  # distances, nearest first
+    embedder.index = ExactIndex("cosine").fit(embedder.embeddings)
+    codes, scores = embedder.to_code(vecs, return_scores=True)
+    assert codes == ["0010", "V010"]
+    np.testing.assert_allclose(scores[:, 0], 1, rtol=1e-5)
+    with pytest.raises(ValueError):
+        embedder.index = ExactIndex().fit(embedder.embeddings[:2])
+    embedder.index = ExactIndex("euclidean").fit(embedder.embeddings)
+    with pytest.raises(ValueError, match="fit"):
+        Icd2Vec().index = ExactIndex().fit(embedder.embeddings)
+
+
+@pytest.mark.unit
+def test_decode(embedder, tmp_path):
+    codes = np.array(list(embedder.icd_codes) * 20)
+    vecs = np.lib.format.open_memmap(tmp_path / "vecs.npy", mode="w+", dtype=np.float32, shape=(len(codes), 8))
+    embedder.to_vec(codes, out=vecs)
+    rows = embedder.decode(vecs, chunk_size=16, workers=2)
+    assert rows.dtype == np.int32 and rows.tolist() == embedder.code_ids(codes).tolist()
+    out = np.empty(len(codes), dtype="<U8")
+    scores = np.empty(len(codes), dtype=np.float32)
+    assert embedder.decode(vecs, out=out, scores_out=scores, chunk_size=16) is out
+    assert out.tolist() == codes.tolist()
+    np.testing.assert_allclose(scores, 0, atol=1e-3)
+    top = embedder.decode(vecs[:5], k=2)
+    assert top.shape == (5, 2)
+    streamed = list(embedder.decode_stream(iter(np.array_split(vecs, 3)), chunk_size=50))
+    assert [len(chunk) for chunk in streamed] == [50, 50, 50, 50, 20]
+    assert np.concatenate(streamed).tolist() == codes.tolist()
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_quantize(sample_tree, tmp_path, dtype):
+    model = Icd2Vec(num_embedding_dimensions=8, seed=0)
+    model.fit(sample_tree)
+    codes = list(model.icd_codes)
+    vecs = model.to_vec(codes)
+    report = model.quantization_report(num_queries=100)
+    assert model.quantize(dtype) is model and model.node2vec is None
+    assert model.embeddings.dtype == np.dtype(dtype) and (model.scales is None) == (dtype == "float16")
+    with pytest.raises(ValueError):
+        model.quantization_report()
+    quantized = model.to_vec(codes)
+    assert quantized.dtype == np.float32
+    np.testing.assert_allclose(quantized, vecs, atol=np.abs(vecs).max() / 100)
+    np.testing.assert_allclose(model.to_vec(["0010", "9999"], unknown="zeros")[1], 0)
+    assert model.to_code(vecs) == codes
+    assert report[dtype]["self_accuracy"] == 1
+    model.save(tmp_path / "model")
+    loaded = Icd2Vec.load(tmp_path / "model")
+    assert loaded.embeddings.dtype == np.dtype(dtype)
+    np.testing.assert_array_equal(loaded.to_vec(codes), quantized)
+    assert loaded.to_code(vecs) == codes
+    float32_bytes = (len(codes) + len(model.ancestors)) * 8 * 4
+    assert (tmp_path / "model" / "embeddings.npy").stat().st_size < float32_bytes
+
+
+@pytest.mark.unit
+def test_update_trains_new_codes_only(sample_tree):
+    from icdcodex.decoding import IVFIndex
+
+    G = sample_tree.to_networkx()
+    added = ["0011", "2801"]
+    old = G.copy()
+    old.remove_nodes_from(added)
+    old_codes = [code for code in sample_tree.codes if code not in added]
+    model = Icd2Vec(num_embedding_dimensions=8, directed=False, seed=0)
+    model.fit(old, old_codes)
+    before = model.to_vec(old_codes)
+    model.index = index = IVFIndex(n_lists=4, n_probe=4, metric="euclidean", seed=0).fit(model.embeddings)
+    assert model.update(sample_tree, previous=old) is model
+    assert list(model.icd_codes) == list(sample_tree.codes)
+    np.testing.assert_array_equal(model.to_vec(old_codes), before)  # frozen
+    assert model.index is index and len(index) == len(sample_tree.codes)
+    assert model.to_code(model.to_vec(added)) == added
+    model.update(old, old_codes)  # removed codes are dropped
+    assert list(model.icd_codes) == old_codes
+    with pytest.raises(ValueError):
+        model.quantize("int8").update(sample_tree)
+
+
+@pytest.mark.unit
+def test_svd_method(sample_tree):
+    model = Icd2Vec(num_embedding_dimensions=32, seed=0, method="svd")
+    model.fit(sample_tree)
+    assert model.node2vec is None and model.embeddings.shape == (len(sample_tree.codes), 32)
+    codes = list(model.icd_codes)
+    assert model.to_code(model.to_vec(codes)) == codes
+    again = Icd2Vec(num_embedding_dimensions=32, seed=0, method="svd")
+    again.fit(sample_tree.to_networkx(), codes[::-1])
+    np.testing.assert_array_equal(again.to_vec(codes), model.to_vec(codes))
+    with pytest.raises(ValueError):
+        model.update(sample_tree)
+    with pytest.raises(ValueError):
+        Icd2Vec(method="spectral")
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("method", ["node2vec", "svd"])
+def test_parent_falls_back_to_ancestors(tmp_path, method):
+    import networkx as nx
+
+    G = nx.DiGraph([
+        ("root", "E08-E13"), ("E08-E13", "E10"), ("E10", "E10.1"), ("E10.1", "E10.10"), ("E10.1", "E10.11"),
+        ("E10", "E10.3"), ("E10.3", "E10.32"), ("E10.32", "E10.321"), ("E10.32", "E10.329"),
+    ])
+    codes = ["E10.10", "E10.11", "E10.321", "E10.329"]  # billable leaves only
+    model = Icd2Vec(num_embedding_dimensions=4, seed=0, method=method)
+    model.fit(G, codes)
+    assert set(model.ancestors) >= {"E10", "E10.1", "E10.3", "E10.32"}
+    rows = model.code_ids(["E10.328", "e10.3", "E10.9", "E10.321", "Z00"], unknown="parent")
+    expected = [len(codes) + model.ancestors.index(name) for name in ("E10.32", "E10.3", "E10")]
+    assert rows.tolist() == expected + [2, -1]
+    vecs = model.to_vec(["E10.328", "E10.9"], unknown="parent")
+    assert vecs.any(axis=1).all()
+    model.save(tmp_path / "model")
+    loaded = Icd2Vec.load(tmp_path / "model")
+    assert len(loaded.embeddings) == len(codes) and loaded.ancestors == model.ancestors
+    np.testing.assert_array_equal(loaded.to_vec(["E10.328", "E10.9"], unknown="parent"), vecs)
+    assert set(loaded.to_code(vecs)) <= set(codes)  # decoding only returns codes
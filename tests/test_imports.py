@@ -0,0 +1,41 @@
+import subprocess
+import sys
+import pytest
+
+HEAVY_MODULES = {"networkx", "node2vec", "gensim", "sklearn", "pandas", "untangle", "requests", "multiprocessing"}
+
+
+def loaded_modules(statement):
+    out = subprocess.run(
+        [sys.executable, "-c", f"import sys; {statement}; print('\\n'.join(sys.modules))"],
+        check=True, stdout=subprocess.PIPE, universal_newlines=True,
+    ).stdout
+    return {module.split(".")[0] for module in out.split()}, set(out.split())
+
+
+@pytest.mark.unit
+def test_import_icdcodex_loads_no_submodules():
+    top_level, modules = loaded_modules("import icdcodex")
+    assert not top_level & HEAVY_MODULES
+    assert not {m for m in modules if m.startswith("icdcodex.")}
+
+
+@pytest.mark.unit
+def test_import_hierarchy_loads_only_numpy():
+    top_level, modules = loaded_modules("import icdcodex.hierarchy")
+    assert not top_level & HEAVY_MODULES
+    assert "icdcodex.icd2vec" not in modules
+    assert "icdcodex.datacleaning" not in modules
+
+
+@pytest.mark.unit
+def test_tree_loading_does_not_import_networkx():
+    top_level, _ = loaded_modules("from icdcodex import hierarchy; hierarchy.icd9(as_networkx=False)")
+    assert not top_level & HEAVY_MODULES
+
+
+@pytest.mark.unit
+def test_submodules_are_loaded_on_attribute_access():
+    top_level, modules = loaded_modules("import icdcodex; icdcodex.icd2vec")
+    assert "icdcodex.icd2vec" in modules
+    assert not top_level & {"node2vec", "gensim", "sklearn"}
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from icdcodex.decoding import ExactIndex, IVFIndex
+from icdcodex.quantization import dequantize, quantize, report
+
+
+@pytest.fixture(scope="module")
+def embeddings():
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((20, 16))
+    return (centers[rng.integers(0, 20, 2000)] + 0.3 * rng.standard_normal((2000, 16))).astype(np.float32)
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_roundtrip(embeddings, dtype):
+    values, scales = quantize(embeddings, dtype)
+    assert values.dtype == np.dtype(dtype) and values.flags["C_CONTIGUOUS"]
+    assert (scales is None) == (dtype != "int8")
+    reconstructed = dequantize(values, scales)
+    assert reconstructed.dtype == np.float32
+    # int8 rounds to half a step of each dimension, float16 to about 1e-3 relative
+    tolerance = scales / 2 + 1e-6 if dtype == "int8" else 1e-3 * np.abs(embeddings).max()
+    assert (np.abs(reconstructed - embeddings) <= tolerance).all()
+    out = np.empty_like(embeddings)
+    assert dequantize(values, scales, out=out) is out
+
+
+@pytest.mark.unit
+def test_int8_scales(embeddings):
+    values, scales = quantize(np.c_[embeddings, np.zeros(len(embeddings), dtype=np.float32)])
+    assert np.abs(values).max(axis=0)[:-1].tolist() == [127] * 16
+    assert scales[-1] == 1 and not values[:, -1].any()
+    with pytest.raises(ValueError):
+        quantize(embeddings, "int4")
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+@pytest.mark.parametrize("metric", ["cosine", "euclidean", "dot"])
+def test_quantized_indexes(embeddings, dtype, metric):
+    queries = embeddings[:300] + 0.05 * np.random.default_rng(1).standard_normal((300, 16)).astype(np.float32)
+    expected_scores, expected_rows = ExactIndex(metric).fit(embeddings).search(queries, k=3)
+    values, scales = quantize(embeddings, dtype)
+    for index in (ExactIndex(metric, dtype=dtype), IVFIndex(n_lists=8, n_probe=8, metric=metric, dtype=dtype)):
+        index.fit(values, scales)
+        assert index.vectors.dtype == np.dtype(dtype)
+        scores, rows = index.search(queries, k=3)
+        assert np.mean(rows[:, 0] == expected_rows[:, 0]) > 0.95
+        np.testing.assert_allclose(scores, expected_scores, rtol=0.05, atol=0.05)
+    # embeddings already stored as the index dtype are shared, not copied
+    if metric != "cosine":
+        assert ExactIndex(metric, dtype=dtype).fit(values, scales).vectors is values
+
+
+@pytest.mark.unit
+def test_report(embeddings):
+    results = report(embeddings, num_queries=200)
+    assert list(results) == ["float16", "int8"]
+    assert results["float16"]["compression"] == 2
+    assert 3.9 < results["int8"]["compression"] < 4
+    for result in results.values():
+        assert result["relative_rmse"] < 0.01
+        assert result["self_accuracy"] > 0.99 and result["agreement"] > 0.95
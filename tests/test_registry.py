@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from icdcodex.icd2vec import Icd2Vec
+from icdcodex.registry import EmbeddingRegistry
+
+
+def model(**kwargs):
+    return Icd2Vec(**{"num_embedding_dimensions": 8, "seed": 0, **kwargs})
+
+
+@pytest.mark.unit
+def test_key_depends_on_everything_that_changes_embeddings(tmp_path, sample_tree):
+    registry = EmbeddingRegistry(tmp_path)
+    key = registry.key(model(), sample_tree)
+    assert key == registry.key(model(corpus="stream"), sample_tree)
+    assert key == registry.key(model(workers=-1), sample_tree)
+    assert key == registry.key(model(), sample_tree.to_networkx(), list(sample_tree.codes))
+    assert key != registry.key(model(seed=1), sample_tree)
+    assert key != registry.key(model(), sample_tree, list(sample_tree.codes)[1:])
+    assert key != registry.key(model(), sample_tree, epochs=2)
+    G = sample_tree.to_networkx()
+    G.graph["version"] = "2022"
+    assert key != registry.key(model(), G, list(sample_tree.codes))
+
+
+@pytest.mark.unit
+def test_fit_or_load(tmp_path, sample_tree):
+    registry = EmbeddingRegistry(tmp_path)
+    fitted = model().fit_or_load(sample_tree, registry=registry)
+    assert fitted.node2vec is not None
+    assert len(registry.entries()) == 1
+    cached = model().fit_or_load(sample_tree, registry=registry)
+    assert cached.node2vec is None
+    np.testing.assert_array_equal(cached.embeddings, fitted.embeddings)
+    assert cached.to_code(fitted.to_vec(["0010"])) == ["0010"]
+    assert registry.get(registry.key(model(), sample_tree)).hierarchy_meta == {"revision": "icd9"}
+    assert registry.get("0" * 64) is None
+
+
+@pytest.mark.unit
+def test_evicts_least_recently_used(tmp_path, sample_tree):
+    registry = EmbeddingRegistry(tmp_path, max_bytes=None)
+    for seed in range(3):
+        model(seed=seed).fit_or_load(sample_tree, registry=registry)
+    keys = [registry.key(model(seed=seed), sample_tree) for seed in range(3)]
+    assert [entry.key for entry in registry.entries()] == keys
+    model(seed=0).fit_or_load(sample_tree, registry=registry)  # a hit marks it as used
+    assert registry.entries()[-1].key == keys[0]
+    size = registry.entries()[0].size
+    assert registry.evict(max_bytes=2 * size) == [keys[1]]
+    assert registry.clear() == [keys[2], keys[0]]
+    assert registry.size() == 0
@@ -0,0 +1,123 @@
+import pytest
+import untangle
+from icdcodex import datacleaning, hierarchy, search
+from icdcodex.search import PrefixIndex, SearchIndex, tokenize
+from icdcodex.tree import IcdTree
+
+sibling_xml = """\
+<ICD10CM.tabular>
+    <chapter>
+        <name>4</name>
+        <desc>Endocrine, nutritional and metabolic diseases (E00-E89)</desc>
+        <section id="E08-E13">
+            <desc>Diabetes mellitus (E08-E13)</desc>
+            <diag>
+                <name>E10.32</name>
+                <desc>Type 1 diabetes mellitus with mild nonproliferative diabetic retinopathy</desc>
+                <sevenChrDef>
+                    <extension char="1">right eye</extension>
+                    <extension char="2">left eye</extension>
+                    <extension char="3">bilateral</extension>
+                    <extension char="9">unspecified eye</extension>
+                </sevenChrDef>
+                <diag>
+                    <name>E10.321</name>
+                    <desc>Type 1 diabetes mellitus with mild nonproliferative diabetic retinopathy with macular edema</desc>
+                </diag>
+            </diag>
+        </section>
+    </chapter>
+</ICD10CM.tabular>"""
+
+
+@pytest.fixture(scope="module")
+def prefix_index():
+    tree, _ = hierarchy.icd9(as_networkx=False)
+    return PrefixIndex(tree)
+
+
+@pytest.mark.unit
+def test_tokenize():
+    assert tokenize("Type 1 diabetes mellitus, with (mild) retinopathy") == [
+        "type", "1", "diabetes", "mellitus", "with", "mild", "retinopathy"
+    ]
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("query", ["001", "00 1", "0.01", " 001"])
+def test_complete_code_prefix(prefix_index, query):
+    completions = prefix_index.complete(query, k=3)
+    assert [code for code, _ in completions] == ["0010", "0011", "0019"]
+    assert completions[0][1] == "Cholera due to vibrio cholerae"
+
+
+@pytest.mark.unit
+def test_complete_description_words(prefix_index):
+    completions = prefix_index.complete("tuberc pulm", k=5)
+    assert completions[0] == ("Pulmonary tuberculosis", None)
+    for name, description in completions:
+        words = tokenize(description or name)
+        assert any(w.startswith("tuberc") for w in words) and any(w.startswith("pulm") for w in words)
+
+
+@pytest.mark.unit
+def test_complete_filters(prefix_index):
+    tree = prefix_index.tree
+    chapter = "Infectious And Parasitic Diseases"
+    completions = prefix_index.complete_ids("c", k=20, billable=True, within=chapter)
+    assert len(completions) == 20
+    root = tree.id_of(chapter)
+    assert all(root < i < root + tree.subtree_sizes[root] for i in completions)
+    assert set(completions) <= set(tree.code_ids)
+    assert prefix_index.complete("qwertyuiop") == []
+    assert prefix_index.complete("") == []
+
+
+@pytest.mark.unit
+def test_save_and_load(prefix_index, tmp_path):
+    prefix_index.save(tmp_path / "icd-9-prefix.bin")
+    loaded = PrefixIndex.load(tmp_path / "icd-9-prefix.bin", prefix_index.tree)
+    for query in ["chol", "v0", "intest inf"]:
+        assert loaded.complete(query) == prefix_index.complete(query)
+
+
+@pytest.fixture(scope="module")
+def search_index():
+    return search.icd9()
+
+
+@pytest.mark.unit
+def test_search_ranks_with_bm25(search_index):
+    results = search_index.search("pulmonary tuberculosis", k=5)
+    assert results[0][0] == "Pulmonary tuberculosis"
+    assert [score for *_, score in results] == sorted((score for *_, score in results), reverse=True)
+    assert search_index.search("qwertyuiop") == []
+
+
+@pytest.mark.unit
+def test_search_batch_and_filters(search_index):
+    queries = ["cholera", "pulmonary tuberculosis", "qwertyuiop"]
+    batch = search_index.search_batch(queries, k=5, billable=True)
+    assert batch == [search_index.search(query, k=5, billable=True) for query in queries]
+    assert all(name in set(search_index.tree.codes) for name, *_ in batch[0] + batch[1])
+    tree = search_index.tree
+    chapter = tree.id_of("Diseases Of The Respiratory System")
+    ids, scores = search_index.search_ids(queries, k=5, within=chapter)
+    assert ids.shape == scores.shape == (3, 5)
+    found = ids[ids != -1]
+    assert len(found) and ((chapter <= found) & (found < chapter + tree.subtree_sizes[chapter])).all()
+    assert (ids[2] == -1).all()
+
+
+@pytest.mark.unit
+@pytest.mark.filterwarnings("ignore: parsing strangeness")
+def test_search_includes_seventh_character_extensions(tmp_path):
+    codes = ["E10.3211", "E10.3212", "E10.3213", "E10.3219"]
+    G, _ = datacleaning.build_icd10_hierarchy(untangle.parse(sibling_xml), codes, prune_extra_codes=False)
+    tree = IcdTree.from_networkx(G, codes)
+    index = SearchIndex(tree)
+    (name, description, _), *_ = index.search("retinopathy macular edema left eye")
+    assert name == "E10.3212"
+    assert description.endswith("left eye")
+    index.save(tmp_path / "search.bin")
+    assert SearchIndex.load(tmp_path / "search.bin", tree).search("bilateral") == index.search("bilateral")
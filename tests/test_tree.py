@@ -0,0 +1,83 @@
+import pytest
+import networkx as nx
+from icdcodex import hierarchy
+from icdcodex.tree import IcdTree
+
+
+@pytest.fixture(scope="module")
+def icd9_graph():
+    return hierarchy.icd9()
+
+
+@pytest.mark.unit
+def test_tree_matches_networkx(icd9_graph):
+    G, codes = icd9_graph
+    tree = IcdTree.from_networkx(G, codes)
+    H = tree.to_networkx()
+    assert set(H.nodes()) == set(G.nodes())
+    assert set(H.edges()) == set(G.edges())
+    assert dict(H.nodes(data="description")) == dict(G.nodes(data="description"))
+    assert list(tree.codes) == list(codes)
+
+
+@pytest.mark.unit
+def test_preorder_subtrees(icd9_graph):
+    G, codes = icd9_graph
+    tree = IcdTree.from_networkx(G, codes)
+    node = tree.id_of("Intestinal Infectious Diseases")
+    subtree = {tree.names[i] for i in range(node, node + tree.subtree_sizes[node])}
+    assert subtree == {"Intestinal Infectious Diseases"} | nx.descendants(G, "Intestinal Infectious Diseases")
+    assert tree.depths[tree.id_of("0010")] == nx.shortest_path_length(G, "root", "0010")
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("mmap", [True, False])
+def test_save_and_load(tmp_path, icd9_graph, mmap):
+    G, codes = icd9_graph
+    tree = IcdTree.from_networkx(G, codes, meta={"revision": "icd9"})
+    tree.save(tmp_path / "icd-9-hierarchy.bin")
+    loaded = IcdTree.load(tmp_path / "icd-9-hierarchy.bin", mmap=mmap)
+    assert loaded.meta == {"revision": "icd9"}
+    assert list(loaded.names) == list(tree.names)
+    assert (loaded.child_ids == tree.child_ids).all()
+    assert loaded.description(loaded.id_of("0010")) == "Cholera due to vibrio cholerae"
+    assert not loaded.parent_ids.flags.writeable
+
+
+@pytest.mark.unit
+def test_unknown_names_and_codes(icd9_graph):
+    G, codes = icd9_graph
+    tree = IcdTree.from_networkx(G, codes)
+    assert "0010" in tree
+    assert "not a code" not in tree
+    with pytest.raises(KeyError):
+        tree.id_of("not a code")
+    with pytest.raises(ValueError, match="not represented"):
+        IcdTree.from_networkx(G, ["not a code"])
+
+
+@pytest.mark.unit
+def test_navigation_matches_networkx(icd9_graph):
+    G, codes = icd9_graph
+    tree = IcdTree.from_networkx(G, codes)
+    node = "Intestinal Infectious Diseases"
+    names = tree.names
+    assert names[tree.parent(node)] == "Infectious And Parasitic Diseases"
+    assert tree.parent("root") == -1
+    assert [names[i] for i in tree.children(node)] == list(G.successors(node))
+    assert [names[i] for i in tree.ancestors("0010")] == ["Cholera", node, "Infectious And Parasitic Diseases", "root"]
+    assert {names[i] for i in tree.subtree(node)} == {node} | nx.descendants(G, node)
+    assert {names[i] for i in tree.leaves(node)} == {n for n in nx.descendants(G, node) if G.out_degree(n) == 0}
+    assert len(tree.leaves()) == sum(1 for n in G if G.out_degree(n) == 0)
+    assert tree.depth("0010") == tree.depth(tree.id_of("0010")) == 4
+    assert {names[i] for i in tree.at_depth(1)} == set(G.successors("root"))
+    assert tree.is_billable.sum() == len(codes)
+
+
+@pytest.mark.unit
+def test_navigation_rejects_unknown_nodes(icd9_graph):
+    tree = IcdTree.from_networkx(*icd9_graph)
+    with pytest.raises(KeyError):
+        tree.children("not a node")
+    with pytest.raises(KeyError):
+        tree.parent(len(tree))
@@ -0,0 +1,69 @@
+import networkx as nx
+import numpy as np
+import pytest
+from icdcodex import datacleaning
+from icdcodex.tree import IcdTree
+from icdcodex.versions import VERSION_INDEX, VersionIndex
+
+RELEASES = {
+    "2019": {"E10.32": "Type 1 diabetes mellitus with retinopathy", "U07.0": "Vaping-related disorder", "Z00.00": "General exam"},
+    "2020": {"E10.32": "Type 1 diabetes mellitus with retinopathy", "U07.0": "Vaping-related disorder", "Z00.00": "General exam"},
+    "2021": {"E10.32": "Type 1 diabetes mellitus with mild retinopathy", "U07.1": "COVID-19", "Z00.00": "General exam"},
+    "2022": {"E10.32": "Type 1 diabetes mellitus with mild retinopathy", "U07.1": "COVID-19", "Z00.00": "General exam"},
+}
+
+
+def release_tree(version):
+    G = nx.DiGraph()
+    for code, description in RELEASES[version].items():
+        G.add_edge("root", code[:3])
+        G.add_edge(code[:3], code)
+        G.nodes[code]["description"] = description
+    return IcdTree.from_networkx(G, sorted(RELEASES[version]), meta={"revision": "icd10cm", "version": version})
+
+
+@pytest.fixture(scope="module")
+def index():
+    return VersionIndex.from_trees({version: release_tree(version) for version in RELEASES})
+
+
+@pytest.mark.unit
+def test_union_of_codes(index):
+    assert index.versions == ["2019", "2020", "2021", "2022"]
+    assert sorted(index.codes) == ["E10.32", "U07.0", "U07.1", "Z00.00"]
+    assert index.valid_in("U07.1") == ["2021", "2022"]
+    assert index.valid_in("A00.0") == []
+
+
+@pytest.mark.unit
+def test_is_valid_over_pairs(index):
+    codes = np.array(["U07.1", "u071", "U07.0", "U07.0", "Z0000", "A00.0", "E10.32"])
+    years = np.array([2020, 2021, 2020, "2021", 2024, 2019, 2018])
+    assert index.is_valid(codes, years).tolist() == [False, True, True, False, False, False, False]
+    assert index.is_valid(["E10.32", "U07.1"], 2022).tolist() == [True, True]
+    assert index.is_valid([["E10.32"], ["U07.0"]], ["2019", "2022"]).shape == (2, 2)
+
+
+@pytest.mark.unit
+def test_changes(index):
+    assert index.changes("2021") == (["U07.1"], ["U07.0"], ["E10.32"])
+    assert index.changes("2022") == ([], [], [])
+    assert index.changes("2022", since="2019") == index.changes("2021")
+    assert index.description("E10.32", "2019") == "Type 1 diabetes mellitus with retinopathy"
+    assert index.description("U07.0", "2022") is None
+    with pytest.raises(ValueError):
+        index.changes("2019")
+    with pytest.raises(ValueError):
+        index.changes("2030")
+
+
+@pytest.mark.unit
+def test_write_version_index(tmp_path, index):
+    for version in RELEASES:
+        release_tree(version).save(tmp_path / f"icd-10-{version}-hierarchy.bin")
+    datacleaning.write_version_index(tmp_path, list(RELEASES) + ["2023"])
+    loaded = VersionIndex.load(tmp_path / VERSION_INDEX)
+    assert loaded.versions == index.versions
+    assert list(loaded.codes) == list(index.codes)
+    assert (loaded.masks == index.masks).all()
+    assert loaded.changes("2021") == index.changes("2021")
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from icdcodex.walks import RandomWalker, WalkCorpus
+
+
+def neighbours(tree, directed):
+    pairs = set()
+    for node in range(len(tree)):
+        for child in tree.children(node):
+            pairs.add((node, child))
+            if not directed:
+                pairs.add((child, node))
+    return pairs
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("directed", [True, False])
+def test_walks_follow_edges(sample_tree, directed):
+    walker = RandomWalker(sample_tree, walk_length=6, num_walks=3, directed=directed, seed=0, block_size=4)
+    walks = walker.walks()
+    assert walks.shape == (len(walker), 6)
+    assert sorted(walks[:, 0].tolist()) == sorted(list(range(len(sample_tree))) * 3)
+    edges = neighbours(sample_tree, directed)
+    for walk in walks:
+        walk = walk[walk != -1].tolist()
+        assert all(step in edges for step in zip(walk, walk[1:]))
+
+
+@pytest.mark.unit
+def test_directed_walks_end_at_leaves(sample_tree):
+    walks = RandomWalker(sample_tree, walk_length=10, num_walks=2, seed=0).walks()
+    lengths = (walks != -1).sum(axis=1)
+    last = walks[np.arange(len(walks)), lengths - 1]
+    assert sample_tree.is_leaf[last].all()
+
+
+@pytest.mark.unit
+def test_walks_are_reproducible_across_workers(sample_tree):
+    walks = RandomWalker(sample_tree, num_walks=4, directed=False, seed=1, block_size=8).walks()
+    parallel = RandomWalker(sample_tree, num_walks=4, directed=False, seed=1, block_size=8, workers=2).walks()
+    np.testing.assert_array_equal(walks, parallel)
+    other = RandomWalker(sample_tree, num_walks=4, directed=False, seed=2, block_size=8).walks()
+    assert not np.array_equal(walks, other)
+
+
+@pytest.mark.unit
+def test_return_parameter_biases_walks(sample_tree):
+    def return_rate(p):
+        walks = RandomWalker(sample_tree, walk_length=3, num_walks=200, p=p, directed=False, seed=0).walks()
+        walks = walks[walks[:, 2] != -1]
+        return np.mean(walks[:, 0] == walks[:, 2])
+
+    assert return_rate(100) < return_rate(1) < return_rate(0.01)
+
+
+@pytest.mark.unit
+def test_sentences_are_node_names(sample_tree):
+    sentences = RandomWalker(sample_tree, num_walks=1, seed=0).sentences()
+    assert len(sentences) == len(sample_tree)
+    names = set(sample_tree.names)
+    assert all(sentence and set(sentence) <= names for sentence in sentences)
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("spill", [False, True])
+def test_corpus_is_restartable(sample_tree, tmp_path, spill):
+    walker = RandomWalker(sample_tree, num_walks=3, directed=False, seed=0, block_size=4)
+    corpus = WalkCorpus(walker, spill=tmp_path / "walks.npy" if spill else None)
+    first, second = list(corpus), list(corpus)
+    assert first == second == walker.sentences()
+    assert len(corpus) == len(first)
+    if spill:
+        np.testing.assert_array_equal(np.load(tmp_path / "walks.npy"), walker.walks())
+
+
+@pytest.mark.unit
+def test_walks_from_given_starts(sample_tree):
+    walker = RandomWalker(sample_tree, walk_length=4, num_walks=3, directed=False, seed=0, starts=[2, 5])
+    walks = walker.walks()
+    assert len(walker) == 6 and sorted(walks[:, 0].tolist()) == [2, 2, 2, 5, 5, 5]